@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+This program calculates the fraction of a star's light that falls within a
+circular aperture without the brute force integration done by
+exposureTimeCalculator.fraction_inside_slow.
+
+fraction_inside evaluates exactly the same 60x60 pixel, 20x20 sub-sample grid
+as fraction_inside_slow, but uses the fact that the gaussian is separable:
+every column of sub-samples inside the aperture is a contiguous run, so its
+sum is a difference of cumulative sums.  fraction_inside_analytic is the
+continuous limit of the same aperture.  Run this file to check both against
+the slow integrator.
+"""
+
+import numpy as np
+
+PIECE = 20          # Pieces to sub-divide pixels into
+MAX_PIX_RAD = 30    # Half width of the pixel grid (pixels)
+FWHM_TO_SIGMA = 2.35
+
+# Largest difference from fraction_inside_slow validate accepts for
+# fraction_inside
+TOLERANCE = 1e-9
+
+# Sub-sample centres of the grid used by fraction_inside_slow, with the star
+# placed at the centre of pixel (0, 0).  The grid runs from -30.5 to 29.5
+# pixels, so there are more sub-samples on the negative side than the positive.
+_BIT = 1.0/PIECE
+_SAMPLES = (np.arange(-(MAX_PIX_RAD + 0.5)*PIECE,
+                      (MAX_PIX_RAD - 0.5)*PIECE) + 0.5)*_BIT
+_N_NEG = int((MAX_PIX_RAD + 0.5)*PIECE)
+_N_POS = int((MAX_PIX_RAD - 0.5)*PIECE)
+_HALF_SAMPLES = (np.arange(_N_NEG) + 0.5)*_BIT
+
+def fraction_inside(FWHM, radius, pixSize):
+    """
+    Figure out what fraction of a star's light falls within the aperture.
+    Gives the same result as fraction_inside_slow (to ~1e-12) in a fraction of
+    the time and works on arrays of FWHM, radius and pixSize.
+    recieves:
+        FWHM     -  Full Width Half Max (arcsec)
+        radius   -  radius of aperture (arcsec)
+        pixSize  -  size of pixel  (arcsec)
+    return:
+        ratio    -  fraction of star's light within aperture
+    """
+
+    # Rescale FWHM and aperture radius into pixels
+    FWHM = np.asarray(FWHM, dtype=float)/pixSize
+    radius = np.asarray(radius, dtype=float)/pixSize
+    FWHM, radius = np.broadcast_arrays(FWHM, radius)
+
+    sigma2 = (FWHM[..., np.newaxis]/FWHM_TO_SIGMA)**2
+    gx = np.exp(-(_SAMPLES*_SAMPLES)/(2.0*sigma2))
+    gy = np.exp(-(_HALF_SAMPLES*_HALF_SAMPLES)/(2.0*sigma2))
+
+    # cumulative[n] is the sum of the n sub-samples closest to y = 0 on one side
+    cumulative = np.concatenate([np.zeros(gy.shape[:-1] + (1,)),
+                                 np.cumsum(gy, axis=-1)], axis=-1)
+
+    # Number of sub-samples on each side of y = 0 inside the aperture,
+    # for every column of sub-samples
+    radius2 = radius[..., np.newaxis]**2
+    half_chord = np.sqrt(np.clip(radius2 - _SAMPLES*_SAMPLES, 0.0, None))
+    count = np.where(radius2 >= _SAMPLES*_SAMPLES,
+                     np.floor(half_chord/_BIT + 0.5), 0).astype(int)
+
+    inside = (np.take_along_axis(cumulative, np.minimum(count, _N_NEG), -1)
+              + np.take_along_axis(cumulative, np.minimum(count, _N_POS), -1))
+    rad_sum = np.sum(gx*inside, axis=-1)
+    all_sum = np.sum(gx, axis=-1)**2
+    return rad_sum/all_sum
+
+def fraction_inside_analytic(FWHM, radius, pixSize):
+    """
+    Fraction of a circular gaussian's light inside a perfectly circular
+    aperture, 1 - exp(-r^2/2sigma^2).  Ignores pixelisation, so it differs from
+    fraction_inside_slow by up to ~1e-2 for apertures a pixel or two across.
+    recieves:
+        FWHM     -  Full Width Half Max (arcsec)
+        radius   -  radius of aperture (arcsec)
+        pixSize  -  size of pixel  (arcsec)
+    return:
+        ratio    -  fraction of star's light within aperture
+    """
+    sigma = np.asarray(FWHM, dtype=float)/FWHM_TO_SIGMA
+    radius = np.asarray(radius, dtype=float)
+    return -np.expm1(-(radius*radius)/(2.0*sigma*sigma))
+
+def validate(nSamples=200, seed=0):
+    """
+    Compares the fast aperture fractions against fraction_inside_slow for
+    random seeing, aperture and pixel sizes.  Raises AssertionError if
+    fraction_inside is off by more than TOLERANCE.
+    Returns dictionary of the largest absolute error of each method
+    """
+    from exposureTimeCalculator import fraction_inside_slow
+
+    rng = np.random.default_rng(seed)
+    fwhms = rng.uniform(0.5, 8.0, nSamples)
+    pixSizes = rng.uniform(0.2, 2.0, nSamples)
+    # Keep the aperture well inside the 30 pixel grid of the slow integrator
+    radii = rng.uniform(0.2, np.minimum(12.0, 25.0*pixSizes))
+
+    slow = np.array([fraction_inside_slow(f, r, p)
+                     for f, r, p in zip(fwhms, radii, pixSizes)])
+    fast = fraction_inside(fwhms, radii, pixSizes)
+    analytic = fraction_inside_analytic(fwhms, radii, pixSizes)
+    errors = {'fraction_inside': np.max(np.abs(fast - slow)),
+              'fraction_inside_analytic': np.max(np.abs(analytic - slow))}
+    assert errors['fraction_inside'] <= TOLERANCE, (
+        "fraction_inside is off by %g" % errors['fraction_inside'])
+    return errors
+
+def main():
+    """
+    Program to check the fast aperture fractions against the slow integrator
+    """
+    for method, error in validate().items():
+        print(method + ":", error)
+
+if __name__ == '__main__':
+    print(main.__doc__)
+    main()
@@ -1,9 +1,69 @@
-from flask import Flask
+import os
+import time
+from flask import Flask, g, request
 
-from starSelectGraphic import main as selectStar
 from createSchedule import writeSchedule
 
 app = Flask(__name__)
 app.config['WTF_CSRF_ENABLED'] = False
 
-from app import routes
\ No newline at end of file
+from app.jobs import BackgroundJob, NightCache
+from app.night import compute_night, compute_observable
+from starCatalog import getCatalog
+from finderChart import FinderChartCache, LocalFetcher
+from artifactStore import ArtifactStore
+from scheduleLibrary import ScheduleLibrary
+from instrumentation import metrics, collector, cacheCollector
+
+#Tonight's altitude curves and maxima, computed once per night in the
+#background and served to the page as JSON, the last ones meanwhile.  Editing
+#the catalog recomputes only the changed stars
+night_data = NightCache(compute_night, version=lambda: getCatalog().version)
+
+#Stars observable tonight, best first, for the star drop down list
+observable_stars = NightCache(compute_observable, name='observable',
+                              version=lambda: getCatalog().version)
+
+#Caches finder charts, set FINDER_CHARTS_OFFLINE=1 to serve the local
+#starField.fits instead of downloading from SkyView
+finder_charts = FinderChartCache(
+    fetcher=LocalFetcher() if os.environ.get('FINDER_CHARTS_OFFLINE') else None)
+
+#Set PREFETCH_FINDER_CHARTS=1 to render every star's finder chart in the
+#background when the app starts
+from prefetchCharts import prefetch, printReport
+
+prefetch_job = BackgroundJob(lambda: printReport(prefetch(cache=finder_charts)),
+                             'prefetch')
+if os.environ.get('PREFETCH_FINDER_CHARTS'):
+    prefetch_job.trigger()
+
+#Schedule files written from the page, which can't be saved anywhere else
+schedule_store = ArtifactStore('./app/static/schedules')
+
+#Index of the schedule files saved so far, to list, check and reuse them
+schedule_library = ScheduleLibrary(schedule_store.directory)
+
+#Hit and miss counts of the app's caches, read when /metrics is requested
+collector(cacheCollector('night_data', night_data))
+collector(cacheCollector('observable_stars', observable_stars))
+collector(cacheCollector('finder_chart', finder_charts))
+collector(cacheCollector('schedule_library', schedule_library))
+
+#Times every request by endpoint for /metrics
+@app.before_request
+def start_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def record_request(response):
+    start = g.pop('request_start', None)
+    if start is not None:
+        endpoint = request.endpoint or 'unknown'
+        metrics.observe('http_request_seconds', time.perf_counter() - start,
+                        endpoint=endpoint)
+        metrics.count('http_requests_total', endpoint=endpoint,
+                      status=response.status_code)
+    return response
+
+from app import routes
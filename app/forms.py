@@ -3,7 +3,7 @@ from wtforms import (StringField, SubmitField, SelectField)
 from wtforms.validators import DataRequired
 
 class ResetImageForm(FlaskForm):
-    submitReset = SubmitField('Reset Image')
+    submitReset = SubmitField('Recompute Night')
 
 class StarSelectForm(FlaskForm):
     select_star = SelectField('Stars')
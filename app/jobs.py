@@ -0,0 +1,157 @@
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+
+class BackgroundJob:
+    """
+    Runs a function in a single background worker thread.
+    Triggering the job while it is already running does nothing, so any
+    number of concurrent requests cause at most one rebuild at a time.
+    """
+
+    def __init__(self, func, name):
+        self.func = func
+        self.name = name
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1,
+                                            thread_name_prefix=name)
+        self._future = None
+        self.state = 'idle'
+        self.started = None
+        self.finished = None
+        self.error = None
+        self.runs = 0
+
+    def running(self):
+        return self._future is not None and not self._future.done()
+
+    def trigger(self):
+        #Starts the job unless it is already running, returns True if started
+        with self._lock:
+            if self.running():
+                return False
+            self.state = 'running'
+            self.started = datetime.now()
+            self._future = self._executor.submit(self._run)
+            return True
+
+    def wait(self, timeout=None):
+        future = self._future
+        if future is not None:
+            future.result(timeout)
+
+    def _run(self):
+        try:
+            self.func()
+        except Exception:
+            self.error = traceback.format_exc()
+            self.state = 'failed'
+            print(self.name + " failed:\n" + self.error)
+        else:
+            self.error = None
+            self.state = 'done'
+        finally:
+            self.finished = datetime.now()
+            self.runs += 1
+
+    def status(self):
+        return {'name': self.name,
+                'state': self.state,
+                'started': self.started.isoformat() if self.started else None,
+                'finished': self.finished.isoformat() if self.finished else None,
+                'error': self.error,
+                'runs': self.runs}
+
+class NightCache:
+    """
+    Holds the result of func(day) for the current night in memory.
+    It goes stale when the date changes, when the value of the optional
+    version() changes (e.g. the catalog was edited) or when reset() is
+    called.  A stale value keeps being served while a BackgroundJob computes
+    the new one, so only the very first get() ever waits for func.
+    """
+
+    def __init__(self, func, name='night', version=None):
+        self.func = func
+        self.name = name
+        self.version = version
+        self._lock = threading.Lock()
+        self.job = BackgroundJob(self._rebuild, name)
+        self.day = None
+        self.key = None
+        self.value = None
+        self.computed = None
+        self.resets = 0
+        self.runs = 0
+        self.hits = 0
+        self.misses = 0
+
+    def _key(self):
+        return (date.today(), self.version() if self.version else None,
+                self.resets)
+
+    def _rebuild(self):
+        #Computes the value until nothing changed while it was computed
+        while True:
+            key = self._key()
+            value = self.func(key[0])
+            with self._lock:
+                self.value = value
+                self.day = key[0]
+                self.key = key
+                self.computed = datetime.now()
+                self.runs += 1
+            if self._key() == key:
+                return
+
+    def fresh(self):
+        return self.value is not None and self.key == self._key()
+
+    def get(self, wait=True):
+        """
+        Returns tonight's result, or the last one while it is recomputed in
+        the background.  When there is none yet it waits for it, or returns
+        None if wait is False
+        """
+        with self._lock:
+            fresh = self.fresh()
+            value = self.value
+            if fresh:
+                self.hits += 1
+            else:
+                self.misses += 1
+        if not fresh:
+            self.job.trigger()
+        if value is None and wait:
+            self.wait()
+            value = self.value
+            if value is None:
+                raise RuntimeError(self.name + " could not be computed:\n"
+                                   + str(self.job.error))
+        return value
+
+    def wait(self, timeout=None):
+        #Waits for a rebuild in progress to finish
+        self.job.wait(timeout)
+
+    def reset(self):
+        #Recomputes the value in the background, serving the old one meanwhile
+        with self._lock:
+            self.resets += 1
+        self.job.trigger()
+
+    def clear(self):
+        #Forgets the value, so the next get() waits for a new one
+        self.wait()
+        with self._lock:
+            self.value = None
+            self.key = None
+
+    def status(self):
+        return {'name': self.name,
+                'day': str(self.day) if self.day else None,
+                'computed': self.computed.isoformat() if self.computed else None,
+                'runs': self.runs,
+                'state': self.job.state,
+                'stale': not self.fresh()}
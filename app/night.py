@@ -0,0 +1,243 @@
+import numpy as np
+from starCatalog import getCatalog, VISIBILITY_COLUMNS, MAXIMA_COLUMNS
+from exposurePlanner import airmass, exposureGrid, snrGrid
+from instrumentation import timed
+from observability import observability
+from riseSet import altitudeAt, visibilityWindows
+from visibilityCache import getVisibilityCache
+
+#Number of steps the night is divided into for the altitude curves
+N_STEPS = 60
+
+#Altitude line drawn on every curve, stars below it all night aren't visible
+MIN_ALTITUDE = 25.0
+
+MINUTES_PER_DAY = 1440.0
+
+#Star entries of the last compute_night by (name, catalog row key)
+_entries = {'day': None, 'stars': {}}
+
+def _minutes(jd, start):
+    #Minutes after the start of the night, rounded to a tenth
+    return np.round((np.asarray(jd, dtype=float) - start)*MINUTES_PER_DAY,
+                    1).tolist()
+
+def _unix_ms(jd):
+    return int(round((jd - 2440587.5)*86400000.0))
+
+@timed('night.compute')
+def compute_night(day):
+    """
+    Computes tonight's altitude curves, maxima and twilight for every star
+    in the catalog, already rounded into the lists the JSON API returns.
+    All times are minutes after the start of the night (nautical twilight).
+    The highest altitude, the intervals above MIN_ALTITUDE and the altitude
+    at each maximum are exact (riseSet) rather than read off the curve
+    """
+    catalog = getCatalog()
+    data = getVisibilityCache(N_STEPS).nightData(day, catalog)
+    times = data['times']
+    start = times[0]
+    ephemeris = data['ephemeris']
+
+    starIndex = data['starIndex']
+    maxima_alt = np.round(altitudeAt(catalog.ra[starIndex],
+                                     catalog.dec[starIndex], data['jd']), 1)
+    maxima = [[] for i in range(len(catalog))]
+    altitudes = [[] for i in range(len(catalog))]
+    for i, minutes, alt in zip(starIndex, _minutes(data['jd'], start),
+                               maxima_alt.tolist()):
+        maxima[i].append(minutes)
+        altitudes[i].append(alt)
+
+    #Stars whose name, position, epoch and period are unchanged since the
+    #last call for the same night keep their entries, which hold their maxima
+    if _entries['day'] != data['day']:
+        _entries['day'] = data['day']
+        _entries['stars'] = {}
+    previous = _entries['stars']
+    keys = catalog.rowKeys(VISIBILITY_COLUMNS + MAXIMA_COLUMNS)
+    names = [(str(catalog.name[i]), keys[i]) for i in range(len(catalog))]
+    new = np.array([i for i, key in enumerate(names) if key not in previous],
+                   dtype=int)
+
+    #Intervals above the line of the new stars
+    found = visibilityWindows(catalog.ra[new], catalog.dec[new], start,
+                              times[-1], MIN_ALTITUDE)
+    alt = np.round(data['alt'], 1)
+
+    entries = {}
+    stars = []
+    for j, i in enumerate(new):
+        windows = [[a, b] for a, b in zip(_minutes(found['start'][j], start),
+                                          _minutes(found['stop'][j], start))
+                   if not np.isnan(a)]
+        entries[names[i]] = {'name': names[i][0],
+                             'max_alt': round(float(found['maxAlt'][j]), 1),
+                             'alt': alt[i].tolist(),
+                             'maxima': maxima[i],
+                             'maxima_alt': altitudes[i],
+                             'windows': windows}
+    for key in names:
+        star = entries.get(key)
+        if star is None:
+            star = previous[key]
+            entries[key] = star
+        stars.append(star)
+    _entries['stars'] = entries
+
+    night = {'day': data['day'],
+             'start': _unix_ms(start),
+             'times': _minutes(times, start),
+             'events': {event: (_minutes(jd, start)
+                                if np.isfinite(jd) else None)
+                        for event, jd in ephemeris.items()
+                        if event != 'lstMidnight'},
+             'min_altitude': MIN_ALTITUDE,
+             'count': len(stars)}
+    return {'night': night, 'stars': stars}
+
+@timed('night.observable')
+def compute_observable(day):
+    """
+    Choices of the star drop down list for tonight, the observable stars of
+    the catalog best first as (name, label) pairs.  The label gives the
+    time (UTC) and altitude of the star's highest maximum above
+    MIN_ALTITUDE, or how long it is above it and how high it gets
+    """
+    catalog = getCatalog()
+    result = observability(day, minAltitude=MIN_ALTITUDE, catalog=catalog)
+    ranked = result['ranked']
+    minutes = np.round(np.mod(result['bestMax'][ranked] + 0.5, 1.0)
+                       *MINUTES_PER_DAY)
+    choices = []
+    for row, minute in zip(ranked, minutes):
+        name = str(catalog.name[row])
+        alt = result['bestAlt'][row]
+        if result['maxima'][row]:
+            minute = int(minute) % int(MINUTES_PER_DAY)
+            label = '%s (max %02d:%02d at %.0f\u00b0)' % (name, minute//60,
+                                                        minute % 60, alt)
+        else:
+            label = '%s (up %.1f h, %.0f\u00b0)' % (name, result['hours'][row],
+                                                  alt)
+        choices.append((name, label))
+    return choices
+
+def reset_night():
+    #Forgets every star's stored curve and entry, so the next compute_night
+    #computes the whole catalog again
+    getVisibilityCache(N_STEPS).reset()
+    _entries['day'] = None
+    _entries['stars'] = {}
+
+def select_stars(stars, visible=False, with_maxima=False,
+                 min_altitude=MIN_ALTITUDE, query=None):
+    #Filters the stars of compute_night by visibility, maxima or name
+    chosen = stars
+    if visible:
+        chosen = [star for star in chosen if star['max_alt'] >= min_altitude]
+    if with_maxima:
+        chosen = [star for star in chosen if star['maxima']]
+    if query:
+        query = query.replace(' ', '').lower()
+        chosen = [star for star in chosen
+                  if query in star['name'].replace(' ', '').lower()]
+    return chosen
+
+def paginate(items, page, per_page):
+    #Returns one page of items with the paging information
+    pages = max(1, -(-len(items)//per_page))
+    page = min(max(page, 1), pages)
+    return {'total': len(items),
+            'page': page,
+            'per_page': per_page,
+            'pages': pages,
+            'items': items[(page - 1)*per_page:page*per_page]}
+
+def find_star(data, name):
+    #Returns the stars entry of compute_night for a star name, None if the
+    #star isn't in it
+    row = getCatalog().find(name)
+    stars = data['stars']
+    if row is None or row >= len(stars):
+        return None
+    star = stars[row]
+    if star['name'].replace(' ', '').lower() != name.replace(' ', '').lower():
+        return None
+    return star
+
+def observing_altitude(data, name, min_altitude=MIN_ALTITUDE):
+    #Altitude of a star at its first maximum tonight above min_altitude, or
+    #when it is highest if there is none.  None if it doesn't rise tonight.
+    #Without tonight's data (None, or missing the star) only that star is
+    #computed
+    star = None if data is None else find_star(data, name)
+    if star is None:
+        return star_observing_altitude(name, min_altitude=min_altitude)
+    for alt in star['maxima_alt']:
+        if alt >= min_altitude:
+            return alt
+    if star['max_alt'] <= 0:
+        return None
+    return star['max_alt']
+
+def star_observing_altitude(name, day=None, min_altitude=MIN_ALTITUDE):
+    #observing_altitude of one catalog star for the night beginning on day
+    #(default tonight), from its own rise, set and maxima only
+    from starSelectGraphic import observatory, nightWindow, predictMaxima
+    catalog = getCatalog()
+    row = catalog.find(name)
+    if row is None:
+        return None
+    rows = [row]
+    loc, obs = observatory()
+    start, stop = nightWindow(obs, day)
+    found = visibilityWindows(catalog.ra[rows], catalog.dec[rows], start.jd,
+                              stop.jd, min_altitude, refine=False)
+    star_index, jd, missing = predictMaxima(catalog.epoch[rows],
+                                            catalog.period[rows], start.jd,
+                                            stop.jd)
+    maxima_alt = altitudeAt(catalog.ra[rows][star_index],
+                            catalog.dec[rows][star_index], jd)
+    for alt in np.round(maxima_alt, 1):
+        if alt >= min_altitude:
+            return float(alt)
+    max_alt = round(float(found['maxAlt'][0]), 1)
+    if max_alt <= 0:
+        return None
+    return max_alt
+
+def _nulls(values, decimals):
+    #Rounded list with None instead of NaN, for JSON
+    values = np.round(values, decimals)
+    return [None if np.isnan(v) else float(v) for v in values]
+
+def exposure_curves(data, name, filters, snr=1000.0,
+                    min_altitude=MIN_ALTITUDE):
+    """
+    Exposure times of every filter along a star's track tonight, the
+    shortest of them and the signal to noise ratio those shortest exposures
+    reach along the track.  None if the star isn't in the catalog
+    """
+    star = find_star(data, name)
+    if star is None:
+        return None
+    mag = getCatalog().lookup(name)['minMag']
+    alt = np.array([star['alt']])
+    exposure = exposureGrid(filters, [mag], alt, min_altitude, SNR=snr)[0]
+    usable = np.isfinite(exposure).any(axis=1)
+    best = np.where(usable, np.nanmin(np.where(np.isfinite(exposure),
+                                               exposure, np.inf), axis=1),
+                    np.nan)
+    curves = snrGrid(filters, [mag], alt, best[np.newaxis, :],
+                     min_altitude)[0]
+    return {'name': star['name'],
+            'filters': filters,
+            'snr_target': snr,
+            'airmass': _nulls(airmass(alt[0]), 3),
+            'exposure': {f: _nulls(exposure[i], 0)
+                         for i, f in enumerate(filters)},
+            'best': {f: (None if np.isnan(best[i]) else round(float(best[i])))
+                     for i, f in enumerate(filters)},
+            'snr': {f: _nulls(curves[i], 0) for i, f in enumerate(filters)}}
@@ -1,30 +1,27 @@
-from flask import render_template, request
-from app import app, selectStar, writeSchedule
+from flask import render_template, request, jsonify, Response
+from app import (app, night_data, observable_stars, finder_charts,
+                 schedule_store, schedule_library, writeSchedule)
+from app.night import (reset_night, select_stars, paginate,
+                       observing_altitude, exposure_curves, MIN_ALTITUDE)
 from app.forms import ScheduleForm, StarSelectForm, ResetImageForm
-from exposureTimeCalculator import expose
-import pandas as pd
+from exposureTimeCalculator import expose, VALID_FILTERS
+from exposurePlanner import airmass, filterList
+from createSchedule import batchSchedules, streamZip
+from scheduleLibrary import parseAngle, checkFile
+from nameResolver import formatRA, formatDec
+from starCatalog import getCatalog, getStarList
+from instrumentation import metrics, timer
 import os
-import aplpy
-from datetime import datetime
-from astroquery.skyview import SkyView
-from astropy import units as u
+from math import isnan
 
 @app.route('/', methods=['GET', 'POST'])
 def index():
-    #Renders up-to-date star selection graphic
-    try:
-        #If the image is over 5 hours old, regenerates it
-        if (datetime.now().timestamp()
-            - os.path.getmtime('./app/static/plot.png') > 18000):
-            selectStar()
-    except: #If image doesn't exist, creates it
-        selectStar()
-    
     starField = ''
     
-    #Imports list of stars
-    star_list = pd.read_csv('app/static/StarList.txt', sep="\t")
-    star_list = star_list.values.flatten().tolist()
+    #Stars observable tonight, best first.  They are ranked in the background,
+    #so the whole star list is offered until they first are or if none are
+    with timer('index.star_list'):
+        star_list = observable_stars.get(wait=False) or getStarList()
     
     #Creates forms
     sched_form = ScheduleForm()
@@ -36,11 +33,12 @@ def index():
     
     #Creates list of default values to send to form after new star is selected
     defaults = []
-    path = [[]]
     
     if reset_form.submitReset.data and reset_form.validate():
-        selectStar()
-        print("Star selection graphic reset")
+        reset_night()
+        night_data.reset()
+        observable_stars.reset()
+        print("Night data recomputing")
     
     #If a star was just selected run this:
     if star_form.submitStar.data and star_form.validate():
@@ -48,29 +46,32 @@ def index():
         selected_star = request.form.get('select_star')
         selected_filters = request.form.get('select_filters')
         
-        #Imports star info from our data file on all possible stars
-        data_file_name = './app/static/PVMS_RR_Lyrae_Candidates.csv'
-        data_file = open(data_file_name)
-        df = pd.read_csv(data_file)
-        data_file.close()
+        #Looks up the selected star in our catalog of all possible stars
+        with timer('index.lookup'):
+            star = getCatalog().lookup(selected_star)
+        RA = star['ra']
+        DE = star['dec']
+        mag = star['minMag']
         
-        #Generates relevant information for just the selected star
-        select_star_df = df.where(df["Name"] == (selected_star + ' ')).dropna()
-        RA = select_star_df["RA (deg)"].values[0]
-        DE = select_star_df["DE (deg)"].values[0]
-        mag = select_star_df["Min I"].values[0]
+        #Exposure times are for the star's airmass at its maximum tonight, or
+        #when it is highest, rather than a fixed airmass.  Tonight's data is
+        #only used if it is ready, otherwise just this star is computed
+        with timer('index.airmass'):
+            alt = observing_altitude(night_data.get(wait=False), selected_star)
+            star_airmass = 1.77 if alt is None else float(airmass(alt))
         
         #Generates string of exposure times for default value in form
         duration = ""
         filterstring = ""
-        for individual_filter in selected_filters.split(','):
-            #Checks if each filter is part of our list of valid filters
-            if individual_filter in ["B", "V", "R", "I", "H", "U"]:
-                time = round(expose(individual_filter,mag))
-                duration += str(time) + ","
-                filterstring += str(individual_filter)
-            else:
-                print("Invalid filter chosen: " + individual_filter)
+        with timer('index.expose'):
+            for individual_filter in selected_filters.split(','):
+                #Checks if each filter is part of our list of valid filters
+                if individual_filter in VALID_FILTERS:
+                    time = round(expose(individual_filter,mag,star_airmass))
+                    duration += str(time) + ","
+                    filterstring += str(individual_filter)
+                else:
+                    print("Invalid filter chosen: " + individual_filter)
         
         #Removes final trailing comma on duration string
         if len(duration) > 0:
@@ -81,22 +82,18 @@ def index():
                         + selected_star.replace(' ','')
                         + '_' + filterstring + '.sch')
         defaults.append(selected_star)
-        defaults.append(RA)
-        defaults.append(DE)
+        #Schedules take RA in hours and Dec in degrees, as 'hh:mm:ss' and
+        #'+dd:mm:ss' like createSchedule writes them
+        defaults.append(str(formatRA(RA)))
+        defaults.append(str(formatDec(DE)))
         defaults.append(selected_filters)
         defaults.append(duration)
         
-        #Gets fits data for star field around selected object
-        path = SkyView.get_images(position=str(RA) + ' ' + str(DE),
-                                  survey=['DSS'], pixels=500,
-                                  height=20*u.arcmin, width=20*u.arcmin)
-        
-        #Saves fits data to png file
-        gc = aplpy.FITSFigure(path[0][0])
-        gc.show_grayscale()
-        gc.save('app/static/starField.png')
-        gc.close()
-        starField = '/static/starField.png'
+        #Gets the finder chart for the star field around the selected object,
+        #only downloading and rendering it if it isn't cached yet
+        with timer('index.finder_chart'):
+            chart = finder_charts.get_chart(RA, DE)
+        starField = '/static/finderCharts/' + os.path.basename(chart)
     
     #If sched_form has been submitted, creates schedule file
     if sched_form.submitSched.data and sched_form.validate():
@@ -106,12 +103,128 @@ def index():
                   sched_form.binning.data, sched_form.subimage.data, sched_form.priority.data,
                   sched_form.compress.data, sched_form.imagedir.data, sched_form.ccdcalib.data,
                   sched_form.shutter.data, sched_form.repeat.data]
-        writeSchedule(sched_form.fileName.data, inputs)
-        print("Schedule file written")
+        #Schedules are only ever written into app/static/schedules, whatever
+        #directory the file name asks for
+        try:
+            path = schedule_store.path(os.path.basename(sched_form.fileName.data))
+        except ValueError:
+            print("Invalid schedule file name: " + sched_form.fileName.data)
+        else:
+            with timer('index.write_schedule'):
+                writeSchedule(path, inputs)
+            print("Schedule file written")
+            #Reads it back as the schedule library will
+            for problem in checkFile(path):
+                print("Schedule file problem: " + problem)
     
     #Renders page
-    return render_template('graph.html', starSelectGraphic='/static/plot.png',
-                           starField = starField,
-                           sched_form=sched_form, reset_form=reset_form,
-                           star_form=star_form, star_list=star_list,
-                           defaults=defaults)
\ No newline at end of file
+    with timer('index.render'):
+        return render_template('graph.html', starField = starField,
+                               sched_form=sched_form, reset_form=reset_form,
+                               star_form=star_form, star_list=star_list,
+                               defaults=defaults)
+
+@app.route('/api/night')
+def api_night():
+    #Tonight's twilight times and the times of the altitude curves, in
+    #minutes after the start of the night, and the state of their background
+    #recomputation for the page to poll
+    night = dict(night_data.get()['night'])
+    night['status'] = night_data.status()
+    return jsonify(night)
+
+@app.route('/api/stars')
+def api_stars():
+    #One page of altitude curves and maxima, e.g.
+    #/api/stars?page=2&per_page=24&visible=1&maxima=1&q=cas
+    try:
+        page = int(request.args.get('page', 1))
+        per_page = min(max(int(request.args.get('per_page', 50)), 1), 500)
+        min_altitude = float(request.args.get('min_altitude', MIN_ALTITUDE))
+    except ValueError:
+        return jsonify({'error': 'page, per_page and min_altitude must be numbers'}), 400
+    stars = select_stars(night_data.get()['stars'],
+                         visible=bool(request.args.get('visible')),
+                         with_maxima=bool(request.args.get('maxima')),
+                         min_altitude=min_altitude,
+                         query=request.args.get('q'))
+    result = paginate(stars, page, per_page)
+    result['stars'] = result.pop('items')
+    return jsonify(result)
+
+@app.route('/api/stars/<name>')
+def api_star(name):
+    #Altitude curve and maxima of one star
+    stars = select_stars(night_data.get()['stars'], query=name)
+    for star in stars:
+        if star['name'].replace(' ', '').lower() == name.replace(' ', '').lower():
+            return jsonify(star)
+    return jsonify({'error': name + ' is not in the catalog'}), 404
+
+@app.route('/api/stars/<name>/exposure')
+def api_star_exposure(name):
+    #Exposure times along the star's track tonight and the signal to noise
+    #the shortest of them reach, e.g. /api/stars/XX And/exposure?filters=B,V
+    filters = filterList(request.args.get('filters', 'B,V,R,I,H'))
+    try:
+        snr = float(request.args.get('snr', 1000.0))
+    except ValueError:
+        return jsonify({'error': 'snr must be a number'}), 400
+    curves = exposure_curves(night_data.get(), name, filters, snr)
+    if curves is None:
+        return jsonify({'error': name + ' is not in the catalog'}), 404
+    return jsonify(curves)
+
+@app.route('/api/schedules')
+def api_schedules():
+    #One page of the saved schedule files and the problems found in them, e.g.
+    #/api/schedules?q=and&filters=B,V&lst=20:00-02:00&invalid=1
+    #/api/schedules?ra=19.36&dec=38.95&radius=0.5
+    try:
+        page = int(request.args.get('page', 1))
+        per_page = min(max(int(request.args.get('per_page', 50)), 1), 500)
+        near = None
+        if 'ra' in request.args and 'dec' in request.args:
+            near = (float(request.args['ra']), float(request.args['dec']))
+        radius = float(request.args.get('radius', 1.0))
+    except ValueError:
+        return jsonify({'error': 'page, per_page, ra, dec and radius must be numbers'}), 400
+    lst_range = None
+    if request.args.get('lst'):
+        lst_range = tuple(parseAngle(t) for t in request.args['lst'].split('-', 1))
+        if len(lst_range) != 2 or any(isnan(t) for t in lst_range):
+            return jsonify({'error': 'lst must be a range like 20:00-02:00'}), 400
+    invalid = request.args.get('invalid')
+    schedules = schedule_library.refresh().query(
+        source=request.args.get('q'), filters=request.args.get('filters'),
+        near=near, radius=radius, lstRange=lst_range,
+        invalid=None if invalid is None else invalid not in ('0', ''))
+    result = paginate(schedules, page, per_page)
+    result['schedules'] = result.pop('items')
+    return jsonify(result)
+
+@app.route('/api/schedules/duplicates')
+def api_schedule_duplicates():
+    #Groups of saved files holding the same schedule
+    return jsonify({'duplicates': schedule_library.refresh().duplicates()})
+
+@app.route('/schedules.zip')
+def schedules_zip():
+    #Streams a zip of the schedule files of every star visible tonight,
+    #e.g. /schedules.zip?filters=B,V,R&observer=Clem&all=1
+    filters = request.args.get('filters', 'B,V,R,I,H')
+    visible_only = not request.args.get('all')
+    fields = {field: request.args[field] for field in
+              ['title', 'observer', 'epoch', 'lststart', 'binning', 'subimage',
+               'priority', 'compress', 'imagedir', 'ccdcalib', 'shutter',
+               'repeat'] if field in request.args}
+    schedules = batchSchedules(filters, visibleOnly=visible_only, **fields)
+    return Response(streamZip(schedules), mimetype='application/zip',
+                    headers={'Content-Disposition':
+                             'attachment; filename=schedules.zip'})
+
+@app.route('/metrics')
+def prometheus_metrics():
+    #Timers and counters in the Prometheus text format, for scraping
+    return Response(metrics.prometheus(),
+                    mimetype='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+This program writes the files the app and the other programs produce (finder
+charts, plots, schedules and cache tables) so that several processes can
+share them, e.g. the app running under several gunicorn workers.
+
+Files are written to a temporary file in the same directory and renamed over
+the final name, so nobody ever sees a half-written file.  Files that are
+expensive to make are regenerated under a lock file shared by every process,
+so only one process makes them and the others wait and then use its result.
+Where fcntl isn't available (Windows) the lock only holds within a process.
+"""
+
+import contextlib
+import hashlib
+import os
+import tempfile
+import threading
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Threads of one process wait on these before locking the file, since a
+# process can't wait on a lock file it holds itself
+_threadLocks = {}
+_threadLocksLock = threading.Lock()
+
+@contextlib.contextmanager
+def fileLock(path):
+    """
+    Holds an exclusive lock on path + '.lock' across every thread and
+    process until the with block ends
+    """
+    lockPath = path + '.lock'
+    with _threadLocksLock:
+        lock = _threadLocks.setdefault(os.path.abspath(lockPath),
+                                       threading.Lock())
+    with lock:
+        if fcntl is None:
+            yield
+            return
+        with open(lockPath, 'a') as file:
+            fcntl.flock(file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(file, fcntl.LOCK_UN)
+
+# Deletes the lock file of path, e.g. once path itself is deleted.  Writes
+# are atomic, so at worst a process that still had the old lock file open
+# builds the same file a second time
+def removeLock(path):
+    lockPath = path + '.lock'
+    with _threadLocksLock:
+        _threadLocks.pop(os.path.abspath(lockPath), None)
+    with contextlib.suppress(FileNotFoundError):
+        os.remove(lockPath)
+
+@contextlib.contextmanager
+def atomicPath(path):
+    """
+    Gives a temporary file name next to path to write to, and renames it
+    over path when the with block ends without an error
+    """
+    directory, name = os.path.split(os.path.abspath(path))
+    handle, temp = tempfile.mkstemp(prefix='.' + name + '.', suffix='.part',
+                                    dir=directory)
+    os.close(handle)
+    try:
+        yield temp
+        os.chmod(temp, 0o644)
+        os.replace(temp, path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(temp)
+        raise
+
+@contextlib.contextmanager
+def atomicWrite(path, binary=False):
+    """
+    Opens a temporary file to write path's contents to, which replaces path
+    when the with block ends without an error
+    """
+    with atomicPath(path) as temp:
+        with open(temp, 'wb' if binary else 'w') as file:
+            yield file
+
+# Returns a file name made from the hash of data, so equal contents always
+# get the same name and different contents never do
+def contentName(data, suffix=''):
+    if isinstance(data, str):
+        data = data.encode()
+    return hashlib.sha1(data).hexdigest()[:20] + suffix
+
+class ArtifactStore:
+    """
+    A directory of files that are written atomically and built at most once
+    at a time across processes
+    """
+
+    def __init__(self, directory):
+        self.directory = os.path.abspath(directory)
+        os.makedirs(self.directory, exist_ok=True)
+
+    def path(self, name):
+        """
+        Returns the path of a file in the store.  Raises ValueError for names
+        that would lead outside of the directory
+        """
+        path = os.path.abspath(os.path.join(self.directory, name))
+        if os.path.dirname(path) != self.directory:
+            raise ValueError(name + " is not a file name in " + self.directory)
+        return path
+
+    def exists(self, name):
+        return os.path.exists(self.path(name))
+
+    def remove(self, name):
+        """
+        Deletes a file of the store along with its lock file.  Raises OSError
+        if the file can't be deleted
+        """
+        path = self.path(name)
+        os.remove(path)
+        removeLock(path)
+
+    def write(self, name, data):
+        """
+        Writes text or bytes to a file in the store, returns its path
+        """
+        path = self.path(name)
+        with atomicWrite(path, binary=isinstance(data, bytes)) as file:
+            file.write(data)
+        return path
+
+    def build(self, name, builder):
+        """
+        Returns the path of a file in the store, first calling
+        builder(tempPath) to make it if it doesn't exist yet.  When several
+        processes want the same missing file only one builds it.
+        """
+        path = self.path(name)
+        if os.path.exists(path):
+            return path
+        try:
+            with fileLock(path):
+                # Another process may have built it while we waited for the
+                # lock
+                if not os.path.exists(path):
+                    with atomicPath(path) as temp:
+                        builder(temp)
+        except BaseException:
+            # No file is left behind to delete the lock file with
+            removeLock(path)
+            raise
+        return path
@@ -0,0 +1,369 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+This program times the slow paths of the project on synthetic catalogs so a
+change that makes them slower is noticed before an observer waits for it at
+the telescope.
+
+Each benchmark is run for every catalog size asked for.  A synthetic catalog
+of that many stars (random positions, magnitudes, epochs and periods in the
+same csv format as the real one) is written with a matching StarList.txt into
+a scratch copy of the app/static directory, and the benchmarks run from there.
+Finder charts come from the local starField.fits instead of SkyView, so no
+network is needed.  The results are saved as JSON, and two result files can be
+compared to flag slowdowns:
+    python benchmarks.py run --sizes 34,1000,10000 --output new.json
+    python benchmarks.py compare old.json new.json --threshold 1.25
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+LOCAL_FITS_FILE = os.path.join(HERE, 'app', 'static', 'starField.fits')
+
+# Catalogs bigger than this are not drawn by starSelectGraphic.main, whose
+# one subplot per star takes minutes for thousands of stars
+MAX_PLOT_STARS = 400
+
+def syntheticCatalog(size, seed=0):
+    """
+    Returns the csv text of a catalog of size random RR Lyrae stars spread
+    over the sky, with the columns starCatalog reads, and their names
+    """
+    rng = np.random.default_rng(seed)
+    ra = rng.uniform(0.0, 360.0, size)
+    dec = np.degrees(np.arcsin(rng.uniform(-1.0, 1.0, size)))
+    maxMag = rng.uniform(9.0, 15.0, size)
+    minMag = maxMag + rng.uniform(0.3, 1.2, size)
+    period = rng.uniform(0.25, 0.9, size)
+    epoch = rng.uniform(40000.0, 60000.0, size)
+
+    names = ['SYN %05d' % i for i in range(size)]
+    lines = ['Name,RA (deg),DE (deg),Type,Max,Min I,Epoch,Period']
+    for i in range(size):
+        lines.append('%s ,%.8f,%.8f,RRAB,%.2f,%.2f,%.3f,%.7f'
+                     % (names[i], ra[i], dec[i], maxMag[i], minMag[i],
+                        epoch[i], period[i]))
+    return '\n'.join(lines) + '\n', names
+
+def makeProject(size, directory):
+    """
+    Writes a synthetic catalog, star list and local finder chart image into
+    directory/app/static, laid out like the real project
+    """
+    static = os.path.join(directory, 'app', 'static')
+    os.makedirs(os.path.join(static, 'schedules'), exist_ok=True)
+    text, names = syntheticCatalog(size)
+    with open(os.path.join(static, 'PVMS_RR_Lyrae_Candidates.csv'), 'w') as f:
+        f.write(text)
+    with open(os.path.join(static, 'StarList.txt'), 'w') as f:
+        f.write('\n'.join(['Name'] + names) + '\n')
+    shutil.copyfile(LOCAL_FITS_FILE, os.path.join(static, 'starField.fits'))
+    return names
+
+def measure(func, repeat=5, warmup=1):
+    """
+    Times func() repeat times after warmup untimed calls
+    Returns dictionary of min, median, mean and max seconds
+    """
+    for i in range(warmup):
+        func()
+    times = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return {'min': min(times), 'median': float(np.median(times)),
+            'mean': float(np.mean(times)), 'max': max(times),
+            'repeat': repeat}
+
+# =============================================================================
+# Benchmarks.  Each one receives the catalog size and the names of the stars
+# and returns the function to time, or None if it doesn't apply to that size.
+# They run with the scratch project as the working directory.
+# =============================================================================
+
+def benchExpose(size, names):
+    # One scalar expose call per star and filter, as the web app makes them
+    from exposureTimeCalculator import expose
+    from starCatalog import getCatalog
+    mags = getCatalog().minMag[:min(size, 200)]
+    def run():
+        for mag in mags:
+            for f in 'BVRIH':
+                expose(f, mag)
+    return run
+
+def benchExposeBatch(size, names):
+    from exposureTimeCalculator import expose_batch
+    from starCatalog import getCatalog
+    mags = getCatalog().minMag
+    filters = np.array(list('BVRIH'))
+    return lambda: expose_batch(filters[np.newaxis, :], mags[:, np.newaxis])
+
+def benchFractionInsideSlow(size, names):
+    from exposureTimeCalculator import fraction_inside_slow
+    return lambda: fraction_inside_slow(2.5, 3.75, 0.442)
+
+def benchFindTimesOfMaxima(size, names):
+    from astropy.time import Time
+    from starCatalog import getCatalog
+    from starSelectGraphic import findTimesOfMaxima
+    catalog = getCatalog()
+    obj = [catalog.name.tolist(), catalog.period, catalog.epoch]
+    start = Time('2026-10-17 23:00:00')
+    stop = Time('2026-10-18 10:00:00')
+    return lambda: findTimesOfMaxima(obj, start, stop)
+
+def benchNightData(size, names):
+    from starSelectGraphic import nightData
+    return lambda: nightData('2026-10-17', 60)
+
+def benchVisibilityWindows(size, names):
+    # Rise, set and transit of every star between tonight's twilights
+    from riseSet import visibilityWindows
+    from starCatalog import getCatalog
+    from starSelectGraphic import nightWindow, observatory
+    catalog = getCatalog()
+    loc, obs = observatory()
+    startTime, stopTime = nightWindow(obs, '2026-10-17')
+    return lambda: visibilityWindows(catalog.ra, catalog.dec, startTime.jd,
+                                     stopTime.jd)
+
+def benchObservability(size, names):
+    # Ranks every catalog star for the star drop down list
+    from observability import observability
+    return lambda: observability('2026-10-17')
+
+def benchSelectStarPlot(size, names):
+    if size > MAX_PLOT_STARS:
+        return None
+    import starSelectGraphic
+    return starSelectGraphic.main
+
+def _client():
+    from app import app, finder_charts, night_data
+    from finderChart import LocalFetcher
+    finder_charts.fetcher = LocalFetcher(LOCAL_FITS_FILE)
+    finder_charts.directory = os.path.abspath('./app/static/finderCharts')
+    os.makedirs(finder_charts.directory, exist_ok=True)
+    from app.night import reset_night
+    night_data.clear()
+    reset_night()
+    return app.test_client(), night_data
+
+def _check(response):
+    if response.status_code != 200:
+        raise RuntimeError("HTTP %d" % response.status_code)
+    return response
+
+def benchIndexPage(size, names):
+    client, night_data = _client()
+    return lambda: _check(client.get('/'))
+
+def benchNightApiCold(size, names):
+    # Computes tonight's curves of every star and returns the first page
+    client, night_data = _client()
+    from app.night import reset_night
+    def run():
+        night_data.clear()
+        reset_night()
+        _check(client.get('/api/night'))
+        _check(client.get('/api/stars?visible=1&per_page=24'))
+    return run
+
+def benchNightApiEdit(size, names):
+    # Changes one star's period in the catalog file and fetches the curves,
+    # served at once while the background rebuild recomputes only that star
+    client, night_data = _client()
+    _check(client.get('/api/night'))
+    filename = './app/static/PVMS_RR_Lyrae_Candidates.csv'
+    with open(filename) as f:
+        lines = f.read().splitlines()
+    edits = iter(range(10**6))
+    def run():
+        fields = lines[1].split(',')
+        fields[-1] = '%.7f' % (float(fields[-1]) + 1e-7*(next(edits) + 1))
+        with open(filename, 'w') as f:
+            f.write('\n'.join([lines[0], ','.join(fields)] + lines[2:]) + '\n')
+        _check(client.get('/api/stars?visible=1&per_page=24'))
+        night_data.wait()
+    return run
+
+def benchNightApiWarm(size, names):
+    client, night_data = _client()
+    _check(client.get('/api/night'))
+    return lambda: _check(client.get('/api/stars?visible=1&per_page=24&page=2'))
+
+def benchSelectStar(size, names):
+    # Selecting a star whose finder chart is already cached
+    client, night_data = _client()
+    form = {'submitStar': 'Update Template', 'select_star': names[0],
+            'select_filters': 'B,V,R,I,H'}
+    return lambda: _check(client.post('/', data=form))
+
+def benchSelectStarCold(size, names):
+    # Selecting a star whose finder chart has to be fetched and rendered
+    client, night_data = _client()
+    form = {'submitStar': 'Update Template', 'select_star': names[0],
+            'select_filters': 'B,V,R,I,H'}
+    from app import finder_charts
+    def run():
+        shutil.rmtree(finder_charts.directory, ignore_errors=True)
+        os.makedirs(finder_charts.directory)
+        _check(client.post('/', data=form))
+    return run
+
+def benchScheduleZip(size, names):
+    client, night_data = _client()
+    return lambda: _check(client.get('/schedules.zip?filters=B,V,R'))
+
+def benchPhotometryFrame(size, names):
+    # Measures size stars spread over the local finder chart image
+    from photometry import Frame, measureFrame
+    filename = './app/static/starField.fits'
+    with Frame(filename) as frame:
+        ny, nx = frame.data.shape
+        rng = np.random.default_rng(0)
+        x = rng.uniform(0.0, nx - 1.0, size)
+        y = rng.uniform(0.0, ny - 1.0, size)
+        ra, dec = frame.wcs().celestial.all_pix2world(x, y, 0)
+    return lambda: measureFrame(filename, ra, dec)
+
+BENCHMARKS = {
+    'expose': benchExpose,
+    'expose_batch': benchExposeBatch,
+    'fraction_inside_slow': benchFractionInsideSlow,
+    'findTimesOfMaxima': benchFindTimesOfMaxima,
+    'nightData': benchNightData,
+    'visibility_windows': benchVisibilityWindows,
+    'observability': benchObservability,
+    'starSelectGraphic.main': benchSelectStarPlot,
+    'index': benchIndexPage,
+    'api_night_cold': benchNightApiCold,
+    'api_night_edit': benchNightApiEdit,
+    'api_stars_warm': benchNightApiWarm,
+    'select_star': benchSelectStar,
+    'select_star_cold_chart': benchSelectStarCold,
+    'schedules_zip': benchScheduleZip,
+    'photometry_frame': benchPhotometryFrame,
+}
+
+# Benchmarks that don't depend on the catalog, only run for the first size
+CATALOG_INDEPENDENT = {'fraction_inside_slow'}
+
+def run(sizes, names=None, repeat=5):
+    """
+    Runs the benchmarks (default all of them) for every catalog size
+    Returns the results as a dictionary ready to be saved as JSON
+    """
+    names = names or list(BENCHMARKS)
+    results = {name: {} for name in names}
+    home = os.getcwd()
+    sys.path.insert(0, HERE)
+    try:
+        for size in sizes:
+            with tempfile.TemporaryDirectory(prefix='bench') as directory:
+                stars = makeProject(size, directory)
+                os.chdir(directory)
+                for name in names:
+                    if name in CATALOG_INDEPENDENT and size != sizes[0]:
+                        continue
+                    # What the benchmarked code prints would drown the results
+                    with open(os.devnull, 'w') as quiet, \
+                         contextlib.redirect_stdout(quiet):
+                        func = BENCHMARKS[name](size, stars)
+                        if func is None:
+                            continue
+                        result = measure(func, repeat)
+                    results[name][str(size)] = result
+                    print("%-24s %6d stars  median %9.4f s  min %9.4f s"
+                          % (name, size, result['median'], result['min']))
+                os.chdir(home)
+    finally:
+        os.chdir(home)
+    return {'created': datetime.now().isoformat(),
+            'python': platform.python_version(),
+            'machine': platform.platform(),
+            'sizes': sizes,
+            'results': results}
+
+def compare(old, new, threshold=1.25):
+    """
+    Compares the median times of two result files
+    Returns list of (benchmark, size, old s, new s, ratio) and the number of
+    them that got slower by more than threshold times
+    """
+    rows = []
+    slower = 0
+    for name, sizes in new['results'].items():
+        for size, result in sizes.items():
+            before = old['results'].get(name, {}).get(size)
+            if before is None:
+                continue
+            ratio = result['median']/before['median']
+            rows.append((name, size, before['median'], result['median'],
+                         ratio))
+            if ratio > threshold:
+                slower += 1
+    return rows, slower
+
+def main():
+    """
+    Program to benchmark the exposure, ephemeris, plotting and web app paths
+    """
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    runParser = commands.add_parser('run', help='run the benchmarks')
+    runParser.add_argument('--sizes', default='34,1000,10000',
+                           help='comma separated catalog sizes')
+    runParser.add_argument('--only', help='comma separated benchmarks, from '
+                           + ', '.join(BENCHMARKS))
+    runParser.add_argument('--repeat', type=int, default=5)
+    runParser.add_argument('--output', default='benchmarks.json')
+
+    compareParser = commands.add_parser('compare',
+                                        help='compare two result files')
+    compareParser.add_argument('old')
+    compareParser.add_argument('new')
+    compareParser.add_argument('--threshold', type=float, default=1.25,
+                               help='flag benchmarks this many times slower')
+    args = parser.parse_args()
+
+    if args.command == 'run':
+        os.environ.setdefault('MPLBACKEND', 'Agg')
+        sizes = [int(size) for size in args.sizes.split(',')]
+        names = args.only.split(',') if args.only else None
+        results = run(sizes, names, args.repeat)
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=1)
+        print("Saved", args.output)
+        return 0
+
+    with open(args.old) as f:
+        old = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+    rows, slower = compare(old, new, args.threshold)
+    for name, size, before, after, ratio in rows:
+        flag = '  SLOWER' if ratio > args.threshold else ''
+        print("%-24s %6s stars  %9.4f s -> %9.4f s  x%.2f%s"
+              % (name, size, before, after, ratio, flag))
+    print("%d of %d benchmarks more than %.2f times slower"
+          % (slower, len(rows), args.threshold))
+    return 1 if slower else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -4,15 +4,47 @@
 """
 This program generates a schedule file for a night of observations.
 
+batchSchedules builds the schedule of every visible catalog star in one pass,
+with all exposure times from a single expose_batch call, and streamZip packs
+them into a zip archive one file at a time.
+
 Created on Fri Sep 10 10:17:02 2021
 
 @author: Kevin Connors
 """
 
-from astropy import coordinates as coord
-from exposureTimeCalculator import expose
+import io
+import os
+import zipfile
+import numpy as np
+from artifactStore import atomicWrite
+from exposureTimeCalculator import expose, expose_batch, VALID_FILTERS
+from starCatalog import getCatalog
+from instrumentation import timed
+
+# Order of the values in the inputs list given to writeSchedule
+FIELDS = ['title', 'observer', 'source', 'ra', 'dec', 'epoch', 'lststart',
+          'filters', 'duration', 'binning', 'subimage', 'priority', 'compress',
+          'imagedir', 'ccdcalib', 'shutter', 'repeat']
+
+# Site defaults for every field that doesn't depend on the target,
+# the same as the defaults of ScheduleForm
+SCHEDULE_DEFAULTS = {'title': 'object',
+                     'observer': 'Clem',
+                     'epoch': '2000',
+                     'lststart': '14:00:00',
+                     'binning': '1,1',
+                     'subimage': '0,0,3056,3056',
+                     'priority': '0',
+                     'compress': '0',
+                     'imagedir': '/usr/local/telescope/user/images',
+                     'ccdcalib': 'NONE',
+                     'shutter': 'OPEN',
+                     'repeat': '60'}
 
 def main():
+    from nameResolver import getResolver, formatRA, formatDec
+    
     title = 'object'
     observer = 'Clem'
     source = 'CZ Lac'
@@ -20,10 +52,17 @@ def main():
     lststart = '14:00:00'
     mag = 10
     
+    #Finds the position in our catalog, then the resolved names cache, and
+    #only goes to Sesame for names seen for the first time
+    ra, dec, found = getResolver().resolve(source)
+    
+    #Takes the magnitude from our catalog when the source is in it
+    if found == 'catalog':
+        mag = getCatalog().lookup(source)['minMag']
+    
     fileName = source + "_BVRIH.sch"
-    ra,dec = coord.SkyCoord.from_name(source).to_string('hmsdms').split(' ')
-    ra = ra[0:2] + ':' + ra[3:5] + ':' + str(round(float(ra[6:-1])))
-    dec = dec[0:3] + ':' + dec[4:6] + ':' + str(round(float(dec[7:-1])))
+    ra = str(formatRA(ra))
+    dec = str(formatDec(dec))
     exposureTimes = [str(round(expose('B',mag))),
                      str(round(expose('V',mag))),
                      str(round(expose('R',mag))),
@@ -31,11 +70,14 @@ def main():
                      str(round(expose('H',mag)))]
     exposureTimes = ','.join(exposureTimes)
     
-    inputs = [title, observer, source, ra, dec, epoch, lststart, exposureTimes]
+    inputs = scheduleInputs(source, ra, dec, 'B,V,R,I,H', exposureTimes,
+                            title=title, observer=observer, epoch=epoch,
+                            lststart=lststart)
     
     writeSchedule(fileName, inputs)
 
-def writeSchedule(sch_file, inputs):
+def formatSchedule(inputs):
+    #Returns the text of a schedule file
     title = inputs[0]
     observer = inputs[1]
     source = inputs[2]
@@ -54,26 +96,157 @@ def writeSchedule(sch_file, inputs):
     shutter = inputs[15]
     repeat = inputs[16]
     
-    with open(sch_file,'w') as schedule:
-        schedule.write('TITLE    = \'' + title + '\'\n')
-        schedule.write('OBSERVER = \'' + observer + '\'\n')
-        schedule.write('SOURCE   = \'' + source + '\'\n')
-        schedule.write('RA       = \'' + ra + '\'\n')
-        schedule.write('DEC      = \'' + dec + '\'\n')
-        schedule.write('EPOCH    = ' + epoch + '\n')
-        schedule.write('LSTSTART = \'' + lststart + '\'\n')
-        schedule.write('FILTER   = \'' + filters + '\'\n')
-        schedule.write('DURATION = \'' + duration + '\'\n')
-        schedule.write('BINNING  = \'' + binning + '\'\n')
-        schedule.write('SUBIMAGE = \'' + subimage + '\'\n')
-        schedule.write('PRIORITY = ' + priority + '\n')
-        schedule.write('COMPRESS = ' + compress + '\n')
-        schedule.write('IMAGEDIR = \'' + imagedir + '\'\n')
-        schedule.write('CCDCALIB = \'' + ccdcalib + '\'\n')
-        schedule.write('SHUTTER  = \'' + shutter + '\'\n')
-        schedule.write('REPEAT   = ' + repeat + '\n')
-        schedule.write('/\n')
-        
+    schedule = io.StringIO()
+    schedule.write('TITLE    = \'' + title + '\'\n')
+    schedule.write('OBSERVER = \'' + observer + '\'\n')
+    schedule.write('SOURCE   = \'' + source + '\'\n')
+    schedule.write('RA       = \'' + ra + '\'\n')
+    schedule.write('DEC      = \'' + dec + '\'\n')
+    schedule.write('EPOCH    = ' + epoch + '\n')
+    schedule.write('LSTSTART = \'' + lststart + '\'\n')
+    schedule.write('FILTER   = \'' + filters + '\'\n')
+    schedule.write('DURATION = \'' + duration + '\'\n')
+    schedule.write('BINNING  = \'' + binning + '\'\n')
+    schedule.write('SUBIMAGE = \'' + subimage + '\'\n')
+    schedule.write('PRIORITY = ' + priority + '\n')
+    schedule.write('COMPRESS = ' + compress + '\n')
+    schedule.write('IMAGEDIR = \'' + imagedir + '\'\n')
+    schedule.write('CCDCALIB = \'' + ccdcalib + '\'\n')
+    schedule.write('SHUTTER  = \'' + shutter + '\'\n')
+    schedule.write('REPEAT   = ' + repeat + '\n')
+    schedule.write('/\n')
+    return schedule.getvalue()
+
+# Writes a schedule file, atomically so nobody reads it half written
+@timed('writeSchedule')
+def writeSchedule(sch_file, inputs):
+    with atomicWrite(sch_file) as schedule:
+        schedule.write(formatSchedule(inputs))
+
+# Returns the inputs list for writeSchedule, filling every field not given
+# with SCHEDULE_DEFAULTS
+def scheduleInputs(source, ra, dec, filters, duration, **fields):
+    values = dict(SCHEDULE_DEFAULTS)
+    values.update(fields)
+    values.update(source=source, ra=ra, dec=dec, filters=filters,
+                  duration=duration)
+    return [str(values[field]) for field in FIELDS]
+
+# Returns the schedule file name used for a star and set of filters
+def scheduleFileName(source, filters):
+    return source.replace(' ','') + '_' + filters.replace(',','') + '.sch'
+
+def batchSchedules(filters='B,V,R,I,H', names=None, visibleOnly=True,
+                   minAltitude=25, day=None, catalog=None, **fields):
+    """
+    Builds the schedule of many catalog stars at once
+    Recieves:
+        filters      -  Comma separated filters, invalid ones are dropped
+        names        -  Stars to schedule, defaults to the whole catalog
+        visibleOnly  -  Only schedule stars rising above minAltitude (deg)
+                        during the night beginning on day (default tonight)
+        catalog      -  StarCatalog, defaults to getCatalog()
+        fields       -  Values for the other schedule fields, defaults to
+                        SCHEDULE_DEFAULTS
+    
+    Returns:
+        List of (file name, schedule text) in catalog order
+    """
+    if catalog is None:
+        catalog = getCatalog()
+    if names is None:
+        rows = np.arange(len(catalog))
+    else:
+        rows = catalog.findAll(names)
+        for name in np.asarray(names)[rows < 0]:
+            print("Not in catalog: " + str(name))
+        rows = rows[rows >= 0]
+    
+    filterList = [f for f in filters.split(',') if f in VALID_FILTERS]
+    filters = ','.join(filterList)
+    
+    #Stars without a magnitude can't be given exposure times
+    noMag = ~np.isfinite(catalog.minMag[rows])
+    for name in catalog.name[rows[noMag]]:
+        print("No magnitude for " + name + ", skipping")
+    rows = rows[~noMag]
+    
+    if visibleOnly:
+        #Stars outside the declination band reaching minAltitude never need
+        #their altitudes computed
+        from starSelectGraphic import maxAltitudeDuringNight, LATITUDE
+        from skyIndex import riseBand
+        rows = np.intersect1d(rows, catalog.skyIndex().band(
+            *riseBand(LATITUDE, minAltitude)))
+    
+    if visibleOnly and len(rows) > 0:
+        from astropy import coordinates as coord
+        position = coord.SkyCoord(catalog.ra[rows], catalog.dec[rows],
+                                  unit='deg')
+        visible = maxAltitudeDuringNight(position, day) >= minAltitude
+        rows = rows[visible]
+    if len(rows) == 0 or len(filterList) == 0:
+        return []
+    
+    #Exposure times of every star in every filter, in one pass
+    durations = expose_batch(np.array(filterList)[np.newaxis, :],
+                             catalog.minMag[rows][:, np.newaxis])
+    durations = np.round(durations).astype(int)
+    
+    #Catalog positions only, so no star ever goes to the name resolver
+    from nameResolver import formatRA, formatDec
+    ras = formatRA(catalog.ra[rows])
+    decs = formatDec(catalog.dec[rows])
+    
+    schedules = []
+    for i, row in enumerate(rows):
+        source = catalog.name[row]
+        duration = ','.join(str(t) for t in durations[i])
+        inputs = scheduleInputs(source, str(ras[i]), str(decs[i]), filters,
+                                duration, **fields)
+        schedules.append((scheduleFileName(source, filters),
+                          formatSchedule(inputs)))
+    return schedules
+
+# Writes every schedule from batchSchedules into directory, returns the paths
+def writeSchedules(directory, **kwargs):
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for fileName, text in batchSchedules(**kwargs):
+        path = os.path.join(directory, fileName)
+        with atomicWrite(path) as schedule:
+            schedule.write(text)
+        paths.append(path)
+    return paths
+
+class _ZipStream(io.RawIOBase):
+    #Write-only, unseekable buffer that is emptied after every file, so
+    #zipfile writes a streamable archive
+    def __init__(self):
+        self.chunks = []
+    
+    def writable(self):
+        return True
+    
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+    
+    def pop(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+# Yields a zip archive of (file name, text) pairs piece by piece, holding at
+# most one compressed file in memory at a time
+def streamZip(files):
+    stream = _ZipStream()
+    with zipfile.ZipFile(stream, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for fileName, text in files:
+            archive.writestr(fileName, text)
+            yield stream.pop()
+    yield stream.pop()
+
 def DDToDMS(dd):
     mnt,sec = divmod(dd*3600,60)
     deg,mnt = divmod(min,60)
@@ -0,0 +1,267 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+This program keeps a table of the sun's ephemeris for every night at an
+observatory: sunset, sunrise, civil, nautical and astronomical twilight and
+the local sidereal time at local midnight.
+
+These never change for a given site and date, so they are computed once for a
+whole range of dates (astroplan handles all the dates in one call per event),
+saved in a small .npz file per site and afterwards looked up by date in O(1)
+through an array indexed by day.  Looking up a date that isn't in the table
+computes and adds just that night; run this file (e.g. from cron) to fill in
+the coming year ahead of time.
+
+"The night of" a date runs through local midnight at the end of that date:
+evening events are the last ones before it and morning events the first ones
+after it.  At the observatory these are the same events the plots have always
+taken nearest to 23:59:59 UTC, and the convention also holds at sites far
+from its timezone.
+"""
+
+import os
+import threading
+from datetime import date, datetime, timedelta
+import numpy as np
+from artifactStore import atomicWrite, fileLock
+from instrumentation import collector
+
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache')
+
+# Version of the table's contents, saved with it.  Tables saved with another
+# version (or none) are computed again; increase it whenever computeEphemeris
+# changes what it returns for a date
+TABLE_VERSION = 2
+
+# Event columns of the table, all stored as JD
+EVENTS = ['sunset', 'civilEvening', 'nauticalEvening', 'astronomicalEvening',
+          'astronomicalMorning', 'nauticalMorning', 'civilMorning', 'sunrise']
+
+# Returns a datetime.date for a date, 'YYYY-MM-DD' string or None (today)
+def toDate(day):
+    if day is None:
+        return date.today()
+    if isinstance(day, datetime):
+        return day.date()
+    if isinstance(day, date):
+        return day
+    return date.fromisoformat(str(day))
+
+def computeEphemeris(obs, days):
+    """
+    Calculates the ephemeris of many nights at once
+    Recieves:
+        obs   -  astroplan Observer of the site
+        days  -  list of datetime.date
+
+    Returns:
+        Dictionary of arrays, a JD array for each of EVENTS and 'lstMidnight',
+        the local sidereal time (hours) at local midnight
+    """
+    from astropy.time import Time
+    # Local midnight at the end of each day, in the site's timezone
+    midnights = Time([obs.timezone.localize(
+        datetime.combine(day + timedelta(days=1), datetime.min.time()))
+        for day in days])
+    table = {
+        'sunset': obs.sun_set_time(midnights, which='previous'),
+        'civilEvening': obs.twilight_evening_civil(midnights,
+                                                   which='previous'),
+        'nauticalEvening': obs.twilight_evening_nautical(midnights,
+                                                         which='previous'),
+        'astronomicalEvening': obs.twilight_evening_astronomical(
+            midnights, which='previous'),
+        'astronomicalMorning': obs.twilight_morning_astronomical(
+            midnights, which='next'),
+        'nauticalMorning': obs.twilight_morning_nautical(midnights,
+                                                         which='next'),
+        'civilMorning': obs.twilight_morning_civil(midnights, which='next'),
+        'sunrise': obs.sun_rise_time(midnights, which='next')}
+    # Events that don't happen (e.g. no astronomical twilight in summer at
+    # high latitude) come back masked, and are stored as NaN.  A single day
+    # comes back as a scalar
+    table = {event: np.atleast_1d(np.ma.filled(np.ma.asarray(time.jd,
+                                                             dtype=float),
+                                               np.nan))
+             for event, time in table.items()}
+
+    lst = obs.local_sidereal_time(midnights)
+    table['lstMidnight'] = np.atleast_1d(np.asarray(lst.hour, dtype=float))
+    return table
+
+class EphemerisTable:
+    """
+    Ephemeris of many nights at one site, backed by an .npz file.
+    Rows are kept in the order they were computed; _rowOf maps the number of
+    days since the earliest night in the table to a row, -1 where the night
+    isn't in the table.
+    """
+
+    COLUMNS = EVENTS + ['lstMidnight']
+
+    def __init__(self, obs, filename=None):
+        self.obs = obs
+        if filename is None:
+            loc = obs.location
+            filename = os.path.join(CACHE_DIR, 'ephemeris_%.5f_%.5f_%.0f.npz'
+                                    % (loc.lat.deg, loc.lon.deg,
+                                       loc.height.to_value('m')))
+        self.filename = filename
+        self.ordinals = np.array([], dtype=int)
+        self.columns = {column: np.array([]) for column in self.COLUMNS}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.load()
+
+    def __len__(self):
+        return len(self.ordinals)
+
+    def _buildIndex(self):
+        if len(self.ordinals) == 0:
+            self._first = 0
+            self._rowOf = np.array([], dtype=int)
+            return
+        self._first = int(self.ordinals.min())
+        self._rowOf = np.full(int(self.ordinals.max()) - self._first + 1, -1,
+                              dtype=int)
+        self._rowOf[self.ordinals - self._first] = np.arange(len(self.ordinals))
+
+    def _find(self, ordinal):
+        i = ordinal - self._first
+        if 0 <= i < len(self._rowOf):
+            return self._rowOf[i]
+        return -1
+
+    def load(self):
+        try:
+            with np.load(self.filename) as data:
+                if int(data['version']) != TABLE_VERSION:
+                    raise ValueError("Ephemeris table version "
+                                     + str(data['version']))
+                ordinals = data['ordinals']
+                columns = {column: data[column] for column in self.COLUMNS}
+        except (OSError, KeyError, ValueError):
+            ordinals, columns = self.ordinals, self.columns
+        self.ordinals, self.columns = ordinals, columns
+        self._buildIndex()
+
+    def save(self):
+        directory = os.path.dirname(self.filename)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with atomicWrite(self.filename, binary=True) as file:
+            np.savez(file, version=TABLE_VERSION, ordinals=self.ordinals,
+                     **self.columns)
+
+    def _compute(self, days):
+        # Computes the given nights that aren't in the table yet and adds
+        # them to it, returns whether there were any
+        days = [day for day in days if self._find(day.toordinal()) < 0]
+        if not days:
+            return False
+        new = computeEphemeris(self.obs, days)
+        self.ordinals = np.concatenate([self.ordinals,
+                                        [day.toordinal() for day in days]])
+        self.columns = {column: np.concatenate([self.columns[column],
+                                                new[column]])
+                        for column in self.COLUMNS}
+        self._buildIndex()
+        return True
+
+    def _add(self, days):
+        # Computes the given nights, adds them to the table and saves it.
+        # Processes sharing the file take turns, and each first reads the
+        # nights the others saved so none of them are lost or computed twice
+        if all(self._find(day.toordinal()) >= 0 for day in days):
+            return
+        try:
+            directory = os.path.dirname(self.filename)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with fileLock(self.filename):
+                self.load()
+                if self._compute(days):
+                    self.save()
+        except OSError:
+            self._compute(days)
+            print("Could not save ephemeris table to " + self.filename)
+
+    def precompute(self, startDay, stopDay):
+        """
+        Makes sure every night from startDay to stopDay is in the table,
+        computing only the missing ones
+        """
+        startDay, stopDay = toDate(startDay), toDate(stopDay)
+        with self._lock:
+            self._add([startDay + timedelta(days=i)
+                       for i in range((stopDay - startDay).days + 1)])
+
+    def row(self, day):
+        """
+        Returns dictionary of the night beginning on day, JD for each of EVENTS
+        and hours for 'lstMidnight'
+        """
+        day = toDate(day)
+        with self._lock:
+            i = self._find(day.toordinal())
+            if i < 0:
+                self.misses += 1
+                self._add([day])
+                i = self._find(day.toordinal())
+            else:
+                self.hits += 1
+            return {column: float(self.columns[column][i])
+                    for column in self.COLUMNS}
+
+    def nightWindow(self, day=None, twilight='nautical'):
+        """
+        Returns the start and stop of the night beginning on day as astropy
+        Times, between 'civil', 'nautical' or 'astronomical' twilight
+        """
+        from astropy.time import Time
+        row = self.row(day)
+        return (Time(row[twilight + 'Evening'], format='jd'),
+                Time(row[twilight + 'Morning'], format='jd'))
+
+_tables = {}
+_tablesLock = threading.Lock()
+
+# Returns the shared ephemeris table of the site of an astroplan Observer
+def getEphemeris(obs):
+    loc = obs.location
+    key = (loc.lat.deg, loc.lon.deg, loc.height.to_value('m'))
+    with _tablesLock:
+        if key not in _tables:
+            _tables[key] = EphemerisTable(obs)
+        return _tables[key]
+
+@collector
+def _collectTables():
+    # Hit and miss counts of every site's table, for the metrics page
+    with _tablesLock:
+        tables = list(_tables.values())
+    return [('cache_hits_total', 'counter', {'cache': 'ephemeris'},
+             sum(table.hits for table in tables)),
+            ('cache_misses_total', 'counter', {'cache': 'ephemeris'},
+             sum(table.misses for table in tables))]
+
+def main():
+    """
+    Program to precompute the observatory's ephemeris for the coming year
+    """
+    from astropy.time import Time
+    from starSelectGraphic import observatory
+    loc, obs = observatory()
+    table = getEphemeris(obs)
+    today = date.today()
+    table.precompute(today, today + timedelta(days=365))
+    print(len(table), "nights in", table.filename)
+    row = table.row(today)
+    for column in EphemerisTable.COLUMNS[:-1]:
+        print("%-20s %s" % (column, Time(row[column], format='jd').isot))
+    print("%-20s %.4f h" % ('lstMidnight', row['lstMidnight']))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+This program works out exposure times along each star's actual track across
+the night instead of at the fixed airmass of 1.77 exposureTimeCalculator
+assumes.  A star high in the sky is seen through far less atmosphere than one
+near the 25 degree line, so it needs much shorter exposures.
+
+The (star x time) altitude grid from starSelectGraphic is turned into airmass
+and the exposure time of every filter at every grid time is computed in one
+vectorized call of expose_batch.  For exposures of a fixed length, the signal
+to noise reached along the track can be computed the same way.
+"""
+
+import argparse
+import numpy as np
+from exposureTimeCalculator import expose_batch, snr_batch, VALID_FILTERS
+from starCatalog import getCatalog
+
+# Returns the airmass at altitudes (deg) from Kasten & Young (1989), which
+# stays accurate down to the horizon, and NaN below it
+def airmass(alt):
+    alt = np.asarray(alt, dtype=float)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        X = 1.0/(np.sin(np.radians(alt))
+                 + 0.50572*np.power(alt + 6.07995, -1.6364))
+    return np.where(alt > 0.0, X, np.nan)
+
+# Returns the filters of a comma separated list the calculator knows about
+def filterList(filters):
+    if isinstance(filters, str):
+        filters = filters.split(',')
+    return [f.strip() for f in filters if f.strip() in VALID_FILTERS]
+
+def exposureGrid(filters, mags, alt, minAltitude=0.0, **options):
+    """
+    Calculates exposure times along the tracks of many stars at once
+    Recieves:
+        filters      -  List of filter names, length N_filters
+        mags         -  (N_stars,) magnitudes
+        alt          -  (N_stars, N_times) altitudes (deg)
+        minAltitude  -  Altitude (deg) below which no time is given
+        options      -  SNR and the other options of expose_batch, except
+                        airmass
+
+    Returns:
+        (N_stars, N_filters, N_times) exposure times in seconds, NaN where
+        the star is below minAltitude
+    """
+    filters = np.asarray(filters, dtype=str).reshape((1, -1, 1))
+    mags = np.asarray(mags, dtype=float).reshape((-1, 1, 1))
+    alt = np.asarray(alt, dtype=float)
+    X = airmass(np.where(alt >= minAltitude, alt, np.nan))
+    return expose_batch(filters, mags, airmass=X[:, np.newaxis, :], **options)
+
+def snrGrid(filters, mags, alt, exposures, minAltitude=0.0, **options):
+    """
+    Calculates the signal to noise ratio fixed exposures reach along the
+    tracks of many stars
+    Recieves:
+        filters, mags, alt, minAltitude  -  as for exposureGrid
+        exposures    -  (N_stars, N_filters) exposure times (s)
+        options      -  The options of expose_batch, except airmass and SNR
+
+    Returns:
+        (N_stars, N_filters, N_times) signal to noise ratios, NaN where the
+        star is below minAltitude
+    """
+    filters = np.asarray(filters, dtype=str).reshape((1, -1, 1))
+    mags = np.asarray(mags, dtype=float).reshape((-1, 1, 1))
+    exposures = np.asarray(exposures, dtype=float)[:, :, np.newaxis]
+    alt = np.asarray(alt, dtype=float)
+    X = airmass(np.where(alt >= minAltitude, alt, np.nan))
+    return snr_batch(filters, mags, exposures, airmass=X[:, np.newaxis, :],
+                     **options)
+
+def planExposures(day=None, filters='B,V,R,I,H', names=None, nSteps=60,
+                  minAltitude=25.0, catalog=None, **options):
+    """
+    Calculates the exposure times of catalog stars along their tracks during
+    the night beginning on day (default tonight)
+    Recieves:
+        filters      -  Comma separated filters
+        names        -  Star names, defaults to the whole catalog
+        nSteps       -  Number of steps the night is divided into
+        minAltitude  -  Lowest usable altitude (deg)
+        options      -  SNR and the other options of expose_batch
+
+    Returns:
+        Dictionary with the catalog 'rows', the 'filters', the grid 'times'
+        (JD), the 'alt' and 'airmass' (N_stars, N_times), the 'exposure'
+        (N_stars, N_filters, N_times) grid, the shortest exposures 'best'
+        (N_stars, N_filters) with the times they happen 'bestJD', and the
+        'snr' curves of those shortest exposures
+    """
+    from starSelectGraphic import nightData
+    if catalog is None:
+        catalog = getCatalog()
+    filters = filterList(filters)
+    data = nightData(day, nSteps, catalog)
+    if names is None:
+        rows = np.arange(len(catalog))
+    else:
+        rows = catalog.findAll(names)
+        rows = rows[rows >= 0]
+    alt = data['alt'][rows]
+    mags = catalog.minMag[rows]
+
+    exposure = exposureGrid(filters, mags, alt, minAltitude, **options)
+
+    # The shortest exposure of each star and filter is where it's highest,
+    # and how the signal to noise of that exposure falls off away from there
+    usable = np.isfinite(exposure).any(axis=2)
+    bestIndex = np.argmin(np.where(np.isfinite(exposure), exposure, np.inf),
+                          axis=2)
+    best = np.where(usable, np.take_along_axis(
+        exposure, bestIndex[:, :, np.newaxis], axis=2)[:, :, 0], np.nan)
+    bestJD = np.where(usable, data['times'][bestIndex], np.nan)
+    snrOptions = {key: value for key, value in options.items()
+                  if key != 'SNR'}
+    snr = snrGrid(filters, mags, alt, best, minAltitude, **snrOptions)
+
+    return {'rows': rows, 'filters': filters, 'times': data['times'],
+            'alt': alt, 'airmass': airmass(alt), 'exposure': exposure,
+            'best': best, 'bestJD': bestJD, 'snr': snr}
+
+def main():
+    """
+    Program to print tonight's exposure times along a star's track
+    """
+    from astropy.time import Time
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument('stars', nargs='+')
+    parser.add_argument('--day', help='night to plan, defaults to today')
+    parser.add_argument('--filters', default='B,V,R,I,H')
+    parser.add_argument('--steps', type=int, default=12)
+    parser.add_argument('--snr', type=float, default=1000.0)
+    parser.add_argument('--min-altitude', type=float, default=25.0)
+    args = parser.parse_args()
+
+    plan = planExposures(args.day, args.filters, args.stars, args.steps,
+                         args.min_altitude, SNR=args.snr)
+    catalog = getCatalog()
+    for name in args.stars:
+        if catalog.find(name) is None:
+            print(name + " is not in the catalog, skipping")
+    clock = [t[11:16] for t in Time(plan['times'], format='jd').isot]
+    for i, row in enumerate(plan['rows']):
+        print(catalog.name[row])
+        print("  UTC    alt  airmass  " + "".join("%8s" % f
+                                                 for f in plan['filters']))
+        for k in range(len(plan['times'])):
+            times = "".join("%8s" % ('-' if np.isnan(t) else '%.0f' % t)
+                            for t in plan['exposure'][i, :, k])
+            print("  %s %5.1f %7.2f  %s" % (clock[k], plan['alt'][i, k],
+                                            plan['airmass'][i, k], times))
+        print()
+
+if __name__ == '__main__':
+    main()
@@ -10,9 +10,13 @@ Created on Thu Mar 18 11:18:46 2021
 @author: Keith Dabroski
 """
 
+import functools
 import numpy as np
-from numba import jit
-from sympy import symbols, solve
+from apertureFraction import fraction_inside
+from instrumentation import timed
+
+# Filters the calculator knows about
+VALID_FILTERS = ['B', 'V', 'R', 'I', 'H', 'U']
 
 def extinction(Filter):
     """
@@ -81,7 +85,25 @@ def get_qe(Filter):
         qe = -1.0
     return qe
 
-@jit(nopython=True, cache=False)
+def lazy_jit(**options):
+    """
+    Decorator compiling a function with numba the first time it is called
+    rather than when this module is imported, so programs that never call it
+    don't pay for importing numba.  With cache=True the compiled code is
+    saved in __pycache__ and reused by every later process.
+    """
+    def decorate(func):
+        compiled = []
+        @functools.wraps(func)
+        def wrapper(*args):
+            if not compiled:
+                from numba import jit
+                compiled.append(jit(**options)(func))
+            return compiled[0](*args)
+        return wrapper
+    return decorate
+
+@lazy_jit(nopython=True, cache=True)
 def fraction_inside_slow(FWHM,radius,pixSize):
     """
     Figure out what fraction of a star's light falls within the aperture.
@@ -138,72 +160,139 @@ def fraction_inside_slow(FWHM,radius,pixSize):
     return ratio
 
 
-def expose(Filter,mag):
+def _filter_table(filters, lookup):
     """
-    Calculates the desired exposure time
+    Applies one of the per-filter lookup functions above to an array of
+    filter names, calling the lookup once for each distinct filter.
+    Invalid filters are returned as NaN rather than -1.0
+    """
+    
+    names, inverse = np.unique(filters, return_inverse=True)
+    values = np.array([lookup(name) for name in names], dtype=float)
+    values[values < 0] = np.nan
+    return values[inverse].reshape(filters.shape)
+
+def electron_rates(filters, mags, tel_diam=50.0, readNoise=15.78,
+                   pixSize=0.442, sky=19.0, airmass=1.77, FWHM=2.5,
+                   aper_rad=None):
+    """
+    Calculates the electrons collected inside the aperture for many filters
+    and magnitudes at once
     Recieves:
-        Filter  -  The filter
-        mag     -  The magnitude of the star
+        filters   -  Filter name or array of filter names
+        mags      -  Magnitude or array of magnitudes of the stars
+        tel_diam  -  Telescope diameter (cm)
+        readNoise -  Read Noise of CCD (electrons)
+        pixSize   -  Pixel size of CCD (arcsec/pixel)
+        sky       -  Sky brightness (mag/arcsec^2)
+        airmass   -  Airmass of object
+        FWHM      -  Full width half max of object (arcsec)
+        aper_rad  -  Aperture radius (arcsec), defaults to 8 pixels
+    filters, mags, sky and airmass are broadcast against each other
     
     Returns:
-        The exposure Time in seconds
+        Electrons per second from the star and from the sky, and the total
+        read noise electrons (squared) of one readout of the aperture
     """
-    tel_diam = 50.0             # Telescope diameter (cm)
-    qe = get_qe(Filter)         # Overall QE of CCD (0 - 1.0)
-    readNoise = 15.78           # Read Noise of CCD (electrons)
-    pixSize = 0.442             # Pixel size of CCD (arcsec/pixel)
-    sky = 19.0                  # Sky brightness (mag/arcsec^2)
-    airmass = 1.77              # Airmass of object
-    SNR = 1000.0                 # Desired signal to noise ratio
-    FWHM = 2.5                  # Full width half max of object (arcsec)
-    aper_rad = 8.0*pixSize      # Area over with signal is measured (arcsec)
+    if aper_rad is None:
+        aper_rad = 8.0*pixSize
     
-    # Get the extinction coefficient appropriate for filter
-    extinct_coeff = extinction(Filter)
+    filters = np.asarray(filters, dtype=str)
+    mags = np.asarray(mags, dtype=float)
     
-    # Get the number of photons from a mag-zero star per sq cm per sec
-    nphoton = mag_zeropoint(Filter)
+    # Per-filter extinction coefficient, zero point photons and QE
+    extinct_coeff = _filter_table(filters, extinction)
+    nphoton = _filter_table(filters, mag_zeropoint)
+    qe = _filter_table(filters, get_qe)
     
     # Number of pixels inside aperture
     npix = (np.pi*aper_rad*aper_rad)/(pixSize*pixSize)
     
     # Fraction of star's light in aperture
-    fraction = fraction_inside_slow(FWHM, aper_rad, pixSize)
+    fraction = fraction_inside(FWHM, aper_rad, pixSize)
     
+    # Electrons per second collected from a mag-zero source above the atmosphere
+    collected = nphoton*np.pi*tel_diam*tel_diam*0.25*qe
     
-    # Calculate the number of electrons collected on the CCD from star in total per second
-    x = np.power(10.0,-0.4*mag)*nphoton
-    x *= np.pi*tel_diam*tel_diam*0.25
-    x *= qe
-    star_electrons = x
+    # Electrons per second from star inside aperture, after extinction
+    # (not in place, as airmass may broadcast to a bigger shape)
+    star_electrons = (np.power(10.0,-0.4*mags)*collected
+                      *np.power(10.0,-0.4*np.multiply(airmass,extinct_coeff))
+                      *fraction)
     
-    # Decrease the number of electrons per second from star due to extinction
-    x = airmass*extinct_coeff
-    star_electrons *= np.power(10.0,-0.4*x)
+    # Electrons per second from sky inside aperture
+    sky_electrons = (np.power(10.0,-0.4*np.asarray(sky))*collected
+                     *pixSize*pixSize*npix)
     
-    # Calculate the number of electrons collected on the CCD from sky per pixel per second
-    x = np.power(10.0,-0.4*sky)*nphoton
-    x *= np.pi*tel_diam*tel_diam*0.25
-    x *= qe
-    x *= pixSize*pixSize
-    sky_electrons_per_pix = x
+    # Total number of electrons from readout in aperture
+    read_electrons = readNoise*readNoise*npix
     
-    # Total number of electrons per second from star inside aperture
-    star_electrons *= fraction
+    return star_electrons, sky_electrons, read_electrons
+
+@timed('expose_batch')
+def expose_batch(filters, mags, tel_diam=50.0, readNoise=15.78, pixSize=0.442,
+                 sky=19.0, airmass=1.77, SNR=1000.0, FWHM=2.5, aper_rad=None):
+    """
+    Calculates the desired exposure times for many filters and magnitudes
+    at once by solving the signal to noise equation in closed form.
+    Recieves:
+        filters   -  Filter name or array of filter names
+        mags      -  Magnitude or array of magnitudes of the stars
+        tel_diam  -  Telescope diameter (cm)
+        readNoise -  Read noise of the CCD (electrons per pixel)
+        pixSize   -  Pixel size (arcsec)
+        sky       -  Sky brightness (mag per square arcsec)
+        airmass   -  Airmass of the observation
+        SNR       -  Desired signal to noise ratio
+        FWHM      -  Seeing (arcsec)
+        aper_rad  -  Photometry aperture radius (arcsec), as for
+                     electron_rates
+    filters, mags, sky, airmass and SNR are broadcast against each other,
+    so a catalog x filter matrix is e.g. expose_batch(F[None,:], m[:,None])
     
-    # Total number of electrons from sky inside aperture per second
-    sky_electrons = sky_electrons_per_pix*npix
+    Returns:
+        Array of exposure times in seconds, NaN where the filter is invalid
+    """
+    star_electrons, sky_electrons, read_electrons = electron_rates(
+        filters, mags, tel_diam, readNoise, pixSize, sky, airmass, FWHM,
+        aper_rad)
     
-    # Total number of electrons from readout in aperture
-    read_electrons = readNoise*readNoise*npix
+    # SNR = S*t/sqrt(R + (B + S)*t) is the quadratic
+    #   S^2*t^2 - SNR^2*(B + S)*t - SNR^2*R = 0
+    # whose positive root is the exposure time
+    snr2 = np.square(SNR)
+    b = snr2*(sky_electrons + star_electrons)
+    disc = np.sqrt(b*b + 4.0*star_electrons*star_electrons*snr2*read_electrons)
     
-    # Solve signal to noise equation for exposure time
-    t = symbols('t')
-    expr = SNR - ((star_electrons*t)/
-    ((read_electrons + sky_electrons*t + star_electrons*t)**0.5))
+    # Return the exposure times in seconds
+    return (b + disc)/(2.0*star_electrons*star_electrons)
+
+def snr_batch(filters, mags, exposure, tel_diam=50.0, readNoise=15.78,
+              pixSize=0.442, sky=19.0, airmass=1.77, FWHM=2.5, aper_rad=None):
+    """
+    Calculates the signal to noise ratio reached by exposures of the given
+    length (s), for many filters and magnitudes at once.  Takes the same
+    parameters as expose_batch and broadcasts exposure with the others
+    """
+    star_electrons, sky_electrons, read_electrons = electron_rates(
+        filters, mags, tel_diam, readNoise, pixSize, sky, airmass, FWHM,
+        aper_rad)
+    signal = star_electrons*exposure
+    return signal/np.sqrt(read_electrons
+                          + (sky_electrons + star_electrons)*exposure)
+
+def expose(Filter,mag,airmass=1.77):
+    """
+    Calculates the desired exposure time
+    Recieves:
+        Filter  -  The filter
+        mag     -  The magnitude of the star
+        airmass -  Airmass of the star when it is observed
     
-    # Return the exposure time in seconds
-    return solve(expr)[0]
+    Returns:
+        The exposure Time in seconds
+    """
+    return float(expose_batch(Filter, mag, airmass=airmass))
 
 def main():
     """
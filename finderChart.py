@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+This program fetches survey images of the star field around a target and
+renders them as finder charts, keeping both in a local cache.
+
+Images are stored under a key made from (RA, Dec, survey, pixels, field size)
+so a star that was looked at before needs neither a SkyView download nor an
+aplpy render.  Files are written atomically under a lock shared by every
+process, so several app workers can share the cache.  The cache is bounded
+in size and the least recently used files are removed first.  Fetchers are
+plain objects with a fetch method, so LocalFetcher can stand in for SkyView
+in tests and when working offline.
+"""
+
+import hashlib
+import os
+import shutil
+import threading
+from artifactStore import ArtifactStore
+
+# aplpy, astroquery and astropy are imported where they are used, since
+# importing them takes seconds and most requests are answered from the cache
+
+CACHE_DIR = './app/static/finderCharts'
+LOCAL_FITS_FILE = './app/static/starField.fits'
+
+class SkyViewFetcher:
+    """
+    Downloads images from SkyView
+    """
+
+    def fetch(self, ra, dec, survey, pixels, size, filename):
+        from astropy import units as u
+        from astroquery.skyview import SkyView
+        images = SkyView.get_images(position=str(ra) + ' ' + str(dec),
+                                    survey=[survey], pixels=pixels,
+                                    height=size*u.arcmin, width=size*u.arcmin)
+        images[0].writeto(filename, overwrite=True)
+
+class LocalFetcher:
+    """
+    Serves the same local FITS file for every position, for tests and
+    offline runs
+    """
+
+    def __init__(self, filename=LOCAL_FITS_FILE):
+        self.filename = filename
+
+    def fetch(self, ra, dec, survey, pixels, size, filename):
+        shutil.copyfile(self.filename, filename)
+
+class FinderChartCache:
+    """
+    On-disk cache of survey images (FITS) and the finder charts rendered from
+    them (PNG), keyed by (RA, Dec, survey, pixels, field size in arcmin).
+    Whenever the files take up more than max_bytes the least recently used
+    ones are deleted.
+    """
+
+    # matplotlib is not thread safe, so only one chart is rendered at a time
+    _render_lock = threading.Lock()
+
+    def __init__(self, directory=CACHE_DIR, fetcher=None, max_bytes=200e6,
+                 survey='DSS', pixels=500, size=20.0):
+        self.directory = directory
+        self.fetcher = SkyViewFetcher() if fetcher is None else fetcher
+        self.max_bytes = max_bytes
+        self.survey = survey
+        self.pixels = pixels
+        self.size = size
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.store = ArtifactStore(directory)
+
+    def key(self, ra, dec, survey=None, pixels=None, size=None):
+        survey = self.survey if survey is None else survey
+        pixels = self.pixels if pixels is None else pixels
+        size = self.size if size is None else size
+        text = '%.6f %.6f %s %d %g' % (ra, dec, survey, pixels, size)
+        return hashlib.sha1(text.encode()).hexdigest()[:20]
+
+    def fits_path(self, key):
+        return os.path.join(self.directory, key + '.fits')
+
+    def png_path(self, key):
+        return os.path.join(self.directory, key + '.png')
+
+    def _hit(self, path):
+        #Marks a cached file as recently used.  A file that is missing, or
+        #was just evicted by another thread or process, is a miss
+        try:
+            os.utime(path)
+            hit = True
+        except FileNotFoundError:
+            hit = False
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return hit
+
+    def get_fits(self, ra, dec, survey=None, pixels=None, size=None):
+        """
+        Returns the path of the cached FITS image, fetching it if needed
+        """
+        key = self.key(ra, dec, survey, pixels, size)
+        path = self.fits_path(key)
+        if self._hit(path):
+            return path
+
+        def fetch(temp):
+            self.fetcher.fetch(ra, dec,
+                               self.survey if survey is None else survey,
+                               self.pixels if pixels is None else pixels,
+                               self.size if size is None else size, temp)
+
+        #Only one thread of one process downloads each image, the others
+        #wait for it
+        self.store.build(key + '.fits', fetch)
+        self.evict()
+        return path
+
+    def open_fits(self, ra, dec, survey=None, pixels=None, size=None):
+        """
+        Returns the cached image as a memory-mapped HDUList
+        """
+        from astropy.io import fits
+        return fits.open(self.get_fits(ra, dec, survey, pixels, size),
+                         memmap=True)
+
+    def get_chart(self, ra, dec, survey=None, pixels=None, size=None):
+        """
+        Returns the path of the rendered finder chart, fetching and rendering
+        it if needed
+        """
+        key = self.key(ra, dec, survey, pixels, size)
+        path = self.png_path(key)
+        if self._hit(path):
+            return path
+
+        def render(temp):
+            with self.open_fits(ra, dec, survey, pixels, size) as hdus:
+                with self._render_lock:
+                    import aplpy
+                    gc = aplpy.FITSFigure(hdus[0])
+                    gc.show_grayscale()
+                    gc.save(temp, format='png')
+                    gc.close()
+
+        self.store.build(key + '.png', render)
+        self.evict()
+        return path
+
+    def evict(self):
+        """
+        Deletes the least recently used files, and their lock files, until
+        the cache fits in max_bytes
+        """
+        files = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.fits') or name.endswith('.png'):
+                try:
+                    stat = os.stat(os.path.join(self.directory, name))
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, name))
+
+        total = sum(size for mtime, size, name in files)
+        for mtime, size, name in sorted(files):
+            if total <= self.max_bytes:
+                break
+            try:
+                self.store.remove(name)
+            except OSError:
+                continue
+            total -= size
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+This program measures how long the web app and each command line program
+take to import in a fresh interpreter and fails if any of them is over its
+startup budget, so a heavy import creeping back into a module's top level is
+caught before it slows down every page load and every worker start.
+
+Every module is imported several times in a new process and the fastest time
+is kept.  With --verbose the slowest imports underneath it are listed, from
+python -X importtime.
+
+Run it from the top of the project:
+    python importBudget.py
+    python importBudget.py app createSchedule --verbose
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+
+# Budget (s) for importing each module in a fresh interpreter
+BUDGETS = {
+    'app': 1.0,
+    'starSelectGraphic': 0.4,
+    'createSchedule': 0.4,
+    'exposureTimeCalculator': 0.4,
+    'apertureFraction': 0.4,
+    'nightScheduler': 0.4,
+    'prefetchCharts': 0.4,
+    'visibilityEngine': 0.4,
+    'ephemerisCache': 0.4,
+    'finderChart': 0.4,
+    'skyIndex': 0.4,
+    'starCatalog': 0.4,
+    'benchmarks': 0.4,
+    'instrumentation': 0.4,
+    'exposurePlanner': 0.4,
+    'nameResolver': 0.4,
+    'artifactStore': 0.4,
+    'visibilityCache': 0.4,
+    'photometry': 0.4,
+    'riseSet': 0.4,
+    'scheduleLibrary': 0.4,
+    'observability': 0.4,
+}
+
+# Imports the module and prints how long the import took
+TIMER = ("import time; start = time.perf_counter(); import {0}; "
+         "print(time.perf_counter() - start)")
+
+def importTime(module, repeats=3):
+    """
+    Returns the fastest time (s) taken to start a new interpreter and import
+    module, out of repeats tries
+    """
+    env = dict(os.environ, MPLBACKEND='Agg')
+    best = float('inf')
+    for i in range(repeats):
+        out = subprocess.run([sys.executable, '-c', TIMER.format(module)],
+                             capture_output=True, text=True, env=env,
+                             check=True)
+        best = min(best, float(out.stdout.strip().splitlines()[-1]))
+    return best
+
+def slowestImports(module, count=10):
+    """
+    Returns the count slowest (cumulative seconds, package) imports under
+    module, from python -X importtime
+    """
+    env = dict(os.environ, MPLBACKEND='Agg')
+    out = subprocess.run([sys.executable, '-X', 'importtime', '-c',
+                          'import ' + module],
+                         capture_output=True, text=True, env=env, check=True)
+    found = []
+    for line in out.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_us, cumulative, name = line[len('import time:'):].split('|')
+        found.append((int(cumulative)/1e6, name.rstrip()))
+    found.sort(reverse=True)
+    return found[:count]
+
+def main():
+    """
+    Program to check the startup time of the web app and command line programs
+    """
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument('modules', nargs='*',
+                        help='modules to check, defaults to all of them')
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--verbose', action='store_true',
+                        help='list the slowest imports of each module')
+    args = parser.parse_args()
+
+    over = 0
+    for module in args.modules or list(BUDGETS):
+        budget = BUDGETS.get(module, 0.4)
+        seconds = importTime(module, args.repeats)
+        status = 'ok' if seconds <= budget else 'OVER BUDGET'
+        if seconds > budget:
+            over += 1
+        print("%-24s %6.3f s  (budget %.2f s)  %s" % (module, seconds,
+                                                     budget, status))
+        if args.verbose:
+            for cumulative, name in slowestImports(module):
+                print("    %6.3f s  %s" % (cumulative, name))
+    return 1 if over else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+This program keeps timers and counters of what the web app and the programs
+it uses spend their time on, and writes them out in the Prometheus text
+format for the app's /metrics page.
+
+Stages are timed with
+    with timer('index.finder_chart'):
+        ...
+which adds to the count and total seconds of that stage, and events are
+counted with count('name', label=value).  Caches that already keep their own
+hit and miss counts are read through collectors when the metrics are written,
+so they cost nothing while serving requests.  Recording a sample is a
+perf_counter call and a dictionary update under a lock, so it stays on in
+production.
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+# Help text of the metrics written by prometheus()
+HELP = {
+    'stage_seconds': 'Time spent in each stage',
+    'events_total': 'Number of times each event happened',
+    'cache_hits_total': 'Lookups answered from a cache',
+    'cache_misses_total': 'Lookups a cache had to compute or fetch',
+    'http_request_seconds': 'Time spent answering requests, by endpoint',
+    'http_requests_total': 'Requests answered, by endpoint and status',
+}
+
+# Returns a metric's labels as a hashable, sorted tuple
+def labelKey(labels):
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+def formatLabels(key):
+    if not key:
+        return ''
+    escaped = [(name, value.replace('\\', '\\\\').replace('"', '\\"')
+                .replace('\n', '\\n')) for name, value in key]
+    return '{' + ','.join('%s="%s"' % pair for pair in escaped) + '}'
+
+class Metrics:
+    """
+    Counters and timers, each identified by a metric name and its labels.
+    Collectors are functions returning (name, type, labels, value) samples,
+    called when the metrics are written.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {}
+        self.timers = {}
+        self._collectors = []
+
+    def count(self, name, amount=1, **labels):
+        key = (name, labelKey(labels))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def observe(self, name, seconds, **labels):
+        key = (name, labelKey(labels))
+        with self._lock:
+            timer = self.timers.get(key)
+            if timer is None:
+                self.timers[key] = [1, seconds]
+            else:
+                timer[0] += 1
+                timer[1] += seconds
+
+    @contextmanager
+    def timer(self, stage, name='stage_seconds'):
+        # Times the body of a with statement as one run of stage
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, stage=stage)
+
+    def timed(self, stage):
+        # Decorator timing every call of a function as stage
+        def decorate(func):
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    self.observe('stage_seconds', time.perf_counter() - start,
+                                 stage=stage)
+            return wrapper
+        return decorate
+
+    def collector(self, func):
+        self._collectors.append(func)
+        return func
+
+    def seconds(self, stage, name='stage_seconds'):
+        # Returns (count, total seconds) of a stage
+        with self._lock:
+            return tuple(self.timers.get((name, labelKey({'stage': stage})),
+                                         (0, 0.0)))
+
+    def reset(self):
+        with self._lock:
+            self.counters.clear()
+            self.timers.clear()
+
+    def prometheus(self):
+        """
+        Returns every metric in the Prometheus text exposition format
+        """
+        with self._lock:
+            counters = dict(self.counters)
+            timers = {key: list(value) for key, value in self.timers.items()}
+        for collect in list(self._collectors):
+            for name, kind, labels, value in collect():
+                key = (name, labelKey(labels))
+                if kind == 'counter':
+                    counters[key] = counters.get(key, 0) + value
+
+        families = {}
+        for (name, labels), value in counters.items():
+            families.setdefault((name, 'counter'), []).append(
+                name + formatLabels(labels) + ' ' + repr(float(value)))
+        for (name, labels), (n, total) in timers.items():
+            lines = families.setdefault((name, 'summary'), [])
+            lines.append(name + '_count' + formatLabels(labels) + ' ' + str(n))
+            lines.append(name + '_sum' + formatLabels(labels) + ' '
+                         + repr(float(total)))
+
+        out = []
+        for (name, kind), lines in sorted(families.items()):
+            if name in HELP:
+                out.append('# HELP %s %s' % (name, HELP[name]))
+            out.append('# TYPE %s %s' % (name, kind))
+            out.extend(sorted(lines))
+        return '\n'.join(out) + '\n'
+
+# The metrics of this process, shared by every module
+metrics = Metrics()
+count = metrics.count
+timer = metrics.timer
+timed = metrics.timed
+collector = metrics.collector
+
+# Returns the collector of a cache object with hits and misses attributes
+def cacheCollector(name, cache):
+    def collect():
+        return [('cache_hits_total', 'counter', {'cache': name}, cache.hits),
+                ('cache_misses_total', 'counter', {'cache': name},
+                 cache.misses)]
+    return collect
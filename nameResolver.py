@@ -0,0 +1,224 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+This program finds the coordinates of objects by name without going to the
+network whenever it can, and formats coordinates as sexagesimal strings for
+whole arrays at once.
+
+A name is looked up first in the candidate catalog's normalized name index,
+then in a cache file of names resolved before, and only then by a remote
+backend (Sesame through astropy by default).  Whatever the backend finds is
+added to the cache, so each name goes over the network at most once.  The
+backend is any object with a resolve(name) method returning (ra, dec) in
+degrees or raising LookupError, so LocalBackend can replace Sesame in tests
+and offline.
+"""
+
+import json
+import os
+import threading
+import numpy as np
+from artifactStore import atomicWrite, fileLock
+from instrumentation import collector
+from starCatalog import getCatalog, normalizeName
+
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache')
+CACHE_FILE = os.path.join(CACHE_DIR, 'resolvedNames.json')
+
+def sexagesimal(values, precision=0, alwaysSign=False, wrap=None):
+    """
+    Formats many values (hours or degrees) as 'dd:mm:ss' strings at once
+    Recieves:
+        values      -  Array of values
+        precision   -  Number of decimals of the seconds
+        alwaysSign  -  Put a '+' in front of positive values
+        wrap        -  Value that rounds back to zero, e.g. 24 for hours
+
+    Returns:
+        Array of strings.  Values are rounded as a whole before being split,
+        so 59.6 seconds carries into the minutes instead of showing as 60
+    """
+    values = np.asarray(values, dtype=float)
+    if values.size == 0:
+        return np.zeros(values.shape, dtype=str)
+    scale = 10**precision
+    negative = values < 0
+    total = np.rint(np.abs(values)*3600*scale).astype(np.int64)
+    if wrap is not None:
+        total %= int(wrap*3600*scale)
+    whole, fraction = np.divmod(total, scale)
+    units, rest = np.divmod(whole, 3600)
+    minutes, seconds = np.divmod(rest, 60)
+
+    text = np.char.add(np.char.zfill(units.astype(str), 2), ':')
+    text = np.char.add(text, np.char.zfill(minutes.astype(str), 2))
+    text = np.char.add(text, ':')
+    text = np.char.add(text, np.char.zfill(seconds.astype(str), 2))
+    if precision > 0:
+        text = np.char.add(text, '.')
+        text = np.char.add(text, np.char.zfill(fraction.astype(str),
+                                               precision))
+
+    # A value that rounds to zero gets no minus sign
+    sign = np.where(negative & (total > 0), '-', '+' if alwaysSign else '')
+    return np.char.add(sign, text)
+
+# Formats right ascensions (deg) as 'hh:mm:ss'
+def formatRA(ra, precision=0):
+    return sexagesimal(np.mod(ra, 360.0)/15.0, precision, wrap=24)
+
+# Formats declinations (deg) as '+dd:mm:ss'
+def formatDec(dec, precision=0):
+    return sexagesimal(dec, precision, alwaysSign=True)
+
+class SesameBackend:
+    """
+    Resolves names with the CDS Sesame service, through astropy
+    """
+
+    def resolve(self, name):
+        from astropy.coordinates import SkyCoord
+        from astropy.coordinates.name_resolve import NameResolveError
+        try:
+            position = SkyCoord.from_name(name)
+        except NameResolveError as error:
+            raise LookupError(str(error))
+        return float(position.ra.deg), float(position.dec.deg)
+
+class LocalBackend:
+    """
+    Resolves names from a dictionary of name: (ra, dec), for tests and
+    offline runs
+    """
+
+    def __init__(self, positions=None):
+        self.positions = {normalizeName(name): position
+                          for name, position in (positions or {}).items()}
+
+    def resolve(self, name):
+        try:
+            ra, dec = self.positions[normalizeName(name)]
+        except KeyError:
+            raise LookupError(name + " is not known")
+        return float(ra), float(dec)
+
+class NameResolver:
+    """
+    Finds (ra, dec) in degrees of names from the catalog, then the cache
+    file, then the backend.  backend=None never goes to the network.
+    """
+
+    def __init__(self, backend=None, cacheFile=CACHE_FILE, catalogFile=None):
+        self.backend = backend
+        self.cacheFile = cacheFile
+        self.catalogFile = catalogFile
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.sources = {'catalog': 0, 'cache': 0, 'remote': 0}
+        self.cache = self._load()
+
+    def _catalog(self):
+        if self.catalogFile is None:
+            return getCatalog()
+        return getCatalog(self.catalogFile)
+
+    def _load(self):
+        try:
+            with open(self.cacheFile) as file:
+                return {name: tuple(position)
+                        for name, position in json.load(file).items()}
+        except (OSError, ValueError):
+            return {}
+
+    def save(self):
+        # Other processes may have resolved names since the file was read,
+        # so theirs are merged in rather than overwritten
+        directory = os.path.dirname(self.cacheFile)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with fileLock(self.cacheFile):
+            cache = self._load()
+            cache.update(self.cache)
+            self.cache = cache
+            with atomicWrite(self.cacheFile) as file:
+                json.dump(self.cache, file, indent=0, sort_keys=True)
+
+    def resolve(self, name):
+        """
+        Returns (ra, dec, source) of a name, source being 'catalog', 'cache'
+        or 'remote'.  Raises LookupError if it can't be found
+        """
+        ra, dec, sources = self.resolveAll([name])
+        if sources[0] is None:
+            raise LookupError("Could not resolve " + name)
+        return float(ra[0]), float(dec[0]), sources[0]
+
+    def resolveAll(self, names):
+        """
+        Resolves many names at once, the catalog ones in one vectorized
+        lookup.  Returns arrays of ra and dec (NaN where not found) and the
+        list of sources (None where not found)
+        """
+        names = [str(name) for name in names]
+        catalog = self._catalog()
+        rows = catalog.findAll(names)
+        found = rows >= 0
+        ra = np.where(found, catalog.ra[np.maximum(rows, 0)], np.nan)
+        dec = np.where(found, catalog.dec[np.maximum(rows, 0)], np.nan)
+        sources = ['catalog' if f else None for f in found]
+
+        added = False
+        with self._lock:
+            self.sources['catalog'] += int(found.sum())
+            for i in np.flatnonzero(~found):
+                key = normalizeName(names[i])
+                if key in self.cache:
+                    ra[i], dec[i] = self.cache[key]
+                    sources[i] = 'cache'
+                    self.sources['cache'] += 1
+                    continue
+                if self.backend is None:
+                    continue
+                try:
+                    position = self.backend.resolve(names[i])
+                except LookupError:
+                    continue
+                ra[i], dec[i] = position
+                self.cache[key] = tuple(position)
+                sources[i] = 'remote'
+                self.sources['remote'] += 1
+                added = True
+            # Names answered without the backend are hits
+            local = sum(source in ('catalog', 'cache') for source in sources)
+            self.hits += local
+            self.misses += len(names) - local
+            if added:
+                try:
+                    self.save()
+                except OSError:
+                    print("Could not save resolved names to " + self.cacheFile)
+        return ra, dec, sources
+
+_resolver = None
+_resolverLock = threading.Lock()
+
+# Returns the shared resolver, which uses Sesame for names it doesn't know
+# unless NAME_RESOLVER_OFFLINE is set
+def getResolver():
+    global _resolver
+    with _resolverLock:
+        if _resolver is None:
+            offline = os.environ.get('NAME_RESOLVER_OFFLINE')
+            _resolver = NameResolver(None if offline else SesameBackend())
+        return _resolver
+
+@collector
+def _collectResolver():
+    if _resolver is None:
+        return []
+    return [('cache_hits_total', 'counter', {'cache': 'name_resolver'},
+             _resolver.hits),
+            ('cache_misses_total', 'counter', {'cache': 'name_resolver'},
+             _resolver.misses)]
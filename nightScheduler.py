@@ -0,0 +1,317 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+This program builds a night's observing sequence automatically, choosing
+which predicted maxima to observe so that as many as possible are covered.
+
+Every predicted maximum during the night becomes a candidate block running
+from lead minutes before to trail minutes after it, lengthened to at least one
+full filter sequence.  A block is usable if it lies inside the twilight window
+and its star stays above the altitude line (25 deg, as drawn in the plots) for
+the whole block, which planNight checks against the exact times each star
+rises above and sets below the line (riseSet.visibilityWindows) rather than
+an altitude grid.  The usable blocks are then chosen without overlaps either
+greedily (earliest finishing block first, which is optimal when every maximum
+counts the same) or exactly with weighted interval scheduling.  Both are
+O(n log n), so catalogs of thousands of candidates are fine.
+"""
+
+import argparse
+import os
+import numpy as np
+from createSchedule import scheduleInputs, scheduleFileName, writeSchedule
+from exposureTimeCalculator import VALID_FILTERS
+from exposurePlanner import exposureGrid
+from skyIndex import riseBand
+from starCatalog import getCatalog
+
+SECONDS_PER_DAY = 86400.0
+
+def interpolateAltitude(times, alt, rows, jd):
+    """
+    Linearly interpolates the altitude grid of star rows[i] at time jd[i]
+    Recieves:
+        times  -  (N_times,) grid times (JD)
+        alt    -  (N_stars, N_times) altitudes (deg)
+        rows   -  star row of every point
+        jd     -  time of every point (JD)
+    """
+    i = np.clip(np.searchsorted(times, jd) - 1, 0, len(times) - 2)
+    w = (jd - times[i])/(times[i + 1] - times[i])
+    return (1.0 - w)*alt[rows, i] + w*alt[rows, i + 1]
+
+def candidateBlocks(times, alt, starIndex, maxJD, sequence, lead=30.0,
+                    trail=30.0, minAltitude=25.0, windows=None):
+    """
+    Builds the observing block of every predicted maximum and keeps the ones
+    that can be observed
+    Recieves:
+        times        -  (N_times,) grid times (JD) from twilight to twilight
+        alt          -  (N_stars, N_times) altitudes (deg)
+        starIndex    -  star of every maximum
+        maxJD        -  time of every maximum (JD)
+        sequence     -  length of one filter sequence at every maximum (s)
+        lead, trail  -  minutes to observe before and after the maximum
+        minAltitude  -  lowest usable altitude (deg)
+        windows      -  Optional (start, stop), (N_stars, 2) arrays (JD) of
+                        the intervals each star is above minAltitude, NaN
+                        where there is none, as from visibilityWindows.
+                        Used instead of alt, which may then be None
+
+    Returns:
+        Dictionary of arrays 'star', 'max', 'start', 'stop' (JD) of the
+        usable blocks and 'maximum', the index of each block's maximum
+    """
+    starIndex = np.asarray(starIndex, dtype=int)
+    maxJD = np.asarray(maxJD, dtype=float)
+    sequence = np.asarray(sequence, dtype=float)/SECONDS_PER_DAY
+    lead = lead*60.0/SECONDS_PER_DAY
+    trail = trail*60.0/SECONDS_PER_DAY
+
+    # Stretch blocks shorter than one filter sequence evenly about the maximum
+    extra = np.maximum(sequence - (lead + trail), 0.0)/2.0
+    start = maxJD - lead - extra
+    stop = maxJD + trail + extra
+
+    usable = (start >= times[0]) & (stop <= times[-1])
+    usable &= np.isfinite(sequence)
+    if windows is not None:
+        # The block must fit inside one of its star's intervals
+        above = ((windows[0][starIndex] <= start[:, np.newaxis])
+                 & (windows[1][starIndex] >= stop[:, np.newaxis]))
+        usable &= above.any(axis=1)
+    else:
+        usable &= (interpolateAltitude(times, alt, starIndex, start)
+                   >= minAltitude)
+        usable &= (interpolateAltitude(times, alt, starIndex, stop)
+                   >= minAltitude)
+
+        # Every grid point inside the block must be above the line too
+        below = alt < minAltitude
+        belowCount = np.concatenate([np.zeros((alt.shape[0], 1), dtype=int),
+                                     np.cumsum(below, axis=1)], axis=1)
+        first = np.searchsorted(times, start, side='left')
+        last = np.searchsorted(times, stop, side='right')
+        usable &= ((belowCount[starIndex, last]
+                    - belowCount[starIndex, first]) == 0)
+
+    return {'star': starIndex[usable], 'max': maxJD[usable],
+            'start': start[usable], 'stop': stop[usable],
+            'maximum': np.flatnonzero(usable)}
+
+def chooseGreedy(start, stop):
+    """
+    Picks non-overlapping blocks by earliest finish, which maximizes the
+    number of blocks.  Returns the indices of the chosen blocks
+    """
+    chosen = []
+    free = -np.inf
+    for i in np.argsort(stop, kind='stable'):
+        if start[i] >= free:
+            chosen.append(i)
+            free = stop[i]
+    return np.array(chosen, dtype=int)
+
+def chooseExact(start, stop, weight):
+    """
+    Picks non-overlapping blocks with the largest total weight by weighted
+    interval scheduling.  Returns the indices of the chosen blocks
+    """
+    order = np.argsort(stop, kind='stable')
+    start = start[order]
+    stop = stop[order]
+    weight = np.asarray(weight, dtype=float)[order]
+
+    # previous[j] is how many blocks finish before block j starts
+    previous = np.searchsorted(stop, start, side='right')
+    best = np.zeros(len(order) + 1)
+    for j in range(len(order)):
+        best[j + 1] = max(best[j], best[previous[j]] + weight[j])
+
+    # Walk back through the table, taking block j whenever it improved on
+    # the best schedule without it
+    chosen = []
+    j = len(order)
+    while j > 0:
+        if best[previous[j - 1]] + weight[j - 1] > best[j - 1]:
+            chosen.append(order[j - 1])
+            j = previous[j - 1]
+        else:
+            j -= 1
+    return np.array(chosen[::-1], dtype=int)
+
+def scheduleNight(times, alt, starIndex, maxJD, sequence, weights=None,
+                  method='greedy', **blockOptions):
+    """
+    Chooses the sequence of blocks to observe during one night
+    Recieves:
+        times, alt, starIndex, maxJD, sequence  -  as for candidateBlocks
+        weights       -  (N_stars,) value of observing a maximum of each star,
+                         defaults to 1 for every star, only used by 'exact'
+        method        -  'greedy' or 'exact'
+        blockOptions  -  lead, trail, minAltitude and windows for
+                         candidateBlocks
+
+    Returns:
+        Dictionary of arrays 'star', 'max', 'start', 'stop' and 'maximum' of
+        the chosen blocks in time order
+    """
+    blocks = candidateBlocks(times, alt, starIndex, maxJD, sequence,
+                             **blockOptions)
+    if method == 'greedy':
+        chosen = chooseGreedy(blocks['start'], blocks['stop'])
+    elif method == 'exact':
+        if weights is None:
+            windows = blockOptions.get('windows')
+            stars = alt.shape[0] if windows is None else len(windows[0])
+            weights = np.ones(stars)
+        blockWeight = np.asarray(weights, dtype=float)[blocks['star']]
+        chosen = chooseExact(blocks['start'], blocks['stop'], blockWeight)
+    else:
+        raise ValueError("method must be 'greedy' or 'exact', not " + method)
+
+    chosen = chosen[np.argsort(blocks['start'][chosen], kind='stable')]
+    return {key: value[chosen] for key, value in blocks.items()}
+
+def localSiderealTimes(jd, longitude):
+    # Returns the local apparent sidereal time of every JD as 'hh:mm:ss'
+    import astropy.units as u
+    from astropy.time import Time
+    if len(jd) == 0:
+        return []
+    lst = Time(jd, format='jd').sidereal_time('apparent',
+                                               longitude=longitude*u.deg)
+    return list(lst.to_string(sep=':', precision=0, pad=True))
+
+def planNight(day=None, filters='B,V,R,I,H', method='greedy', overhead=10.0,
+              catalog=None, weights=None, **blockOptions):
+    """
+    Plans the night beginning on day (default tonight) for the catalog stars
+    Recieves:
+        filters   -  Comma separated filters observed in every block
+        method    -  'greedy' or 'exact'
+        overhead  -  Readout and filter change time per exposure (s)
+        weights   -  Optional (N_stars,) value of each star's maxima, for
+                     the 'exact' method
+
+    Returns:
+        List of dictionaries, one per block in time order, with the star's
+        catalog row and name, the maximum, start and stop as astropy Times,
+        the LST start, the exposure times and the number of sequence repeats
+    """
+    from astropy.time import Time
+    from riseSet import altitudeAt, visibilityWindows
+    from starSelectGraphic import (observatory, nightWindow, predictMaxima,
+                                   LATITUDE, LONGITUDE)
+
+    if catalog is None:
+        catalog = getCatalog()
+    filterList = [f for f in filters.split(',') if f in VALID_FILTERS]
+
+    loc, obs = observatory()
+    startTime, stopTime = nightWindow(obs, day)
+    times = np.array([startTime.jd, stopTime.jd])
+
+    # Only stars in the declination band reaching minAltitude can have
+    # intervals above it, the rest are left without any
+    minAltitude = blockOptions.get('minAltitude', 25.0)
+    rows = catalog.skyIndex().band(*riseBand(LATITUDE, minAltitude))
+    windowStart = np.full((len(catalog), 2), np.nan)
+    windowStop = np.full((len(catalog), 2), np.nan)
+    if len(rows) > 0:
+        found = visibilityWindows(catalog.ra[rows], catalog.dec[rows],
+                                  startTime.jd, stopTime.jd, minAltitude)
+        windowStart[rows] = found['start']
+        windowStop[rows] = found['stop']
+    starIndex, maxJD, missing = predictMaxima(catalog.epoch, catalog.period,
+                                              startTime.jd, stopTime.jd)
+
+    # Exposure time of each filter at the airmass of every maximum, and the
+    # length of a filter sequence there
+    maxAlt = altitudeAt(catalog.ra[starIndex], catalog.dec[starIndex], maxJD)
+    exposures = np.round(exposureGrid(filterList, catalog.minMag[starIndex],
+                                      maxAlt[:, np.newaxis],
+                                      minAltitude)[:, :, 0])
+    sequence = np.sum(exposures + overhead, axis=1)
+
+    blockOptions['windows'] = (windowStart, windowStop)
+    blocks = scheduleNight(times, None, starIndex, maxJD, sequence,
+                           weights=weights, method=method, **blockOptions)
+    lststarts = localSiderealTimes(blocks['start'], LONGITUDE)
+
+    plan = []
+    for i, row in enumerate(blocks['star']):
+        maximum = blocks['maximum'][i]
+        length = (blocks['stop'][i] - blocks['start'][i])*SECONDS_PER_DAY
+        plan.append({'row': int(row),
+                     'name': catalog.name[row],
+                     'max': Time(blocks['max'][i], format='jd'),
+                     'start': Time(blocks['start'][i], format='jd'),
+                     'stop': Time(blocks['stop'][i], format='jd'),
+                     'lststart': lststarts[i],
+                     'filters': ','.join(filterList),
+                     'duration': ','.join(str(int(t))
+                                          for t in exposures[maximum]),
+                     'repeat': max(1, int(length // sequence[maximum]))})
+    return plan
+
+def writePlan(plan, directory, catalog=None, **fields):
+    """
+    Writes one schedule file per block of a plan, numbered in time order,
+    with the computed LST start.  Returns the paths written
+    """
+    from nameResolver import formatRA, formatDec
+    if catalog is None:
+        catalog = getCatalog()
+    os.makedirs(directory, exist_ok=True)
+    rows = np.array([block['row'] for block in plan], dtype=int)
+    ras = formatRA(catalog.ra[rows])
+    decs = formatDec(catalog.dec[rows])
+    paths = []
+    for i, block in enumerate(plan):
+        ra = str(ras[i])
+        dec = str(decs[i])
+        values = dict(fields)
+        values.update(lststart=block['lststart'], repeat=block['repeat'])
+        inputs = scheduleInputs(block['name'], ra, dec, block['filters'],
+                                block['duration'], **values)
+        path = os.path.join(directory, '%02d_' % (i + 1)
+                            + scheduleFileName(block['name'],
+                                               block['filters']))
+        writeSchedule(path, inputs)
+        paths.append(path)
+    return paths
+
+def main():
+    """
+    Program to plan tonight's observations of RR Lyrae maxima
+    """
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument('--day', help='night to plan, defaults to today')
+    parser.add_argument('--filters', default='B,V,R,I,H')
+    parser.add_argument('--method', choices=['greedy', 'exact'],
+                        default='greedy')
+    parser.add_argument('--min-altitude', type=float, default=25.0)
+    parser.add_argument('--lead', type=float, default=30.0,
+                        help='minutes observed before each maximum')
+    parser.add_argument('--trail', type=float, default=30.0,
+                        help='minutes observed after each maximum')
+    parser.add_argument('--write', metavar='DIRECTORY',
+                        help='write the schedule files into DIRECTORY')
+    args = parser.parse_args()
+
+    plan = planNight(args.day, args.filters, args.method,
+                     lead=args.lead, trail=args.trail,
+                     minAltitude=args.min_altitude)
+    for block in plan:
+        print(block['name'], block['start'].isot[11:16], "-",
+              block['stop'].isot[11:16], "UTC  max", block['max'].isot[11:16],
+              " LST start", block['lststart'], " repeat", block['repeat'])
+    print(len(plan), "maxima scheduled")
+    if args.write:
+        for path in writePlan(plan, args.write):
+            print("Wrote", path)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+This program finds which catalog stars are worth observing tonight and ranks
+them, for the whole candidate catalog in one vectorized pass.
+
+A star is observable if it rises above the altitude line between the
+twilights (riseSet.visibilityWindows), every filter's exposure at the
+highest altitude it is usable at stays below maxExposure, and one sequence
+of those exposures fits in the time it is above the line.  Stars with a
+predicted maximum while they are above the line come first, highest maximum
+first, then the other observable stars by how high they get.
+"""
+
+import argparse
+import numpy as np
+from exposurePlanner import exposureGrid, filterList
+from starCatalog import getCatalog
+
+# Longest exposure (s) a star can be given in one filter
+MAX_EXPOSURE = 600.0
+
+def observability(day=None, filters='B,V,R,I,H', minAltitude=25.0,
+                  maxExposure=MAX_EXPOSURE, catalog=None, **options):
+    """
+    Evaluates every catalog star for the night beginning on day (default
+    tonight)
+    Recieves:
+        filters      -  Comma separated filters the exposures are for
+        minAltitude  -  Lowest usable altitude (deg)
+        maxExposure  -  Longest usable exposure (s)
+        options      -  SNR and the other options of expose_batch
+
+    Returns:
+        Dictionary of (N_stars,) arrays 'maxAlt' (highest altitude between
+        the twilights), 'hours' above minAltitude, 'maxima' (number of
+        maxima while above minAltitude), 'bestMax' (JD of the highest of
+        them, NaN if none) and 'bestAlt' (its altitude, else maxAlt), the
+        (N_stars, N_filters) 'exposure' times at bestAlt, 'observable', and
+        'ranked', the rows of the observable stars from best to worst.
+        Also 'filters', 'start' and 'stop' (JD) of the night
+    """
+    from riseSet import altitudeAt, visibilityWindows
+    from skyIndex import riseBand
+    from starSelectGraphic import (observatory, nightWindow, predictMaxima,
+                                   LATITUDE)
+    if catalog is None:
+        catalog = getCatalog()
+    filters = filterList(filters)
+    loc, obs = observatory()
+    startTime, stopTime = nightWindow(obs, day)
+    count = len(catalog)
+
+    # Only stars in the declination band reaching minAltitude can be above
+    # it, the others keep no intervals
+    rows = catalog.skyIndex().band(*riseBand(LATITUDE, minAltitude))
+    maxAlt = np.full(count, -90.0)
+    windowStart = np.full((count, 2), np.nan)
+    windowStop = np.full((count, 2), np.nan)
+    if len(rows) > 0:
+        found = visibilityWindows(catalog.ra[rows], catalog.dec[rows],
+                                  startTime.jd, stopTime.jd, minAltitude)
+        maxAlt[rows] = found['maxAlt']
+        windowStart[rows] = found['start']
+        windowStop[rows] = found['stop']
+    hours = np.nansum(windowStop - windowStart, axis=1)*24.0
+
+    # Maxima while their star is above the line, and the highest of them
+    starIndex, maxJD, missing = predictMaxima(catalog.epoch, catalog.period,
+                                              startTime.jd, stopTime.jd)
+    above = ((windowStart[starIndex] <= maxJD[:, np.newaxis])
+             & (windowStop[starIndex] >= maxJD[:, np.newaxis])).any(axis=1)
+    starIndex = starIndex[above]
+    maxJD = maxJD[above]
+    maxAltitude = altitudeAt(catalog.ra[starIndex], catalog.dec[starIndex],
+                             maxJD)
+    maxima = np.bincount(starIndex, minlength=count)
+    order = np.lexsort((-maxAltitude, starIndex))
+    stars, first = np.unique(starIndex[order], return_index=True)
+    bestMax = np.full(count, np.nan)
+    bestMax[stars] = maxJD[order][first]
+    bestAlt = maxAlt.copy()
+    bestAlt[stars] = maxAltitude[order][first]
+
+    exposure = exposureGrid(filters, catalog.minMag, bestAlt[:, np.newaxis],
+                            minAltitude, **options)[:, :, 0]
+    # Every exposure must be short enough, and one sequence of them must fit
+    # in the time the star is above the line
+    with np.errstate(invalid='ignore'):
+        feasible = np.all(np.isfinite(exposure) & (exposure <= maxExposure),
+                          axis=1)
+        feasible &= exposure.sum(axis=1) <= hours*3600.0
+    observable = (hours > 0) & feasible & (len(filters) > 0)
+
+    # Stars with a maximum first, each group highest first
+    candidates = np.flatnonzero(observable)
+    ranked = candidates[np.lexsort((-bestAlt[candidates],
+                                    maxima[candidates] == 0))]
+    return {'filters': filters, 'start': startTime.jd, 'stop': stopTime.jd,
+            'maxAlt': maxAlt, 'hours': hours, 'maxima': maxima,
+            'bestMax': bestMax, 'bestAlt': bestAlt, 'exposure': exposure,
+            'observable': observable, 'ranked': ranked}
+
+def main():
+    """
+    Program to rank the catalog stars observable tonight
+    """
+    from astropy.time import Time
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument('--day', help='night to rank, defaults to today')
+    parser.add_argument('--filters', default='B,V,R,I,H')
+    parser.add_argument('--min-altitude', type=float, default=25.0)
+    parser.add_argument('--max-exposure', type=float, default=MAX_EXPOSURE)
+    args = parser.parse_args()
+
+    catalog = getCatalog()
+    result = observability(args.day, args.filters, args.min_altitude,
+                           args.max_exposure, catalog)
+    for row in result['ranked']:
+        maximum = ('maximum ' + Time(result['bestMax'][row],
+                                     format='jd').isot[11:16] + ' UTC'
+                   if result['maxima'][row] else 'no maximum')
+        print("%-12s %5.1f deg  %4.1f h  %-20s %s"
+              % (catalog.name[row], result['bestAlt'][row],
+                 result['hours'][row], maximum,
+                 ','.join(str(int(round(t))) for t in result['exposure'][row])))
+    print(len(result['ranked']), "of", len(catalog), "stars observable")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,345 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+This program measures the brightness of many stars on FITS frames at once by
+aperture photometry, and turns a directory of frames from a night into light
+curves of the RR Lyrae stars on them.
+
+Frames are opened memory-mapped, and only the small boxes of pixels around
+the stars are ever read, so frames of any size can be measured without
+loading them into memory.  Every star on a frame is measured in the same
+vectorized pass:
+    - Each pixel's weight in the circular aperture is the fraction of its
+      sub-pixels (PIECE x PIECE, as in fraction_inside) whose centres lie
+      inside the circle, so the aperture follows the star's exact position.
+    - The sky is the median of the pixels in an annulus around the star.
+    - The flux is corrected for the light outside the aperture with
+      fraction_inside, the same gaussian PSF and aperture model the exposure
+      time calculator uses.
+lightCurves measures every frame of a directory in a pool of processes.
+"""
+
+import argparse
+import glob
+import os
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from apertureFraction import PIECE, fraction_inside
+from artifactStore import atomicWrite
+from instrumentation import timed
+
+# Extensions of the FITS files lightCurves picks up from a directory
+FITS_EXTENSIONS = ('.fits', '.fit', '.fts')
+
+# Stars measured together, which bounds the size of the weight arrays
+CHUNK = 256
+
+def apertureWeights(dx, dy, radius, half, piece=PIECE):
+    """
+    Calculates the weight of every pixel of a box in circular apertures
+    Recieves:
+        dx, dy  -  (N,) position of each star (pixels) relative to the
+                   centre of the box's middle pixel
+        radius  -  Aperture radius (pixels)
+        half    -  The box is 2*half + 1 pixels on a side
+        piece   -  Pieces to sub-divide pixels into along each axis
+
+    Returns:
+        (N, 2*half + 1, 2*half + 1) fraction of each pixel's sub-pixels
+        inside the aperture, indexed [star, y, x]
+    """
+    dx = np.asarray(dx, dtype=float)[:, np.newaxis]
+    dy = np.asarray(dy, dtype=float)[:, np.newaxis, np.newaxis]
+    size = 2*half + 1
+
+    # Every column of sub-pixels inside the circle is a run between the
+    # circle's lower and upper edges, so each pixel only needs the number of
+    # its sub-pixel rows between them
+    xs = (np.arange(size*piece) + 0.5)/piece - half - 0.5
+    rx2 = (xs - dx)**2
+    chord = np.sqrt(np.clip(radius*radius - rx2, 0.0, None))[..., np.newaxis]
+    rows = np.arange(-half, half + 1)
+    first = np.ceil((dy - chord - rows + 0.5)*piece - 0.5)
+    last = np.floor((dy + chord - rows + 0.5)*piece - 0.5)
+    count = np.clip(last, -1, piece - 1) - np.clip(first, 0, piece) + 1
+    count = np.where((rx2 <= radius*radius)[..., np.newaxis],
+                     np.maximum(count, 0), 0)
+
+    # (star, x sub-pixel, y pixel) -> (star, y pixel, x pixel)
+    count = count.reshape(len(dx), size, piece, size).sum(axis=2)
+    return np.transpose(count, (0, 2, 1))/(piece*piece)
+
+class Frame:
+    """
+    A FITS image opened memory-mapped.  Pixels are only read when cutouts
+    asks for them, and BSCALE and BZERO are applied to just those pixels.
+    """
+
+    def __init__(self, filename):
+        from astropy.io import fits
+        self.filename = filename
+        self.hdus = fits.open(filename, memmap=True,
+                              do_not_scale_image_data=True)
+        image = next(hdu for hdu in self.hdus
+                     if hdu.header.get('NAXIS', 0) == 2)
+        self.header = image.header
+        self.data = image.data
+        self.bscale = float(self.header.get('BSCALE', 1.0))
+        self.bzero = float(self.header.get('BZERO', 0.0))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.data = None
+        self.hdus.close()
+
+    def jd(self):
+        # Middle of the exposure as a JD, NaN if the header doesn't say
+        from astropy.time import Time
+        if 'JD' in self.header:
+            return float(self.header['JD'])
+        if 'MJD-OBS' in self.header:
+            start = float(self.header['MJD-OBS']) + 2400000.5
+        elif 'DATE-OBS' in self.header:
+            start = Time(self.header['DATE-OBS'], scale='utc').jd
+        else:
+            return np.nan
+        return start + self.exposure()/2.0/86400.0
+
+    def exposure(self):
+        # Exposure time (s), 1 if the header doesn't say
+        return float(self.header.get('EXPTIME',
+                                     self.header.get('EXPOSURE', 1.0)))
+
+    def wcs(self):
+        from astropy.wcs import WCS
+        return WCS(self.header)
+
+    def pixelScale(self):
+        # Pixel size (arcsec) from the WCS, None without one
+        from astropy.wcs.utils import proj_plane_pixel_scales
+        wcs = self.wcs()
+        if not wcs.has_celestial:
+            return None
+        return float(np.mean(proj_plane_pixel_scales(wcs.celestial))*3600.0)
+
+    def toPixels(self, ra, dec):
+        # Zero based (x, y) pixel positions of (ra, dec) in degrees
+        x, y = self.wcs().celestial.all_world2pix(np.atleast_1d(ra),
+                                                  np.atleast_1d(dec), 0)
+        return x, y
+
+    def cutouts(self, x, y, half):
+        """
+        Reads the (2*half + 1) square boxes of pixels centred on the pixels
+        nearest to (x, y).  Returns the (N, size, size) values, NaN outside
+        the frame, and the offsets of the stars from the boxes' centres
+        """
+        x = np.asarray(x, dtype=float)
+        y = np.asarray(y, dtype=float)
+        cx = np.rint(x).astype(int)
+        cy = np.rint(y).astype(int)
+        offsets = np.arange(-half, half + 1)
+        ix = cx[:, np.newaxis, np.newaxis] + offsets[np.newaxis, np.newaxis, :]
+        iy = cy[:, np.newaxis, np.newaxis] + offsets[np.newaxis, :, np.newaxis]
+        ny, nx = self.data.shape
+        inside = (ix >= 0) & (ix < nx) & (iy >= 0) & (iy < ny)
+        raw = self.data[np.clip(iy, 0, ny - 1), np.clip(ix, 0, nx - 1)]
+        values = np.where(inside, raw*self.bscale + self.bzero, np.nan)
+        return values, x - cx, y - cy
+
+def measure(frame, x, y, radius=8.0, annulus=(12.0, 20.0), piece=PIECE,
+            gain=1.0):
+    """
+    Measures many stars on a frame by aperture photometry
+    Recieves:
+        frame      -  Frame
+        x, y       -  (N,) zero based pixel positions of the stars
+        radius     -  Aperture radius (pixels)
+        annulus    -  Inner and outer radius of the sky annulus (pixels)
+        gain       -  Electrons per count
+
+    Returns:
+        Dictionary of (N,) 'flux' (counts inside the aperture above the sky),
+        its 'error', the 'sky' per pixel and the aperture 'area' (pixels).
+        Stars whose aperture runs off the frame get NaN
+    """
+    x = np.atleast_1d(np.asarray(x, dtype=float))
+    y = np.atleast_1d(np.asarray(y, dtype=float))
+    inner, outer = annulus
+    # Stars are within half a pixel of their box's centre, so the aperture
+    # fits in a box of apHalf and the annulus in one of half
+    apHalf = int(np.ceil(radius + 0.5))
+    half = max(int(np.ceil(outer + 0.5)), apHalf)
+    apBox = slice(half - apHalf, half + apHalf + 1)
+    result = {key: np.full(len(x), np.nan)
+              for key in ('flux', 'error', 'sky', 'area')}
+
+    for start in range(0, len(x), CHUNK):
+        chunk = slice(start, start + CHUNK)
+        values, dx, dy = frame.cutouts(x[chunk], y[chunk], half)
+        weights = apertureWeights(dx, dy, radius, apHalf, piece)
+
+        # Sky from the median of the whole pixels in the annulus
+        offsets = np.arange(-half, half + 1)
+        r2 = ((offsets[np.newaxis, np.newaxis, :] - dx[:, None, None])**2
+              + (offsets[np.newaxis, :, np.newaxis] - dy[:, None, None])**2)
+        ring = (r2 >= inner*inner) & (r2 <= outer*outer)
+        skyValues = np.where(ring, values, np.nan)
+        # Stars off the frame have no sky pixels and get NaN
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            sky = np.nanmedian(skyValues, axis=(1, 2))
+            skyVar = np.nanvar(skyValues, axis=(1, 2))
+        nSky = np.sum(ring & np.isfinite(values), axis=(1, 2))
+
+        area = weights.sum(axis=(1, 2))
+        under = values[:, apBox, apBox]
+        offFrame = np.any((weights > 0) & ~np.isfinite(under), axis=(1, 2))
+        flux = np.sum(weights*np.nan_to_num(under - sky[:, None, None]),
+                      axis=(1, 2))
+        flux = np.where(offFrame, np.nan, flux)
+
+        # Photon noise of the star plus the scatter of the sky pixels under
+        # the aperture, and the error of the sky level.  The scatter is
+        # measured in the annulus, so it already holds the read noise
+        with np.errstate(invalid='ignore', divide='ignore'):
+            variance = (np.maximum(flux, 0.0)/gain + area*skyVar
+                        + area*area*skyVar/nSky)
+        result['flux'][chunk] = flux
+        result['error'][chunk] = np.sqrt(variance)
+        result['sky'][chunk] = sky
+        result['area'][chunk] = area
+    return result
+
+@timed('photometry.frame')
+def measureFrame(filename, ra, dec, radius=8.0, annulus=(12.0, 20.0),
+                 FWHM=2.5, pixSize=None, **options):
+    """
+    Measures stars at (ra, dec) in degrees on a FITS file
+    Recieves:
+        radius, annulus  -  Aperture and sky annulus radii (pixels)
+        FWHM             -  Full width half max of the stars (arcsec)
+        pixSize          -  Pixel size (arcsec), defaults to the WCS's
+        options          -  gain, as for measure
+
+    Returns:
+        Dictionary of the frame's 'jd' and 'exposure' and (N,) 'x', 'y',
+        'flux' and 'error' corrected to the star's total light, 'mag' and
+        'magError' instrumental magnitudes per second, 'sky'
+    """
+    with Frame(filename) as frame:
+        x, y = frame.toPixels(ra, dec)
+        result = measure(frame, x, y, radius, annulus, **options)
+        if pixSize is None:
+            pixSize = frame.pixelScale() or 0.442
+        jd = frame.jd()
+        exposure = frame.exposure()
+
+    # Light of the gaussian PSF falling outside the aperture
+    fraction = fraction_inside(FWHM, radius*pixSize, pixSize)
+    flux = result['flux']/fraction
+    error = result['error']/fraction
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mag = np.where(flux > 0, -2.5*np.log10(flux/exposure), np.nan)
+        magError = np.where(flux > 0, 1.0857*error/flux, np.nan)
+    return {'jd': jd, 'exposure': exposure, 'x': x, 'y': y, 'flux': flux,
+            'error': error, 'mag': mag, 'magError': magError,
+            'sky': result['sky']}
+
+# Returns the sorted FITS files of a directory, or the given list of files
+def frameFiles(frames):
+    if isinstance(frames, str):
+        return sorted(os.path.join(frames, name) for name in os.listdir(frames)
+                      if name.lower().endswith(FITS_EXTENSIONS))
+    return sorted(path for pattern in frames for path in glob.glob(pattern))
+
+def lightCurves(frames, ra, dec, workers=None, **options):
+    """
+    Measures stars on every frame of a night
+    Recieves:
+        frames   -  Directory of FITS files or list of files (or patterns)
+        ra, dec  -  (N,) positions of the stars (deg)
+        workers  -  Number of processes, 1 measures every frame in this one
+        options  -  radius, annulus, FWHM, pixSize and gain, as for
+                    measureFrame
+
+    Returns:
+        Dictionary of the (N_frames,) 'file' names and 'jd' in time order,
+        and (N_frames, N) 'flux', 'error', 'mag', 'magError' and 'sky'
+    """
+    files = frameFiles(frames)
+    ra = np.atleast_1d(np.asarray(ra, dtype=float))
+    dec = np.atleast_1d(np.asarray(dec, dtype=float))
+    args = [(filename, ra, dec) for filename in files]
+    if workers == 1 or len(files) <= 1:
+        results = [measureFrame(*arg, **options) for arg in args]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(measureFrame, *arg, **options)
+                       for arg in args]
+            results = [future.result() for future in futures]
+
+    jd = np.array([result['jd'] for result in results], dtype=float)
+    order = np.argsort(jd, kind='stable')
+    curves = {'file': [files[i] for i in order], 'jd': jd[order]}
+    for key in ('flux', 'error', 'mag', 'magError', 'sky'):
+        curves[key] = (np.array([results[i][key] for i in order])
+                       if results else np.empty((0, len(ra))))
+    return curves
+
+def writeLightCurves(filename, names, curves):
+    # Writes the light curves as csv, one line per star and frame
+    with atomicWrite(filename) as file:
+        file.write('Name,JD,Mag,MagError,Flux,FluxError,File\n')
+        for j, name in enumerate(names):
+            for i in range(len(curves['jd'])):
+                file.write('%s,%.6f,%.4f,%.4f,%.2f,%.2f,%s\n'
+                           % (name, curves['jd'][i], curves['mag'][i, j],
+                              curves['magError'][i, j], curves['flux'][i, j],
+                              curves['error'][i, j],
+                              os.path.basename(curves['file'][i])))
+
+def main():
+    """
+    Program to make light curves of stars from a directory of FITS frames
+    """
+    from nameResolver import getResolver
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument('frames', help='directory of FITS frames')
+    parser.add_argument('stars', nargs='+', help='names of the stars')
+    parser.add_argument('--radius', type=float, default=8.0,
+                        help='aperture radius (pixels)')
+    parser.add_argument('--annulus', default='12,20',
+                        help='inner,outer sky annulus radii (pixels)')
+    parser.add_argument('--fwhm', type=float, default=2.5,
+                        help='FWHM of the stars (arcsec)')
+    parser.add_argument('--gain', type=float, default=1.0)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--output', default='lightCurves.csv')
+    args = parser.parse_args()
+
+    ra, dec, sources = getResolver().resolveAll(args.stars)
+    names = [name for name, source in zip(args.stars, sources)
+             if source is not None]
+    for name, source in zip(args.stars, sources):
+        if source is None:
+            print("Could not find " + name + ", skipping")
+    found = np.array([source is not None for source in sources], dtype=bool)
+    annulus = tuple(float(r) for r in args.annulus.split(','))
+
+    curves = lightCurves(args.frames, ra[found], dec[found], args.workers,
+                         radius=args.radius, annulus=annulus, FWHM=args.fwhm,
+                         gain=args.gain)
+    writeLightCurves(args.output, names, curves)
+    print("Measured %d stars on %d frames, saved %s"
+          % (len(names), len(curves['jd']), args.output))
+
+if __name__ == '__main__':
+    main()
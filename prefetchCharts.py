@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+This program fetches and renders the finder chart of every star in
+StarList.txt ahead of time, so the whole observing list is ready before the
+night starts.  Charts are downloaded by a bounded pool of threads and each
+star gets its own files in the finder chart cache.
+
+Run it from the top of the project, e.g. nightly from cron:
+    python prefetchCharts.py --workers 8
+or set PREFETCH_FINDER_CHARTS=1 to run it in the background when the web app
+starts.
+"""
+
+import argparse
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from finderChart import FinderChartCache, LocalFetcher
+from starCatalog import getCatalog, getStarList
+
+def prefetchOne(name, cache, catalog):
+    """
+    Fetches and renders the finder chart of one star
+    Returns dictionary with the star's name, chart path, time taken in
+    seconds and the error message if it failed
+    """
+    start = time.perf_counter()
+    result = {'name': name, 'path': None, 'seconds': 0.0, 'error': None}
+    try:
+        star = catalog.lookup(name)
+        if star is None:
+            raise KeyError(name + " is not in the catalog")
+        result['path'] = cache.get_chart(star['ra'], star['dec'])
+    except Exception as error:
+        result['error'] = repr(error)
+    result['seconds'] = time.perf_counter() - start
+    return result
+
+def prefetch(names=None, cache=None, workers=8):
+    """
+    Fetches and renders the finder charts of many stars concurrently
+    Recieves:
+        names    -  Star names, defaults to every star in StarList.txt
+        cache    -  FinderChartCache to fill
+        workers  -  Number of charts fetched at once
+
+    Returns:
+        List of results from prefetchOne, in the order of names
+    """
+    if names is None:
+        names = getStarList()
+    if cache is None:
+        cache = FinderChartCache()
+    catalog = getCatalog()
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(lambda name: prefetchOne(name, cache, catalog),
+                             names))
+
+def printReport(results):
+    failed = 0
+    for result in results:
+        if result['error'] is None:
+            print("%-12s %7.2f s  %s" % (result['name'], result['seconds'],
+                                         result['path']))
+        else:
+            failed += 1
+            print("%-12s %7.2f s  FAILED %s" % (result['name'],
+                                                result['seconds'],
+                                                result['error']))
+    print()
+    print("%d charts ready, %d failed, %.2f s total" %
+          (len(results) - failed, failed,
+           sum(result['seconds'] for result in results)))
+    return failed
+
+def main():
+    """
+    Program to prefetch the finder charts of every star on the observing list
+    """
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument('stars', nargs='*',
+                        help='star names, defaults to all of StarList.txt')
+    parser.add_argument('--workers', type=int, default=8,
+                        help='number of charts fetched at once')
+    parser.add_argument('--offline', action='store_true',
+                        help='use the local starField.fits instead of SkyView')
+    args = parser.parse_args()
+
+    cache = FinderChartCache(fetcher=LocalFetcher() if args.offline else None)
+    start = time.perf_counter()
+    results = prefetch(args.stars or None, cache, args.workers)
+    failed = printReport(results)
+    print("Wall time: %.2f s" % (time.perf_counter() - start))
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,291 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+This program finds when stars transit and when they rise above and set below
+an altitude line during a night, for the whole catalog at once, without
+sampling their altitude on a grid.
+
+A star's altitude only depends on its hour angle H and declination:
+    sin(alt) = sin(lat) sin(dec) + cos(lat) cos(dec) cos(H)
+so it crosses the line alt0 at the hour angles +-H0 with
+    cos(H0) = (sin(alt0) - sin(lat) sin(dec)) / (cos(lat) cos(dec))
+and transits at H = 0.  With the stars' apparent places for the night and the
+local sidereal time, which runs at a constant rate, every crossing time
+follows in closed form.  The closed form is then checked against astropy's
+full AltAz transformation: the small difference between the two (diurnal
+aberration, polar motion, the change of the apparent place over the night) is
+sampled about every three hours for all stars at once, interpolated to the
+crossings, transits and window ends, and each crossing is moved by Newton
+steps, instead of evaluating the transformation on a fine grid for every star.
+"""
+
+import numpy as np
+from starSelectGraphic import LATITUDE, LONGITUDE, HEIGHT
+
+# Sidereal days per solar day
+SIDEREAL_RATE = 1.00273790935
+
+# Returns the apparent places (deg) of ICRS positions at one JD
+def apparentPlace(ra, dec, jd):
+    from astropy.coordinates import SkyCoord, TETE
+    from astropy.time import Time
+    place = SkyCoord(ra, dec, unit='deg').transform_to(
+        TETE(obstime=Time(jd, format='jd')))
+    return place.ra.deg, place.dec.deg
+
+# Returns the local apparent sidereal time (hours) at JDs
+def siderealTime(jd, longitude=LONGITUDE):
+    import astropy.units as u
+    from astropy.time import Time
+    return Time(jd, format='jd').sidereal_time(
+        'apparent', longitude=longitude*u.deg).hour
+
+# Returns the altitude (deg) at hour angles (hours) and declinations (deg)
+def hourAngleAltitude(ha, dec, latitude=LATITUDE):
+    lat = np.radians(latitude)
+    dec = np.radians(dec)
+    sinAlt = (np.sin(lat)*np.sin(dec)
+              + np.cos(lat)*np.cos(dec)*np.cos(np.radians(15.0*ha)))
+    return np.degrees(np.arcsin(np.clip(sinAlt, -1.0, 1.0)))
+
+def crossingHourAngle(dec, minAltitude, latitude=LATITUDE):
+    """
+    Returns the hour angle (hours) at which stars cross minAltitude, NaN for
+    stars that never reach it and 12 for stars that never go below it
+    """
+    lat = np.radians(latitude)
+    dec = np.radians(np.asarray(dec, dtype=float))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        cosH = ((np.sin(np.radians(minAltitude)) - np.sin(lat)*np.sin(dec))
+                /(np.cos(lat)*np.cos(dec)))
+    H = np.degrees(np.arccos(np.clip(cosH, -1.0, 1.0)))/15.0
+    return np.where(cosH > 1.0, np.nan, np.where(cosH < -1.0, 12.0, H))
+
+class _NightSky:
+    # Apparent places and sidereal time for one night, from which the hour
+    # angle of any star at any time follows linearly
+
+    def __init__(self, ra, dec, referenceJD, latitude, longitude):
+        self.referenceJD = referenceJD
+        self.latitude = latitude
+        self.ra, self.dec = apparentPlace(ra, dec, referenceJD)
+        self.ra = np.atleast_1d(self.ra)
+        self.dec = np.atleast_1d(self.dec)
+        self.lst = siderealTime(referenceJD, longitude)
+        self.haOffset = None
+        self.decOffset = None
+
+    def calibrate(self, ra, dec, longitude, height, samples=9):
+        # Samples the difference between the hour angles and declinations
+        # astropy's AltAz transformation implies and the linear ones over a
+        # sidereal day around the reference time, with one transformation of
+        # every star at each sample time.  Unlike the altitude, both vary
+        # smoothly even for stars passing near the zenith
+        import astropy.units as u
+        from astropy.coordinates import AltAz, EarthLocation, SkyCoord
+        from astropy.time import Time
+        day = 1.0/SIDEREAL_RATE
+        self.sampleJD = self.referenceJD + np.linspace(-0.55, 0.55, samples)*day
+        loc = EarthLocation(lat=self.latitude*u.deg, lon=longitude*u.deg,
+                            height=height*u.m)
+        frame = AltAz(obstime=Time(self.sampleJD, format='jd')[np.newaxis, :],
+                      location=loc)
+        place = SkyCoord(ra, dec, unit='deg')[:, np.newaxis].transform_to(frame)
+        alt = place.alt.rad
+        az = place.az.rad
+        lat = np.radians(self.latitude)
+        sinDec = (np.sin(lat)*np.sin(alt)
+                  + np.cos(lat)*np.cos(alt)*np.cos(az))
+        ha = np.degrees(np.arctan2(-np.sin(az)*np.cos(alt),
+                                   np.cos(lat)*np.sin(alt)
+                                   - np.sin(lat)*np.cos(alt)*np.cos(az)))/15.0
+        stars = np.arange(len(self.ra))[:, np.newaxis]
+        model = self.hourAngle(stars, self.sampleJD[np.newaxis, :])
+        self.haOffset = np.mod(ha - model + 12.0, 24.0) - 12.0
+        self.decOffset = (np.degrees(np.arcsin(np.clip(sinDec, -1.0, 1.0)))
+                          - self.dec[stars])
+
+    def _interpolate(self, offset, rows, jd):
+        # Offset of the calibrated stars at jd, zero if not calibrated
+        if offset is None:
+            return 0.0
+        rows, jd = np.broadcast_arrays(rows, jd)
+        k = np.clip(np.searchsorted(self.sampleJD, jd) - 1, 0,
+                    len(self.sampleJD) - 2)
+        t0 = self.sampleJD[k]
+        f = (jd - t0)/(self.sampleJD[k + 1] - t0)
+        return (1.0 - f)*offset[rows, k] + f*offset[rows, k + 1]
+
+    def hourAngle(self, rows, jd):
+        lst = self.lst + 24.0*SIDEREAL_RATE*(jd - self.referenceJD)
+        return (np.mod(lst - self.ra[rows]/15.0 + 12.0, 24.0) - 12.0
+                + self._interpolate(self.haOffset, rows, jd))
+
+    def declination(self, rows, jd):
+        return self.dec[rows] + self._interpolate(self.decOffset, rows, jd)
+
+    def altitude(self, rows, jd):
+        return hourAngleAltitude(self.hourAngle(rows, jd),
+                                 self.declination(rows, jd), self.latitude)
+
+    def altitudeRate(self, rows, jd):
+        # d(alt)/dt in deg/day
+        lat = np.radians(self.latitude)
+        dec = np.radians(self.declination(rows, jd))
+        H = np.radians(15.0*self.hourAngle(rows, jd))
+        alt = np.radians(self.altitude(rows, jd))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.degrees(-np.cos(lat)*np.cos(dec)*np.sin(H)
+                              *2.0*np.pi*SIDEREAL_RATE/np.cos(alt))
+
+def exactAltitude(ra, dec, jd, latitude=LATITUDE, longitude=LONGITUDE,
+                  height=HEIGHT):
+    """
+    Altitudes (deg) of star i at time jd[i] with astropy's full AltAz
+    transformation, for (star, time) pairs
+    """
+    import astropy.units as u
+    from astropy.coordinates import AltAz, EarthLocation, SkyCoord
+    from astropy.time import Time
+    jd = np.atleast_1d(np.asarray(jd, dtype=float))
+    if len(jd) == 0:
+        return np.empty(0)
+    loc = EarthLocation(lat=latitude*u.deg, lon=longitude*u.deg,
+                        height=height*u.m)
+    frame = AltAz(obstime=Time(jd, format='jd'), location=loc)
+    return np.asarray(SkyCoord(ra, dec, unit='deg').transform_to(frame).alt.deg)
+
+def altitudeAt(ra, dec, jd, latitude=LATITUDE, longitude=LONGITUDE):
+    """
+    Altitudes (deg) of star i at time jd[i] from the hour angle, for
+    (star, time) pairs within a day or so of each other
+    """
+    jd = np.atleast_1d(np.asarray(jd, dtype=float))
+    if len(jd) == 0:
+        return np.empty(0)
+    sky = _NightSky(ra, dec, float(np.median(jd)), latitude, longitude)
+    return sky.altitude(np.arange(len(jd)), jd)
+
+def visibilityWindows(ra, dec, startJD, stopJD, minAltitude=25.0,
+                      latitude=LATITUDE, longitude=LONGITUDE, height=HEIGHT,
+                      refine=True):
+    """
+    Finds when stars are above minAltitude between two times less than a day
+    apart (e.g. twilight to twilight)
+    Recieves:
+        ra, dec      -  (N,) ICRS positions (deg)
+        minAltitude  -  Altitude line (deg)
+        refine       -  Correct crossings and altitudes to astropy's AltAz
+                        transformation
+
+    Returns:
+        Dictionary of (N,) 'transit' (JD of the upper transit nearest the
+        middle of the window), 'transitAlt', 'rise' and 'set' (JD of the
+        crossings around that transit, NaN if the star never crosses), the
+        (N, 2) 'start' and 'stop' (JD) of the intervals above minAltitude
+        inside the window in time order (NaN where there is none), 'hours'
+        above minAltitude and 'maxAlt', the highest altitude in the window
+    """
+    ra = np.atleast_1d(np.asarray(ra, dtype=float))
+    dec = np.atleast_1d(np.asarray(dec, dtype=float))
+    middle = 0.5*(startJD + stopJD)
+    stars = np.arange(len(ra))
+    sky = _NightSky(ra, dec, middle, latitude, longitude)
+    day = 1.0/SIDEREAL_RATE
+
+    if refine and len(ra) > 0:
+        sky.calibrate(ra, dec, longitude, height)
+    transit = middle - sky.hourAngle(stars, middle)/24.0*day
+    transit -= sky.hourAngle(stars, transit)/24.0*day
+    H0 = crossingHourAngle(sky.declination(stars, transit), minAltitude,
+                           latitude)/24.0*day
+    transitAlt = sky.altitude(stars, transit)
+
+    # Intervals above the line around the transits before, nearest to and
+    # after the middle of the window.  Windows are shorter than a day, so at
+    # most two of them overlap it
+    center = transit[:, np.newaxis] + np.array([-day, 0.0, day])
+    up = center - H0[:, np.newaxis]
+    down = center + H0[:, np.newaxis]
+
+    if refine and len(ra) > 0:
+        # Newton steps on the calibrated altitude at each crossing inside
+        # the window
+        for crossing in (up, down):
+            inside = ((crossing > startJD) & (crossing < stopJD)
+                      & (H0[:, np.newaxis] < 0.5*day))
+            rows, k = np.nonzero(inside)
+            jd = crossing[rows, k]
+            for _ in range(2):
+                alt = sky.altitude(rows, jd)
+                rate = sky.altitudeRate(rows, jd)
+                step = np.where(np.abs(rate) > 0, (minAltitude - alt)/rate, 0.0)
+                jd = jd + np.clip(step, -0.01, 0.01)
+            crossing[rows, k] = jd
+
+    start = np.clip(up, startJD, stopJD)
+    stop = np.clip(down, startJD, stopJD)
+    # Circumpolar stars are above the line the whole window
+    always = H0 >= 0.5*day
+    start[always] = [startJD, startJD, startJD]
+    stop[always] = [stopJD, startJD, startJD]
+    empty = ~(stop > start)
+    start[empty] = np.nan
+    stop[empty] = np.nan
+    order = np.argsort(np.where(empty, np.inf, start), axis=1,
+                       kind='stable')[:, :2]
+    start = np.take_along_axis(start, order, axis=1)
+    stop = np.take_along_axis(stop, order, axis=1)
+
+    # Highest point in the window is the transit, or else one of its ends
+    ends = np.stack([np.full(len(ra), startJD), np.full(len(ra), stopJD)])
+    endAlt = sky.altitude(stars[np.newaxis, :], ends)
+    inWindow = (transit >= startJD) & (transit <= stopJD)
+    maxAlt = np.where(inWindow, transitAlt, endAlt.max(axis=0))
+
+    crosses = np.isfinite(H0) & ~always
+    return {'transit': transit, 'transitAlt': transitAlt,
+            'rise': np.where(crosses, up[:, 1], np.nan),
+            'set': np.where(crosses, down[:, 1], np.nan),
+            'start': start, 'stop': stop,
+            'hours': np.nansum(stop - start, axis=1)*24.0,
+            'maxAlt': maxAlt}
+
+def main():
+    """
+    Program to print tonight's transit and the times each catalog star is
+    above 25 degrees
+    """
+    import argparse
+    from astropy.time import Time
+    from ephemerisCache import getEphemeris
+    from starCatalog import getCatalog
+    from starSelectGraphic import observatory
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument('--day', help='night, defaults to today')
+    parser.add_argument('--min-altitude', type=float, default=25.0)
+    args = parser.parse_args()
+
+    loc, obs = observatory()
+    startTime, stopTime = getEphemeris(obs).nightWindow(args.day)
+    catalog = getCatalog()
+    windows = visibilityWindows(catalog.ra, catalog.dec, startTime.jd,
+                                stopTime.jd, args.min_altitude)
+
+    def clock(jd):
+        return '--:--' if np.isnan(jd) else Time(jd, format='jd').isot[11:16]
+
+    print("Night %s to %s UTC, above %g deg:" % (startTime.isot[:16],
+                                                 stopTime.isot[11:16],
+                                                 args.min_altitude))
+    for i, name in enumerate(catalog.name):
+        intervals = ', '.join(clock(a) + '-' + clock(b) for a, b in
+                              zip(windows['start'][i], windows['stop'][i])
+                              if np.isfinite(a))
+        print("  %-10s transit %s at %5.1f deg  %4.1f h  %s"
+              % (name, clock(windows['transit'][i]),
+                 windows['transitAlt'][i], windows['hours'][i], intervals))
+
+if __name__ == '__main__':
+    main()
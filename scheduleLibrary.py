@@ -0,0 +1,437 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+This program reads schedule files (.sch) back in, so that the schedules
+directory can be listed, searched, checked and reused instead of only being
+written to.
+
+A schedule file is a list of KEY = value lines, strings in single quotes,
+ended by a line holding only '/'.  One file can hold several schedules one
+after another.  iterSchedules parses them a line at a time into dictionaries
+keyed like createSchedule.FIELDS, and checkSchedule finds what is wrong with
+one: missing keys, coordinates that aren't valid, and filter and duration
+lists of different lengths.
+
+ScheduleLibrary keeps an index of every schedule in a directory in a JSON
+file: its fields, its RA, Dec and LST start as numbers and its problems.
+Only files added or changed since the index was saved are parsed again, and
+queries run on numpy columns of the index, so thousands of schedules are
+searched without opening any file.
+"""
+
+import argparse
+import json
+import os
+import threading
+import numpy as np
+from artifactStore import atomicWrite, contentName, fileLock
+from createSchedule import FIELDS
+from exposureTimeCalculator import VALID_FILTERS
+from starCatalog import getCatalog, normalizeName
+
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache')
+
+# Key of each field in a schedule file
+KEYS = {'title': 'TITLE', 'observer': 'OBSERVER', 'source': 'SOURCE',
+        'ra': 'RA', 'dec': 'DEC', 'epoch': 'EPOCH', 'lststart': 'LSTSTART',
+        'filters': 'FILTER', 'duration': 'DURATION', 'binning': 'BINNING',
+        'subimage': 'SUBIMAGE', 'priority': 'PRIORITY',
+        'compress': 'COMPRESS', 'imagedir': 'IMAGEDIR',
+        'ccdcalib': 'CCDCALIB', 'shutter': 'SHUTTER', 'repeat': 'REPEAT'}
+FIELD_OF_KEY = {key: field for field, key in KEYS.items()}
+
+# Fields a schedule can't be observed without
+REQUIRED = ('source', 'ra', 'dec', 'filters', 'duration')
+
+# Largest distance (deg) from the catalog position of the source before
+# validate reports it
+MAX_OFFSET = 1.0/60.0
+
+def iterSchedules(lines):
+    """
+    Parses schedules from lines of text (e.g. an open file) one at a time
+    Returns:
+        Iterator of (values, problems), values being a dictionary of the
+        fields' text by createSchedule.FIELDS name and problems a list of
+        what couldn't be parsed
+    """
+    values = {}
+    problems = []
+    for number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line:
+            continue
+        if line == '/':
+            yield values, problems
+            values = {}
+            problems = []
+            continue
+        key, equals, value = line.partition('=')
+        key = key.strip().upper()
+        if not equals:
+            problems.append("line %d is not KEY = value" % number)
+            continue
+        if key not in FIELD_OF_KEY:
+            problems.append("unknown key " + key)
+            continue
+        value = value.strip()
+        if len(value) >= 2 and value[0] == value[-1] == "'":
+            value = value[1:-1]
+        field = FIELD_OF_KEY[key]
+        if field in values:
+            problems.append(key + " given twice")
+        values[field] = value
+    if values or problems:
+        problems.append("no '/' after the last schedule")
+        yield values, problems
+
+# Returns a number from text, NaN if the text is missing or isn't a number
+def _number(text):
+    try:
+        return float(text)
+    except (TypeError, ValueError):
+        return np.nan
+
+# Returns 'dd:mm:ss.s' or decimal text as a number, NaN if it isn't either
+def parseAngle(text):
+    text = str(text).strip()
+    sign = -1.0 if text.startswith('-') else 1.0
+    try:
+        parts = [float(part) for part in text.lstrip('+-').split(':')]
+    except ValueError:
+        return np.nan
+    if (len(parts) > 3 or not np.all(np.isfinite(parts))
+            or min(parts) < 0 or max(parts[1:], default=0.0) >= 60.0):
+        return np.nan
+    return sign*sum(part/60.0**i for i, part in enumerate(parts))
+
+def checkSchedule(values):
+    """
+    Finds the problems of one schedule's values
+    Returns:
+        ra (hours), dec (deg), lst (hours of LSTSTART), NaN where missing or
+        invalid, and the list of problems
+    """
+    problems = ["missing " + KEYS[field] for field in REQUIRED
+                if field not in values]
+    ra = parseAngle(values.get('ra', 'nan'))
+    dec = parseAngle(values.get('dec', 'nan'))
+    lst = parseAngle(values.get('lststart', 'nan'))
+    if 'ra' in values and not 0.0 <= ra < 24.0:
+        problems.append("RA '%s' is not hours from 0 to 24" % values['ra'])
+        ra = np.nan
+    if 'dec' in values and not -90.0 <= dec <= 90.0:
+        problems.append("DEC '%s' is not degrees from -90 to 90"
+                        % values['dec'])
+        dec = np.nan
+    if 'lststart' in values and not 0.0 <= lst < 24.0:
+        problems.append("LSTSTART '%s' is not a time of day"
+                        % values['lststart'])
+        lst = np.nan
+
+    filters = values.get('filters', '').split(',')
+    durations = values.get('duration', '').split(',')
+    if 'filters' in values and 'duration' in values:
+        if len(filters) != len(durations):
+            problems.append("%d filters but %d durations"
+                            % (len(filters), len(durations)))
+    if 'filters' in values:
+        unknown = [f for f in filters if f not in VALID_FILTERS]
+        if unknown:
+            problems.append("unknown filters " + ','.join(unknown))
+    if 'duration' in values:
+        if not all(_number(d) > 0 for d in durations):
+            problems.append("DURATION '%s' is not positive seconds"
+                            % values['duration'])
+    for field in ('priority', 'compress', 'repeat'):
+        if field in values and not values[field].lstrip('+-').isdigit():
+            problems.append("%s '%s' is not a whole number"
+                            % (KEYS[field], values[field]))
+    if 'epoch' in values and np.isnan(_number(values['epoch'])):
+        problems.append("EPOCH '%s' is not a year" % values['epoch'])
+    return ra, dec, lst, problems
+
+def readSchedules(path):
+    """
+    Returns the list of records of the schedules in one file, each a
+    dictionary of 'block' (position in the file), 'values', 'ra', 'dec',
+    'lst' (None where missing or invalid) and 'problems'
+    """
+    records = []
+    with open(path, errors='replace') as file:
+        for block, (values, problems) in enumerate(iterSchedules(file)):
+            ra, dec, lst, found = checkSchedule(values)
+            records.append({'block': block, 'values': values,
+                            'ra': None if np.isnan(ra) else ra,
+                            'dec': None if np.isnan(dec) else dec,
+                            'lst': None if np.isnan(lst) else lst,
+                            'problems': problems + found})
+    return records
+
+def positionProblems(sources, ra, dec, catalog=None):
+    """
+    Finds schedules whose position is more than MAX_OFFSET from the catalog
+    position of their source
+    Recieves:
+        sources  -  Source names of the schedules
+        ra, dec  -  Arrays of their RA (hours) and Dec (deg), NaN if missing
+        catalog  -  StarCatalog to check against, default the shared one
+
+    Returns:
+        List of the problems of each schedule, empty where its source isn't
+        in the catalog or it has no position
+    """
+    if catalog is None:
+        catalog = getCatalog()
+    from skyIndex import separation
+    ra = np.asarray(ra, dtype=float)
+    dec = np.asarray(dec, dtype=float)
+    rows = catalog.findAll(sources)
+    known = np.flatnonzero((rows >= 0) & np.isfinite(ra) & np.isfinite(dec))
+    offset = np.zeros(len(rows))
+    offset[known] = separation(ra[known]*15.0, dec[known],
+                               catalog.ra[rows[known]],
+                               catalog.dec[rows[known]])
+    return [["RA, DEC are %.2f deg from the catalog position of %s"
+             % (offset[i], source)] if offset[i] > MAX_OFFSET else []
+            for i, source in enumerate(sources)]
+
+def checkFile(path, catalog=None):
+    """
+    Returns the problems of every schedule in one file, as a single list:
+    those of checkSchedule plus positions away from the catalog
+    """
+    records = readSchedules(path)
+    sources = [record['values'].get('source', '') for record in records]
+    offsets = positionProblems(sources,
+                               [_number(record['ra']) for record in records],
+                               [_number(record['dec']) for record in records],
+                               catalog)
+    return [problem for record, found in zip(records, offsets)
+            for problem in record['problems'] + found]
+
+class ScheduleLibrary:
+    """
+    Index of the schedule files in a directory.  hits and misses count files
+    whose index entries were reused and files that were parsed.
+    """
+
+    def __init__(self, directory, indexFile=None):
+        self.directory = os.path.abspath(directory)
+        if indexFile is None:
+            indexFile = os.path.join(CACHE_DIR, 'schedules_'
+                                     + contentName(self.directory, '.json'))
+        self.indexFile = indexFile
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.files = self._load()
+        self._table = None
+
+    def __len__(self):
+        return len(self.table()['file'])
+
+    def _load(self):
+        try:
+            with open(self.indexFile) as file:
+                return json.load(file)['files']
+        except (OSError, ValueError, KeyError):
+            return {}
+
+    def save(self):
+        directory = os.path.dirname(self.indexFile)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with fileLock(self.indexFile):
+            with atomicWrite(self.indexFile) as file:
+                json.dump({'directory': self.directory, 'files': self.files},
+                          file)
+
+    def refresh(self):
+        """
+        Brings the index up to date with the directory, parsing only the
+        files added or changed since, and saves it if anything changed
+        """
+        with self._lock:
+            files = {}
+            changed = False
+            try:
+                entries = list(os.scandir(self.directory))
+            except FileNotFoundError:
+                entries = []
+            for entry in entries:
+                if not entry.name.endswith('.sch') or not entry.is_file():
+                    continue
+                stat = entry.stat()
+                stamp = [stat.st_mtime_ns, stat.st_size]
+                known = self.files.get(entry.name)
+                if known is not None and known['stamp'] == stamp:
+                    files[entry.name] = known
+                    self.hits += 1
+                    continue
+                try:
+                    records = readSchedules(entry.path)
+                except OSError:
+                    continue
+                files[entry.name] = {'stamp': stamp, 'records': records}
+                self.misses += 1
+                changed = True
+            changed |= set(files) != set(self.files)
+            self.files = files
+            if changed:
+                self._table = None
+                try:
+                    self.save()
+                except OSError:
+                    print("Could not save the schedule index to "
+                          + self.indexFile)
+        return self
+
+    def table(self):
+        """
+        Returns the index as columns, one entry per schedule sorted by file
+        name: 'file', 'record', 'source' (normalized), 'filters', 'ra'
+        (hours), 'dec', 'lst' (NaN where missing) and 'sky', a SkyIndex of
+        the schedules with a position
+        """
+        with self._lock:
+            if self._table is not None:
+                return self._table
+            from skyIndex import SkyIndex
+            names = sorted(self.files)
+            records = [(name, record) for name in names
+                       for record in self.files[name]['records']]
+            ra = np.array([_number(r['ra']) for n, r in records], dtype=float)
+            dec = np.array([_number(r['dec']) for n, r in records], dtype=float)
+            placed = np.flatnonzero(np.isfinite(ra) & np.isfinite(dec))
+            self._table = {
+                'file': np.array([n for n, r in records], dtype=object),
+                'record': [r for n, r in records],
+                'source': np.array([normalizeName(r['values'].get('source', ''))
+                                    for n, r in records], dtype=object),
+                'filters': np.array([r['values'].get('filters', '')
+                                     for n, r in records], dtype=object),
+                'ra': ra,
+                'dec': dec,
+                'lst': np.array([_number(r['lst']) for n, r in records],
+                                dtype=float),
+                'placed': placed,
+                'sky': SkyIndex(ra[placed]*15.0, dec[placed])}
+            return self._table
+
+    def query(self, source=None, filters=None, near=None, radius=1.0,
+              lstRange=None, invalid=None, catalog=None):
+        """
+        Finds schedules, every criterion given must hold
+        Recieves:
+            source    -  Part of the source name, any case and spacing
+            filters   -  Comma separated filters the schedule must all have
+            near      -  (ra, dec) in degrees, with radius (deg)
+            lstRange  -  (start, stop) hours the LST start must be within,
+                         across midnight if stop < start
+            invalid   -  True for only schedules with problems, False for
+                         only those without
+            catalog   -  StarCatalog validate checks positions against
+
+        Returns:
+            List of records with their 'file' added, in file order
+        """
+        table = self.table()
+        keep = np.ones(len(table['file']), dtype=bool)
+        if source:
+            part = normalizeName(source).replace(' ', '')
+            keep &= np.array([part in name.replace(' ', '')
+                              for name in table['source']], dtype=bool)
+        if filters:
+            wanted = set(f for f in filters.split(',') if f)
+            keep &= np.array([wanted.issubset(have.split(','))
+                              for have in table['filters']], dtype=bool)
+        if near is not None:
+            inside = np.zeros(len(keep), dtype=bool)
+            inside[table['placed'][table['sky'].cone(near[0], near[1],
+                                                     radius)]] = True
+            keep &= inside
+        if lstRange is not None:
+            start, stop = lstRange
+            lst = table['lst']
+            with np.errstate(invalid='ignore'):
+                if start <= stop:
+                    keep &= (lst >= start) & (lst <= stop)
+                else:
+                    keep &= (lst >= start) | (lst <= stop)
+        problems = None
+        if invalid is not None:
+            problems = self.validate(catalog)
+            bad = np.array([bool(p) for p in problems], dtype=bool)
+            keep &= bad if invalid else ~bad
+        rows = np.flatnonzero(keep)
+        if problems is None and len(rows) > 0:
+            problems = self.validate(catalog)
+        return [dict(table['record'][i], file=table['file'][i],
+                     problems=problems[i]) for i in rows]
+
+    def validate(self, catalog=None):
+        """
+        Returns the problems of every schedule in table order, those found
+        when its file was parsed plus a position more than MAX_OFFSET from
+        the catalog position of its source
+        """
+        table = self.table()
+        sources = [record['values'].get('source', '')
+                   for record in table['record']]
+        offsets = positionProblems(sources, table['ra'], table['dec'],
+                                   catalog)
+        return [record['problems'] + found
+                for record, found in zip(table['record'], offsets)]
+
+    def duplicates(self):
+        """
+        Returns lists of the files holding the same schedule, every field
+        equal, for schedules saved more than once
+        """
+        table = self.table()
+        groups = {}
+        for name, record in zip(table['file'], table['record']):
+            key = tuple(record['values'].get(field) for field in FIELDS)
+            groups.setdefault(key, []).append(name)
+        return [files for files in groups.values() if len(files) > 1]
+
+def main():
+    """
+    Program to list, search and check the schedule files in a directory
+    """
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument('directory', nargs='?', default='./app/static/schedules')
+    parser.add_argument('--source', help='part of the source name')
+    parser.add_argument('--filters', help='filters the schedules must have')
+    parser.add_argument('--lst', metavar='START-STOP',
+                        help='LST start between two times, e.g. 20:00-02:00')
+    parser.add_argument('--invalid', action='store_true',
+                        help='only schedules with problems')
+    parser.add_argument('--duplicates', action='store_true',
+                        help='list files holding the same schedule')
+    args = parser.parse_args()
+
+    library = ScheduleLibrary(args.directory).refresh()
+    if args.duplicates:
+        for files in library.duplicates():
+            print("Same schedule: " + ', '.join(files))
+        return
+    lstRange = None
+    if args.lst:
+        lstRange = tuple(parseAngle(t) for t in args.lst.split('-', 1))
+    records = library.query(args.source, args.filters, lstRange=lstRange,
+                            invalid=True if args.invalid else None)
+    for record in records:
+        values = record['values']
+        print("%-28s %-12s %-12s %-12s %-10s %s"
+              % (record['file'], values.get('source'), values.get('ra'),
+                 values.get('dec'), values.get('lststart'),
+                 values.get('filters')))
+        for problem in record['problems']:
+            print("    " + problem)
+    print(len(records), "of", len(library), "schedules")
+
+if __name__ == '__main__':
+    main()
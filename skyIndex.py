@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+This program builds a spatial index over star positions so that cone
+searches, declination band cuts and nearest neighbour lookups don't need to
+scan the whole catalog.
+
+The index is a zone index: the sky is cut into declination zones of equal
+height and the stars in each zone are sorted by right ascension.  A cone search
+only looks at the zones its declination range touches and, inside each one, at
+the RA range the cone can reach, found by binary search.  Candidates are then
+checked exactly with the haversine separation.
+"""
+
+import numpy as np
+
+# Returns the angular separation (deg) between positions in degrees
+def separation(ra1, dec1, ra2, dec2):
+    # Haversine formula, accurate for small separations too
+    ra1, dec1, ra2, dec2 = map(np.radians, (ra1, dec1, ra2, dec2))
+    a = (np.sin((dec2 - dec1)/2.0)**2
+         + np.cos(dec1)*np.cos(dec2)*np.sin((ra2 - ra1)/2.0)**2)
+    return np.degrees(2.0*np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0))))
+
+# Returns the declination band (deg) of stars that reach minAltitude at some
+# point of the day at a site at latitude, ignoring refraction
+def riseBand(latitude, minAltitude=0.0):
+    reach = 90.0 - minAltitude
+    return max(-90.0, latitude - reach), min(90.0, latitude + reach)
+
+class SkyIndex:
+    """
+    Zone index over positions ra, dec (deg).  Query results are indices into
+    the arrays the index was built from, in increasing order.
+    """
+
+    def __init__(self, ra, dec, zoneHeight=1.0):
+        self.ra = np.mod(np.asarray(ra, dtype=float), 360.0)
+        self.dec = np.asarray(dec, dtype=float)
+        self.zoneHeight = zoneHeight
+        self.nZones = int(np.ceil(180.0/zoneHeight))
+
+        # Stars ordered by zone then RA, with where each zone starts
+        zone = self._zone(self.dec)
+        self._order = np.lexsort((self.ra, zone))
+        self._zoneRA = self.ra[self._order]
+        self._zoneStart = np.searchsorted(zone[self._order],
+                                          np.arange(self.nZones + 1))
+
+        # Stars ordered by declination, for band queries
+        self._decOrder = np.argsort(self.dec, kind='stable')
+        self._sortedDec = self.dec[self._decOrder]
+
+    def __len__(self):
+        return len(self.ra)
+
+    def _zone(self, dec):
+        zone = np.floor((np.asarray(dec) + 90.0)/self.zoneHeight).astype(int)
+        return np.clip(zone, 0, self.nZones - 1)
+
+    def band(self, decMin, decMax):
+        """
+        Returns the indices of stars with decMin <= dec <= decMax
+        """
+        lo = np.searchsorted(self._sortedDec, decMin, side='left')
+        hi = np.searchsorted(self._sortedDec, decMax, side='right')
+        return np.sort(self._decOrder[lo:hi])
+
+    def cone(self, ra, dec, radius):
+        """
+        Returns the indices of stars within radius (deg) of ra, dec (deg)
+        """
+        ra = float(np.mod(ra, 360.0))
+        candidates = []
+        for zone in range(self._zone(dec - radius), self._zone(dec + radius) + 1):
+            start, stop = self._zoneStart[zone], self._zoneStart[zone + 1]
+            if start == stop:
+                continue
+
+            # Half width in RA of the cone, the whole circle near the poles
+            if abs(dec) + radius >= 90.0:
+                width = 180.0
+            else:
+                width = np.degrees(np.arcsin(min(1.0,
+                    np.sin(np.radians(radius))/np.cos(np.radians(dec)))))
+            if width >= 180.0:
+                candidates.append(self._order[start:stop])
+                continue
+
+            zoneRA = self._zoneRA[start:stop]
+            for lo, hi in self._raRanges(ra - width, ra + width):
+                i = np.searchsorted(zoneRA, lo, side='left')
+                j = np.searchsorted(zoneRA, hi, side='right')
+                candidates.append(self._order[start + i:start + j])
+
+        if not candidates:
+            return np.array([], dtype=int)
+        candidates = np.unique(np.concatenate(candidates))
+        inside = separation(ra, dec, self.ra[candidates],
+                            self.dec[candidates]) <= radius
+        return candidates[inside]
+
+    @staticmethod
+    def _raRanges(lo, hi):
+        # Splits an RA range that wraps through 0/360 into two
+        if lo < 0.0:
+            return [(lo + 360.0, 360.0), (0.0, hi)]
+        if hi > 360.0:
+            return [(lo, 360.0), (0.0, hi - 360.0)]
+        return [(lo, hi)]
+
+    def nearest(self, ra, dec, k=1, maxRadius=180.0, exclude=None):
+        """
+        Returns the indices and separations (deg) of the k stars nearest to
+        ra, dec, closest first, looking no further than maxRadius (deg).
+        exclude is an index to leave out, e.g. the target itself.
+        """
+        # Start from the radius expected to hold k stars and widen from there
+        density = max(len(self), 1)/41253.0
+        radius = min(maxRadius,
+                     max(np.sqrt((k + 1)/(np.pi*density)), 0.01))
+        while True:
+            found = self.cone(ra, dec, radius)
+            if exclude is not None:
+                found = found[found != exclude]
+            if len(found) >= k or radius >= maxRadius:
+                break
+            radius = min(maxRadius, 2.0*radius)
+
+        sep = separation(ra, dec, self.ra[found], self.dec[found])
+        closest = np.argsort(sep, kind='stable')[:k]
+        return found[closest], sep[closest]
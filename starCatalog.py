@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+This program loads the RR Lyrae candidate catalog and the list of stars shown
+in the web app once per process and keeps them in memory.
+
+The catalog is stored column by column in numpy arrays with a dictionary
+from normalized star name to row, so looking a star up no longer depends on
+the trailing space GCVS leaves on every name.  Both files are only parsed
+again when their modification time changes and their contents differ.
+"""
+
+import hashlib
+import io
+import os
+import threading
+import numpy as np
+from instrumentation import collector, cacheCollector
+
+CATALOG_FILE = './app/static/PVMS_RR_Lyrae_Candidates.csv'
+STAR_LIST_FILE = './app/static/StarList.txt'
+
+# Catalog columns kept in memory, as attribute name: csv column
+NUMERIC_COLUMNS = {'ra': 'RA (deg)',
+                   'dec': 'DE (deg)',
+                   'maxMag': 'Max',
+                   'minMag': 'Min I',
+                   'epoch': 'Epoch',
+                   'period': 'Period'}
+TEXT_COLUMNS = {'name': 'Name',
+                'varType': 'Type'}
+
+# Columns a star's altitudes depend on, and the further columns its times of
+# maxima depend on
+VISIBILITY_COLUMNS = ('ra', 'dec')
+MAXIMA_COLUMNS = ('epoch', 'period')
+
+# Normalizes a star name so 'XX And ', 'xx  and' and 'XX And' all match
+def normalizeName(name):
+    return ' '.join(str(name).split()).upper()
+
+class StarCatalog:
+    """
+    Read only, columnar copy of the candidate catalog.
+    Every column in NUMERIC_COLUMNS and TEXT_COLUMNS is an attribute holding
+    a numpy array with one entry per star; missing numbers are NaN.
+    version is the sha1 of the file the catalog was read from.
+    """
+
+    def __init__(self, data, version=None):
+        import pandas as pd
+        df = pd.read_csv(io.BytesIO(data))
+        for attr, column in NUMERIC_COLUMNS.items():
+            values = pd.to_numeric(df[column], errors='coerce')
+            setattr(self, attr, values.to_numpy(float))
+        for attr, column in TEXT_COLUMNS.items():
+            values = df[column].fillna('').astype(str).str.strip()
+            setattr(self, attr, values.to_numpy(str))
+        self.version = version
+        self._skyIndex = None
+        self._rowKeys = {}
+        self.index = {}
+        for i, name in enumerate(self.name):
+            self.index.setdefault(normalizeName(name), i)
+
+    def __len__(self):
+        return len(self.name)
+
+    # Returns the row of a star, None if it isn't in the catalog
+    def find(self, name):
+        return self.index.get(normalizeName(name))
+
+    # Returns a dictionary of every kept column for one row
+    def row(self, i):
+        star = {attr: str(getattr(self, attr)[i]) for attr in TEXT_COLUMNS}
+        star.update({attr: float(getattr(self, attr)[i])
+                     for attr in NUMERIC_COLUMNS})
+        return star
+
+    # Returns the row dictionary of a star, None if it isn't in the catalog
+    def lookup(self, name):
+        i = self.find(name)
+        return None if i is None else self.row(i)
+
+    # Returns the spatial index over the stars' positions, built on first use
+    def skyIndex(self):
+        if self._skyIndex is None:
+            from skyIndex import SkyIndex
+            self._skyIndex = SkyIndex(self.ra, self.dec)
+        return self._skyIndex
+
+    # Returns one key (bytes) per row made from the values of the given
+    # numeric columns, equal for rows with equal values, so results can be
+    # cached by what they were computed from
+    def rowKeys(self, attrs=VISIBILITY_COLUMNS):
+        attrs = tuple(attrs)
+        if attrs not in self._rowKeys:
+            values = np.column_stack([getattr(self, attr) for attr in attrs])
+            values = np.ascontiguousarray(values, dtype=float)
+            self._rowKeys[attrs] = [row.tobytes() for row in values]
+        return self._rowKeys[attrs]
+
+    # Returns the rows of many stars, -1 for stars not in the catalog
+    def findAll(self, names):
+        return np.array([self.index.get(normalizeName(name), -1)
+                         for name in names], dtype=int)
+
+def _readStarList(data, version=None):
+    # The first line of the star list is a header, as when it was read with
+    # pandas, and blank lines are ignored
+    lines = data.decode().splitlines()[1:]
+    return [line.strip() for line in lines if line.strip()]
+
+class _FileCache:
+    """
+    Parses files with a loader and keeps the results, re-reading a file only
+    when its modification time or size changes and re-parsing it only when
+    its contents actually changed.  hits counts lookups answered without
+    parsing and misses the times a file was parsed.
+    """
+
+    def __init__(self, loader):
+        self.loader = loader
+        self._lock = threading.Lock()
+        self._entries = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, filename):
+        stat = os.stat(filename)
+        stamp = (stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            entry = self._entries.get(filename)
+            if entry is not None and entry['stamp'] == stamp:
+                self.hits += 1
+                return entry['value']
+
+            with open(filename, 'rb') as file:
+                data = file.read()
+            digest = hashlib.sha1(data).hexdigest()
+            if entry is None or entry['digest'] != digest:
+                self.misses += 1
+                entry = {'value': self.loader(data, digest), 'digest': digest}
+                self._entries[filename] = entry
+            else:
+                self.hits += 1
+            entry['stamp'] = stamp
+            return entry['value']
+
+_catalogs = _FileCache(StarCatalog)
+_starLists = _FileCache(_readStarList)
+collector(cacheCollector('catalog', _catalogs))
+collector(cacheCollector('star_list', _starLists))
+
+# Returns the in-memory candidate catalog, reloading it if the file changed
+def getCatalog(filename=CATALOG_FILE):
+    return _catalogs.get(filename)
+
+# Returns the list of star names offered in the web app
+def getStarList(filename=STAR_LIST_FILE):
+    return _starLists.get(filename)
@@ -6,160 +6,272 @@ This program selects valid RR Lyrae stars for observation on a given night
 and displays their altitude vs time graph with astronomical twilight region
 and time of maxima graphed as well.
 
-Note: Some stars do not have an epoch listed in GCVS and will break this
+Note: Some stars do not have an epoch listed in GCVS, these are reported and
+plotted without times of maxima
 
 Created on Fri Feb 12 17:38:24 2021
 
 @author: Kevin Connors
 """
 
-import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
-import matplotlib.dates as mdates
-from astropy.visualization import astropy_mpl_style, quantity_support
-from astropy.coordinates import SkyCoord, EarthLocation, AltAz
-from astropy.time import Time
-import astropy.units as u
-from astroplan import Observer
 from datetime import date
+from starCatalog import getCatalog
+from skyIndex import riseBand
+from ephemerisCache import getEphemeris, toDate
+from artifactStore import atomicWrite
+from instrumentation import timer
 
-plt.style.use(astropy_mpl_style)
-quantity_support()
-
-# =============================================================================
-# This code will enable the graphics backend QT5 to create plots that account 
-# for screen resolution settings. (notes: matplotlib default figure.dpi = 100,
-#    physical screen dpi for 1920x1080 is 166 and for 3840x2160 is 333)
-#    using 0.8 factor gives figure of  132.8 dpi and 266.4, respectively
-# Use the following to return to all matplotlib default settings:
-#     plt.style.use('default')  # resets matplotlib default settings
-# Credit to Dr. Fair of Grove City College for this code.
-# =============================================================================
-if plt.get_backend() == 'Qt5Agg':
-    import sys
-    from matplotlib.backends.qt_compat import QtWidgets
-    qApp = QtWidgets.QApplication(sys.argv)
-    plt.matplotlib.rcParams['figure.dpi'] = 0.8*qApp.desktop().physicalDpiX()
-# =============================================================================
+# astropy, astroplan and matplotlib take seconds to import, so they are only
+# imported by the functions that use them.  This keeps the web app and the
+# other programs that use this module quick to start.
+
+# Sets up matplotlib for the star selection graphic, the first time it's drawn
+def setupPlotting():
+    import matplotlib.pyplot as plt
+    from astropy.visualization import astropy_mpl_style, quantity_support
+    
+    plt.style.use(astropy_mpl_style)
+    quantity_support()
+    
+    # =========================================================================
+    # This code will enable the graphics backend QT5 to create plots that
+    # account for screen resolution settings. (notes: matplotlib default
+    #    figure.dpi = 100, physical screen dpi for 1920x1080 is 166 and for
+    #    3840x2160 is 333) using 0.8 factor gives figure of 132.8 dpi and
+    #    266.4, respectively
+    # Use the following to return to all matplotlib default settings:
+    #     plt.style.use('default')  # resets matplotlib default settings
+    # Credit to Dr. Fair of Grove City College for this code.
+    # =========================================================================
+    if plt.get_backend() == 'Qt5Agg':
+        import sys
+        from matplotlib.backends.qt_compat import QtWidgets
+        qApp = QtWidgets.QApplication(sys.argv)
+        plt.matplotlib.rcParams['figure.dpi'] = (0.8
+            *qApp.desktop().physicalDpiX())
+    # =========================================================================
+    return plt
+
+# Observatory Coordinates
+LATITUDE = 41.81250
+LONGITUDE = -80.09361
+HEIGHT = 400
+TIMEZONE = "US/Eastern"
+
+# Plot of every star's altitude written by main
+PLOT_FILE = "app/static/plot.png"
 
 # Obtains the altitude of an object at a certian location and time
 def checkAltitude(objSkyCoord, time, loc):
+    from astropy.coordinates import AltAz
     objAzAlt = objSkyCoord.transform_to(AltAz(obstime = time,
                                            location = loc))
     return objAzAlt.alt
 
+# Obtains the altitude (deg) of every object at every time with a single
+# broadcast transform, returned as an (N_objects, N_times) array
+def altitudeGrid(objSkyCoord, times, loc):
+    from astropy.coordinates import AltAz
+    frame = AltAz(obstime = times.reshape((1, -1)), location = loc)
+    objAzAlt = objSkyCoord.reshape((-1, 1)).transform_to(frame)
+    return np.asarray(objAzAlt.alt.deg)
+
+# Returns a float array of values, with NaN for anything that isn't a number
+def toNumbers(values):
+    try:
+        return np.array(values, dtype=float)
+    except (TypeError, ValueError):
+        import pandas as pd
+        numbers = pd.to_numeric(pd.Series(values), errors='coerce')
+        return numbers.to_numpy(float, copy=True)
+
+# Predicts the times of maxima (JD) of many objects between startJD and stopJD
+# (floats or arrays) without building any astropy Time objects.
+# epochs are the GCVS epochs of maximum (JD - 2400000) and periods are in days.
+# Returns the flat (starIndex, jd) pairs of every maximum, sorted by star and
+# then time, and the indices of objects with a missing epoch or period
+def predictMaxima(epochs, periods, startJD, stopJD):
+    epochs = toNumbers(epochs) + 2400000.
+    periods = toNumbers(periods)
+    
+    missing = np.flatnonzero(~np.isfinite(epochs) | ~np.isfinite(periods)
+                             | (periods <= 0))
+    valid = np.ones(len(epochs), dtype=bool)
+    valid[missing] = False
+    epochs[~valid] = 0.
+    periods[~valid] = 1.
+    
+    # First and last cycle strictly inside the window for every object
+    startJD = np.broadcast_to(np.asarray(startJD, dtype=float), epochs.shape)
+    stopJD = np.broadcast_to(np.asarray(stopJD, dtype=float), epochs.shape)
+    first = np.floor((startJD - epochs)/periods) + 1
+    last = np.ceil((stopJD - epochs)/periods) - 1
+    counts = np.where(valid, np.maximum(last - first + 1, 0), 0).astype(int)
+    
+    # Expand to one entry per maximum
+    starIndex = np.repeat(np.arange(len(epochs)), counts)
+    offsets = np.cumsum(counts) - counts
+    cycle = np.arange(counts.sum()) - np.repeat(offsets, counts)
+    jd = (epochs[starIndex]
+          + (first[starIndex] + cycle)*periods[starIndex])
+    return starIndex, jd, missing
+
 # Returns a list of times of maxima for a list of objects in a given time range
 def findTimesOfMaxima(obj, startTime, stopTime):
+    from astropy.time import Time
     objName = obj[0]
     objPD = obj[1]
     objEP = obj[2]
     
-    timesOfMax = []
+    starIndex, jd, missing = predictMaxima(objEP, objPD,
+                                           startTime.jd, stopTime.jd)
+    for i in missing:
+        print("No epoch or period for " + str(objName[i]).strip()
+              + ", skipping its times of maxima")
     
-    for i in range(0, len(objName)):  
-        timesOfMax.append([])
-        
-        tempTime = float(objEP[i]) + 2400000.
-        tempTimeAstropy = Time(objEP[i], format="jd")
-        startTimeJD = float(startTime.jd)
-        
-        period = objPD[i]
-        initialSkips = np.floor(((startTimeJD-1)-tempTime)/period)
-        tempTime += initialSkips*period
-        
-        while tempTimeAstropy < stopTime:
-            if tempTimeAstropy > startTime:
-                timesOfMax[i].append(tempTimeAstropy)
-            
-            tempTime += period
-            tempTimeAstropy = Time(tempTime, format="jd")
+    timesOfMax = [[] for i in range(0, len(objName))]
+    if len(jd) > 0:
+        for i, t in zip(starIndex, Time(jd, format="jd")):
+            timesOfMax[i].append(t)
     return timesOfMax
 
+# Returns the observatory's EarthLocation and astroplan Observer
+def observatory():
+    import astropy.units as u
+    from astropy.coordinates import EarthLocation
+    from astroplan import Observer
+    loc = EarthLocation(lat = LATITUDE*u.deg,
+                      lon = LONGITUDE*u.deg,
+                      height = HEIGHT*u.m)
+    obs = Observer(location=loc, timezone=TIMEZONE)
+    return loc, obs
+
+# Returns the start and stop (nautical twilight) of the night beginning on day,
+# which defaults to today, from the site's cached ephemeris table
+def nightWindow(obs, day=None):
+    return getEphemeris(obs).nightWindow(day)
+
+# Returns nSteps + 1 evenly spaced times from startTime to stopTime
+def nightTimes(startTime, stopTime, nSteps=15):
+    tau = (stopTime - startTime) / nSteps
+    return startTime + np.arange(nSteps + 1)*tau
+
+# Returns the highest altitude (deg) each object reaches during the night
+# beginning on day
+def maxAltitudeDuringNight(objSkyCoord, day=None, nSteps=15):
+    loc, obs = observatory()
+    startTime, stopTime = nightWindow(obs, day)
+    times = nightTimes(startTime, stopTime, nSteps)
+    return altitudeGrid(objSkyCoord, times, loc).max(axis=1)
+
+# Computes the altitude curves and maxima of every catalog star for the night
+# beginning on day (default today).  Stars that never rise are left at -90 deg.
+# Returns a dictionary with the day, the site's ephemeris row (JD), the grid
+# times (JD), the (N_stars, N_times) altitudes, the flat (starIndex, jd) maxima
+# and the rows of the stars that rise
+def nightData(day=None, nSteps=15, catalog=None):
+    from astropy.coordinates import SkyCoord
+    if catalog is None:
+        catalog = getCatalog()
+    loc, obs = observatory()
+    table = getEphemeris(obs)
+    startTime, stopTime = table.nightWindow(day)
+    times = nightTimes(startTime, stopTime, nSteps)
+    
+    rows = catalog.skyIndex().band(*riseBand(LATITUDE))
+    alt = np.full((len(catalog), len(times)), -90.0)
+    if len(rows) > 0:
+        coords = SkyCoord(catalog.ra[rows], catalog.dec[rows], unit='deg')
+        alt[rows] = altitudeGrid(coords, times, loc)
+    starIndex, jd, missing = predictMaxima(catalog.epoch, catalog.period,
+                                           startTime.jd, stopTime.jd)
+    return {'day': str(toDate(day)), 'ephemeris': table.row(day),
+            'times': times.jd, 'alt': alt, 'starIndex': starIndex, 'jd': jd,
+            'missing': missing, 'rows': rows}
+
 def main():
     
-    # Observatory Coordinates
-    lat = 41.81250
-    lng = -80.09361
-    hgt = 400
+    with timer('selectStar.imports'):
+        from astropy.coordinates import SkyCoord
+        import matplotlib.dates as mdates
+        plt = setupPlotting()
     
-    loc = EarthLocation(lat = lat*u.deg,
-                      lon = lng*u.deg,
-                      height = hgt*u.m)
-    obs = Observer(location=loc, timezone="US/Eastern")
+    loc, obs = observatory()
     
-    filename = "./app/static/PVMS_RR_Lyrae_Candidates.csv"
-    file = open(filename)
-    df = pd.read_csv(file)
-    file.close()
-    objName = df['Name'].values.tolist()
-    objRA = df['RA (deg)'].values.tolist()
-    objDE = df['DE (deg)'].values.tolist()
-    objPD = df['Period'].values.tolist()
-    objEP = df['Epoch'].values.tolist()
-    objCoord = SkyCoord(objRA, objDE, unit='deg')
-    obj = [objName, objPD, objEP]
+    # Skips stars that never rise at the observatory's latitude
+    with timer('selectStar.catalog'):
+        catalog = getCatalog()
+        rows = catalog.skyIndex().band(*riseBand(LATITUDE))
+        for name in np.delete(catalog.name, rows):
+            print(name + " never rises, skipping")
+        objName = catalog.name[rows].tolist()
+        objRA = catalog.ra[rows]
+        objDE = catalog.dec[rows]
+        objPD = catalog.period[rows]
+        objEP = catalog.epoch[rows]
+        objCoord = SkyCoord(objRA, objDE, unit='deg')
+        obj = [objName, objPD, objEP]
     
-    today = str(date.today())
-    midnightUTC = Time(today + " 23:59:59")
-    startTime = obs.twilight_evening_nautical(midnightUTC)
-    stopTime = obs.twilight_morning_nautical(midnightUTC)
+    with timer('selectStar.ephemeris'):
+        today = str(date.today())
+        startTime, stopTime = nightWindow(obs, today)
     print("Start Time:", startTime.isot)
     print("Stop Time:", stopTime.isot)
     print()
     
-    altPlot = []
-    timPlot = []
-    timesOfMax = findTimesOfMaxima(obj, startTime, stopTime)
-    
-    # Fill altPlot with empty lists to append points to
-    for i in range(0, len(objName)):
-        altPlot.append([])
+    with timer('selectStar.maxima'):
+        timesOfMax = findTimesOfMaxima(obj, startTime, stopTime)
     
     # Makes each individual altitude plot
-    nSteps = 15
-    tau = (stopTime - startTime) / nSteps
-    
-    for i in range(0, nSteps + 1):
-        time = startTime + i*tau
-        for j in range(0, len(objName)):
-            altPlot[j].append(checkAltitude(objCoord[j], time, loc)/u.deg)
-        timPlot.append(mdates.date2num(time.datetime))
+    with timer('selectStar.altitudes'):
+        times = nightTimes(startTime, stopTime)
+        altPlot = altitudeGrid(objCoord, times, loc)
+        timPlot = mdates.date2num(times.datetime)
     
     # Creates figure with altitude plots and informative lines
-    figSize = int(np.ceil(np.sqrt(len(objName))))
-    fig, axis = plt.subplots(figSize, figSize, figsize=(10,8))
-    
-    for i in range(figSize):
-        for j in range(figSize):
-            curObj = i*figSize + j
-            if (curObj < len(objName)):
-                # Set the title of each plot
-                axis[i,j].set_title(objName[curObj], fontsize="12")
-                
-                # Displays horizontal altitude lines for ~0, 25, and 90 degrees
-                axis[i,j].axhline(0, linewidth=1, color="black")
-                axis[i,j].axhline(25, linewidth=1, color="black", linestyle='--')
-                axis[i,j].axhline(90, linewidth=1, color="black")
-                
-                # Displays vertical line for each maximum and prints to console
-                for k in range(len(timesOfMax[curObj])):
-                    timeOfMax = mdates.date2num(timesOfMax[curObj][k].datetime)
-                    print(objName[curObj], timesOfMax[curObj][k].isot)
-                    axis[i,j].axvline(timeOfMax, color="dodgerblue")
+    with timer('selectStar.draw'):
+        figSize = int(np.ceil(np.sqrt(len(objName))))
+        fig, axis = plt.subplots(figSize, figSize, figsize=(10,8))
+        
+        for i in range(figSize):
+            for j in range(figSize):
+                curObj = i*figSize + j
+                if (curObj < len(objName)):
+                    # Set the title of each plot
+                    axis[i,j].set_title(objName[curObj], fontsize="12")
+                    
+                    # Displays horizontal altitude lines for ~0, 25, and 90
+                    # degrees
+                    axis[i,j].axhline(0, linewidth=1, color="black")
+                    axis[i,j].axhline(25, linewidth=1, color="black",
+                                      linestyle='--')
+                    axis[i,j].axhline(90, linewidth=1, color="black")
+                    
+                    # Displays vertical line for each maximum and prints to
+                    # console
+                    for k in range(len(timesOfMax[curObj])):
+                        timeOfMax = mdates.date2num(
+                            timesOfMax[curObj][k].datetime)
+                        print(objName[curObj], timesOfMax[curObj][k].isot)
+                        axis[i,j].axvline(timeOfMax, color="dodgerblue")
+                    
+                    # Displayes altitude plot over the course of the night
+                    axis[i,j].plot(timPlot, altPlot[curObj], color='indigo', 
+                                   label='Altitude')
+                    axis[i,j].set_ylim(-2, 91)
                 
-                # Displayes altitude plot over the course of the night
-                axis[i,j].plot(timPlot, altPlot[curObj], color='indigo', 
-                               label='Altitude')
-                axis[i,j].set_ylim(-2, 91)
-            
-            axis[i,j].axis('off')
-    
-    fig.suptitle("The Night of " + today, fontsize="15")
-    fig.tight_layout()
-    fig.subplots_adjust(wspace = 0.5, hspace = 1)
-    plt.close(fig)
-    fig.savefig("app/static/plot.png")
+                axis[i,j].axis('off')
+        
+        fig.suptitle("The Night of " + today, fontsize="15")
+        fig.tight_layout()
+        fig.subplots_adjust(wspace = 0.5, hspace = 1)
+        plt.close(fig)
+    # Written whole and renamed into place, so other processes never serve
+    # a half-written plot
+    with timer('selectStar.save'):
+        with atomicWrite(PLOT_FILE, binary=True) as file:
+            fig.savefig(file, format='png')
     return 1
 
 if __name__ == "__main__":
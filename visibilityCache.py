@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+This program keeps the altitude curves of the catalog stars for the current
+night in memory star by star, so that when the catalog is edited only the
+stars that were added or changed are computed again.
+
+Each star's curve is stored under the values of its catalog row it depends
+on (RA and Dec, see StarCatalog.rowKeys), so editing a star's epoch or
+period doesn't compute it again, and the whole cache under the night, the
+site and the number of grid steps, so a new night empties it.  nightData
+returns the same dictionary as starSelectGraphic.nightData, put back
+together from the stored curves.  Times of maxima are not stored:
+predictMaxima finds them for the whole catalog at once in closed form,
+faster than they could be looked up.
+"""
+
+import threading
+import numpy as np
+from ephemerisCache import getEphemeris, toDate
+from instrumentation import collector
+from skyIndex import riseBand
+from starCatalog import getCatalog
+
+class VisibilityCache:
+    """
+    Altitude curves of stars for one night, by catalog row key.  hits and
+    misses count stars whose curves were reused and computed.
+    """
+
+    def __init__(self, nSteps=15):
+        self.nSteps = nSteps
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self._clear()
+
+    def __len__(self):
+        return len(self._slots)
+
+    def _clear(self):
+        self.night = None
+        self._slots = {}
+        self._alt = np.empty((0, self.nSteps + 1))
+
+    def reset(self):
+        # Forgets every stored curve
+        with self._lock:
+            self._clear()
+
+    def _store(self, keys, alt):
+        # Adds the curves of new keys
+        start = len(self._alt)
+        self._alt = np.concatenate([self._alt, alt])
+        for i, key in enumerate(keys):
+            self._slots[key] = start + i
+
+    def _prune(self, keys):
+        # Drops the curves of stars no longer in the catalog once they make
+        # up more than half of the cache
+        if len(self._slots) <= 2*len(keys):
+            return
+        keys = list(dict.fromkeys(keys))
+        slots = [self._slots[key] for key in keys]
+        self._alt = self._alt[slots]
+        self._slots = {key: i for i, key in enumerate(keys)}
+
+    def nightData(self, day=None, catalog=None):
+        """
+        Returns the altitude curves and maxima of every catalog star for the
+        night beginning on day (default tonight), as
+        starSelectGraphic.nightData, computing only the curves of stars not
+        stored yet
+        """
+        from astropy.coordinates import SkyCoord
+        from starSelectGraphic import (observatory, nightTimes, altitudeGrid,
+                                       predictMaxima, LATITUDE, LONGITUDE,
+                                       HEIGHT)
+        if catalog is None:
+            catalog = getCatalog()
+        loc, obs = observatory()
+        table = getEphemeris(obs)
+        startTime, stopTime = table.nightWindow(day)
+        times = nightTimes(startTime, stopTime, self.nSteps)
+        night = (str(toDate(day)), LATITUDE, LONGITUDE, HEIGHT)
+
+        rows = catalog.skyIndex().band(*riseBand(LATITUDE))
+        keys = catalog.rowKeys()
+        rowKeys = [keys[row] for row in rows]
+        with self._lock:
+            if night != self.night:
+                self._clear()
+                self.night = night
+
+            # One computation per new key, even if several rows share it
+            new = {}
+            for row, key in zip(rows, rowKeys):
+                if key not in self._slots:
+                    new.setdefault(key, row)
+            self.misses += len(new)
+            self.hits += len(rows) - len(new)
+            if new:
+                newRows = np.fromiter(new.values(), dtype=int, count=len(new))
+                coords = SkyCoord(catalog.ra[newRows], catalog.dec[newRows],
+                                  unit='deg')
+                self._store(list(new), altitudeGrid(coords, times, loc))
+
+            alt = np.full((len(catalog), len(times)), -90.0)
+            if len(rows) > 0:
+                alt[rows] = self._alt[[self._slots[key] for key in rowKeys]]
+            self._prune(rowKeys)
+
+        starIndex, jd, missing = predictMaxima(catalog.epoch, catalog.period,
+                                               startTime.jd, stopTime.jd)
+        return {'day': night[0], 'ephemeris': table.row(day),
+                'times': times.jd, 'alt': alt, 'starIndex': starIndex,
+                'jd': jd, 'missing': missing, 'rows': rows}
+
+_caches = {}
+_cachesLock = threading.Lock()
+
+# Returns the shared cache of curves with nSteps grid steps
+def getVisibilityCache(nSteps=15):
+    with _cachesLock:
+        if nSteps not in _caches:
+            _caches[nSteps] = VisibilityCache(nSteps)
+        return _caches[nSteps]
+
+@collector
+def _collectCaches():
+    # Stars whose curves were reused and computed, for the metrics page
+    with _cachesLock:
+        caches = list(_caches.values())
+    return [('cache_hits_total', 'counter', {'cache': 'star_visibility'},
+             sum(cache.hits for cache in caches)),
+            ('cache_misses_total', 'counter', {'cache': 'star_visibility'},
+             sum(cache.misses for cache in caches))]
@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+This program computes the altitude curves and predicted times of maxima of
+every catalog star for many nights at many sites in one call, so a whole
+observing campaign can be planned at once instead of night by night.
+
+Each (site, night) pair is an independent job, and the jobs are spread over a
+pool of processes.  The results are stacked into arrays indexed
+[site, night, star, time], with altitudes stored as float32.
+"""
+
+import argparse
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+import numpy as np
+from ephemerisCache import toDate
+from starCatalog import getCatalog
+from starSelectGraphic import LATITUDE, LONGITUDE, HEIGHT, TIMEZONE
+
+Site = namedtuple('Site', ['name', 'lat', 'lon', 'height', 'timezone'])
+
+# The observatory used everywhere else in the project
+DEFAULT_SITE = Site('Observatory', LATITUDE, LONGITUDE, HEIGHT, TIMEZONE)
+
+# Returns the EarthLocation and astroplan Observer of a Site
+def siteObserver(site):
+    import astropy.units as u
+    from astropy.coordinates import EarthLocation
+    from astroplan import Observer
+    loc = EarthLocation(lat = site.lat*u.deg,
+                        lon = site.lon*u.deg,
+                        height = site.height*u.m)
+    return loc, Observer(location=loc, timezone=site.timezone)
+
+# Returns every date from start to stop, inclusive
+def dateRange(start, stop):
+    start, stop = toDate(start), toDate(stop)
+    return [start + timedelta(days=i) for i in range((stop - start).days + 1)]
+
+def nightJob(site, day, ra, dec, epochs, periods, nSteps):
+    """
+    Computes one night at one site
+    Returns the night's (start, stop) JD, the grid times (JD), the
+    (N_stars, N_times) float32 altitudes and the star index and JD of every
+    predicted maximum
+    """
+    from astropy.coordinates import SkyCoord
+    from ephemerisCache import getEphemeris
+    from starSelectGraphic import altitudeGrid, nightTimes, predictMaxima
+
+    loc, obs = siteObserver(site)
+    startTime, stopTime = getEphemeris(obs).nightWindow(day)
+    times = nightTimes(startTime, stopTime, nSteps)
+    alt = altitudeGrid(SkyCoord(ra, dec, unit='deg'), times, loc)
+    starIndex, jd, missing = predictMaxima(epochs, periods,
+                                           startTime.jd, stopTime.jd)
+    return ((startTime.jd, stopTime.jd), times.jd, alt.astype(np.float32),
+            starIndex.astype(np.int32), jd)
+
+class VisibilityResult:
+    """
+    Stacked results of computeVisibility
+        sites     -  list of Site, length N_sites
+        days      -  list of datetime.date, length N_nights
+        window    -  (N_sites, N_nights, 2) night start and stop (JD)
+        times     -  (N_sites, N_nights, N_times) grid times (JD)
+        altitude  -  (N_sites, N_nights, N_stars, N_times) float32 (deg)
+        maxima    -  flat structured array with fields site, night, star
+                     and jd, one entry per predicted maximum
+    """
+
+    def __init__(self, sites, days, window, times, altitude, maxima):
+        self.sites = sites
+        self.days = days
+        self.window = window
+        self.times = times
+        self.altitude = altitude
+        self.maxima = maxima
+
+    # Returns the star indices and JDs of the maxima of one site and night
+    def maximaOf(self, site, night):
+        chosen = self.maxima[(self.maxima['site'] == site)
+                             & (self.maxima['night'] == night)]
+        return chosen['star'], chosen['jd']
+
+    # Returns (N_sites, N_nights, N_stars) highest altitude during each night
+    def maxAltitude(self):
+        return self.altitude.max(axis=-1)
+
+MAXIMA_DTYPE = np.dtype([('site', np.int16), ('night', np.int32),
+                         ('star', np.int32), ('jd', np.float64)])
+
+def computeVisibility(days, sites=None, catalog=None, nSteps=15, workers=None):
+    """
+    Computes altitude curves and times of maxima of every catalog star
+    Recieves:
+        days     -  list of dates (date or 'YYYY-MM-DD'), see dateRange
+        sites    -  list of Site, defaults to [DEFAULT_SITE]
+        catalog  -  StarCatalog, defaults to getCatalog()
+        nSteps   -  Number of steps the night is divided into
+        workers  -  Number of processes, 1 computes everything in this one
+
+    Returns:
+        VisibilityResult
+    """
+    if sites is None:
+        sites = [DEFAULT_SITE]
+    if catalog is None:
+        catalog = getCatalog()
+    days = [toDate(day) for day in days]
+    jobs = [(s, d) for s in range(len(sites)) for d in range(len(days))]
+    args = [(sites[s], days[d], catalog.ra, catalog.dec, catalog.epoch,
+             catalog.period, nSteps) for s, d in jobs]
+
+    if workers == 1 or len(jobs) == 1:
+        results = [nightJob(*arg) for arg in args]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(nightJob, *zip(*args)))
+
+    nSites, nNights = len(sites), len(days)
+    window = np.empty((nSites, nNights, 2))
+    times = np.empty((nSites, nNights, nSteps + 1))
+    altitude = np.empty((nSites, nNights, len(catalog), nSteps + 1),
+                        dtype=np.float32)
+    maxima = []
+    for (s, d), (night, grid, alt, starIndex, jd) in zip(jobs, results):
+        window[s, d] = night
+        times[s, d] = grid
+        altitude[s, d] = alt
+        found = np.empty(len(jd), dtype=MAXIMA_DTYPE)
+        found['site'] = s
+        found['night'] = d
+        found['star'] = starIndex
+        found['jd'] = jd
+        maxima.append(found)
+    maxima = (np.concatenate(maxima) if maxima
+              else np.empty(0, dtype=MAXIMA_DTYPE))
+    return VisibilityResult(sites, days, window, times, altitude, maxima)
+
+def main():
+    """
+    Program to compute catalog visibility over a range of nights
+    """
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument('start', help='first night, YYYY-MM-DD')
+    parser.add_argument('stop', help='last night, YYYY-MM-DD')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--steps', type=int, default=15)
+    parser.add_argument('--min-altitude', type=float, default=25.0)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    result = computeVisibility(dateRange(args.start, args.stop),
+                               nSteps=args.steps, workers=args.workers)
+    print("Computed %d nights in %.1f s" % (len(result.days),
+                                            time.perf_counter() - start))
+
+    names = getCatalog().name
+    visible = result.maxAltitude()[0] >= args.min_altitude
+    for d, day in enumerate(result.days):
+        stars, jd = result.maximaOf(0, d)
+        print(day, "%d stars above %g deg, %d maxima" %
+              (visible[d].sum(), args.min_altitude, len(jd)))
+    print("Nights each star is above %g deg:" % args.min_altitude)
+    for name, nights in zip(names, visible.sum(axis=0)):
+        print("  %-10s %d" % (name, nights))
+
+if __name__ == '__main__':
+    main()